@@ -0,0 +1,127 @@
+# Copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import argparse
+import threading
+import numpy as np
+import deploy
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model_dir",
+        "-m",
+        type=str,
+        default=None,
+        help="path to openvino model .xml file")
+    parser.add_argument(
+        "--cfg_file",
+        "-c",
+        type=str,
+        default=None,
+        help="Path to PaddelX model yml file")
+    parser.add_argument(
+        "--device",
+        "-d",
+        type=str,
+        default='CPU',
+        help="Specify the target device to infer on:[CPU, GPU, FPGA, HDDL, MYRIAD,HETERO]"
+        "Default value is CPU")
+    parser.add_argument(
+        "--img", "-i", type=str, default=None, help="path to an image files")
+    parser.add_argument(
+        "--img_list", "-l", type=str, default=None, help="Path to a imglist")
+    parser.add_argument(
+        "--batch_size",
+        "-b",
+        type=int,
+        default=1,
+        help="number of images in each inference request")
+    parser.add_argument(
+        "--num_requests",
+        "-nr",
+        type=int,
+        default=1,
+        help="number of inference requests in flight, use async mode if > 1")
+    parser.add_argument(
+        "--iterations",
+        "-n",
+        type=int,
+        default=100,
+        help="number of batches to run")
+    parser.add_argument(
+        "--warmup", "-w", type=int, default=10, help="number of warmup batches")
+    return parser
+
+
+def main():
+    parser = arg_parser()
+    args = parser.parse_args()
+
+    predictor = deploy.Predictor(
+        args.model_dir,
+        args.cfg_file,
+        args.device,
+        batch_size=args.batch_size,
+        num_requests=args.num_requests)
+
+    if args.img_list is not None:
+        with open(args.img_list) as f:
+            images = [line.strip() for line in f if line.strip()]
+    else:
+        images = [args.img]
+    batches = list()
+    for i in range(args.iterations):
+        batch = [
+            images[(i * args.batch_size + j) % len(images)]
+            for j in range(args.batch_size)
+        ]
+        batches.append(batch)
+
+    for batch in batches[:args.warmup]:
+        predictor.batch_predict(batch)
+
+    latencies = list()
+    lock = threading.Lock()
+
+    def callback(results, start_time):
+        with lock:
+            latencies.append(time.time() - start_time)
+
+    start_time = time.time()
+    for batch in batches:
+        if args.num_requests > 1:
+            predictor.predict_async(batch, callback, userdata=time.time())
+        else:
+            batch_start_time = time.time()
+            predictor.batch_predict(batch)
+            latencies.append(time.time() - batch_start_time)
+    predictor.wait_all()
+    total_time = time.time() - start_time
+
+    num_images = args.iterations * args.batch_size
+    print("Mode: {}, batch_size: {}, num_requests: {}".format(
+        "async" if args.num_requests > 1 else "sync", args.batch_size,
+        args.num_requests))
+    print("Throughput: {:.2f} FPS".format(num_images / total_time))
+    print("Latency(ms): avg {:.2f}, p50 {:.2f}, p99 {:.2f}".format(
+        np.mean(latencies) * 1000,
+        np.percentile(latencies, 50) * 1000,
+        np.percentile(latencies, 99) * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -67,11 +67,11 @@ def main():
         lines = f.readlines()
         for im_path in lines:
             print(im_path)
-            predictor.predict(im_path.strip('\n'))
+            print(predictor.predict(im_path.strip('\n')))
         f.close()
     else:
         im_path = args.img
-        predictor.predict(im_path)
+        print(predictor.predict(im_path))
 
 
 if __name__ == "__main__":
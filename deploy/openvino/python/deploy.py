@@ -24,7 +24,21 @@ from openvino.inference_engine import IECore
 
 
 class Predictor:
-    def __init__(self, model_xml, model_yaml, device="CPU"):
+    def __init__(self,
+                 model_xml,
+                 model_yaml,
+                 device="CPU",
+                 batch_size=1,
+                 num_requests=1):
+        """ 创建OpenVINO Predictor
+
+            Args:
+                model_xml: 模型转换生成的.xml文件路径
+                model_yaml: PaddleX模型的.yml配置文件路径
+                device: 运行的平台，默认为"CPU"
+                batch_size: 每次推理的图像数量，默认为1。检测模型仅支持1
+                num_requests: 同时执行的推理请求数量，异步预测时使用，默认为1
+        """
         self.device = device
         if not osp.exists(model_xml):
             print("model xml file is not exists in {}".format(model_xml))
@@ -38,6 +52,13 @@ class Predictor:
         self.model_name = self.info['Model']
         self.num_classes = self.info['_Attributes']['num_classes']
         self.labels = self.info['_Attributes']['labels']
+        if self.model_type == "detector" and batch_size != 1:
+            # 检测模型的输出框无法按图像拆分
+            raise Exception(
+                "Only batch_size=1 is supported for detector, use num_requests to improve the throughput"
+            )
+        self.batch_size = batch_size
+        self.num_requests = num_requests
         transforms_mode = self.info.get('TransformsMode', 'RGB')
         if transforms_mode == 'RGB':
             to_rgb = True
@@ -57,12 +78,18 @@ class Predictor:
         print("Loading network files:\n\t{}\n\t{}".format(self.model_xml,
                                                           self.model_bin))
         net = ie.read_network(model=self.model_xml, weights=self.model_bin)
-        net.batch_size = 1
+        net.batch_size = self.batch_size
         network_config = {}
         if self.device == "MYRIAD":
             network_config = {'VPU_HW_STAGES_OPTIMIZATION': 'NO'}
+        elif self.device == "CPU" and self.num_requests > 1:
+            # 多个推理请求并行执行时，由OpenVINO自动划分CPU计算资源
+            network_config = {'CPU_THROUGHPUT_STREAMS': 'CPU_THROUGHPUT_AUTO'}
         exec_net = ie.load_network(
-            network=net, device_name=self.device, config=network_config)
+            network=net,
+            device_name=self.device,
+            config=network_config,
+            num_requests=self.num_requests)
         return exec_net, net
 
     def build_transforms(self, transforms_info, to_rgb=True):
@@ -106,8 +133,7 @@ class Predictor:
         else:
             eval_transforms.transforms.append(arrange_transform(mode='test'))
 
-    def raw_predict(self, preprocessed_input):
-        self.count_num += 1
+    def get_feed_dict(self, preprocessed_input):
         feed_dict = {}
         if self.model_name == "YOLOv3":
             inputs = self.net.inputs
@@ -121,47 +147,66 @@ class Predictor:
         else:
             input_blob = next(iter(self.net.inputs))
             feed_dict[input_blob] = preprocessed_input['image']
-        #Start sync inference
-        print("Starting inference in synchronous mode")
-        res = self.predictor.infer(inputs=feed_dict)
+        return feed_dict
 
-        #Processing output blob
-        print("Processing output blob")
+    def raw_predict(self, preprocessed_input):
+        self.count_num += 1
+        feed_dict = self.get_feed_dict(preprocessed_input)
+        res = self.predictor.infer(inputs=feed_dict)
         return res
 
-    def preprocess(self, image):
+    def preprocess(self, images):
+        """ 对图像做预处理，不足batch_size时以最后一张图像补齐
+
+            Args:
+                images(str|np.ndarray|list|tuple): 单张图像或图像列表，元素可以是图像路径，
+                    也可以是解码后的排列格式为（H，W，C）且为BGR格式的数组。
+        """
+        if not isinstance(images, (list, tuple)):
+            images = [images]
+        if len(images) > self.batch_size:
+            raise Exception(
+                "The number of images({}) is larger than batch_size({})".format(
+                    len(images), self.batch_size))
         res = dict()
+        res['num'] = len(images)
+        images = list(images) + [images[-1]] * (self.batch_size - len(images))
         if self.model_type == "classifier":
-            im = self.transforms(image)
-            im = np.expand_dims(im, axis=0).copy()
-            res['image'] = im
+            im = [self.transforms(image)[0] for image in images]
+            res['image'] = np.ascontiguousarray(np.stack(im, axis=0))
         elif self.model_type == "detector":
             if self.model_name == "YOLOv3":
-                im, im_shape = self.transforms(image)
+                im, im_shape = self.transforms(images[0])
                 im = np.expand_dims(im, axis=0).copy()
                 im_shape = np.expand_dims(im_shape, axis=0).copy()
                 res['image'] = im
                 res['im_size'] = im_shape
         elif self.model_type == "segmenter":
-            im, im_info = self.transforms(image)
-            im = np.expand_dims(im, axis=0).copy()
-            res['image'] = im
+            im = list()
+            im_info = list()
+            for image in images:
+                outputs = self.transforms(image)
+                im.append(outputs[0])
+                im_info.append(outputs[1])
+            res['image'] = np.ascontiguousarray(np.stack(im, axis=0))
             res['im_info'] = im_info
         return res
 
-    def classifier_postprocess(self, preds, topk=1):
+    def classifier_postprocess(self, preds, topk=1, num=1):
         """ 对分类模型的预测结果做后处理
         """
         true_topk = min(self.num_classes, topk)
         output_name = next(iter(self.net.outputs))
-        pred_label = np.argsort(-preds[output_name][0])[:true_topk]
-        result = [{
-            'category_id': l,
-            'category': self.labels[l],
-            'score': preds[output_name][0][l],
-        } for l in pred_label]
-        print(result)
-        return result
+        results = list()
+        for i in range(num):
+            scores = preds[output_name][i]
+            pred_label = np.argsort(-scores)[:true_topk]
+            results.append([{
+                'category_id': l,
+                'category': self.labels[l],
+                'score': scores[l],
+            } for l in pred_label])
+        return results
 
     def segmenter_postprocess(self, preds, preprocessed_inputs):
         """ 对语义分割结果做后处理
@@ -169,23 +214,26 @@ class Predictor:
         it = iter(self.net.outputs)
         next(it)
         label_name = next(it)
-        label_map = np.squeeze(preds[label_name]).astype('uint8')
         score_name = next(it)
-        score_map = np.squeeze(preds[score_name])
-        score_map = np.transpose(score_map, (1, 2, 0))
-
-        im_info = preprocessed_inputs['im_info']
-
-        for info in im_info[0][::-1]:
-            if info[0] == 'resize':
-                w, h = info[1][1], info[1][0]
-                label_map = cv2.resize(label_map, (w, h), cv2.INTER_NEAREST)
-                score_map = cv2.resize(score_map, (w, h), cv2.INTER_LINEAR)
-            elif info[0] == 'padding':
-                w, h = info[1][1], info[1][0]
-                label_map = label_map[0:h, 0:w]
-                score_map = score_map[0:h, 0:w, :]
-        return {'label_map': label_map, 'score_map': score_map}
+        results = list()
+        for i in range(preprocessed_inputs['num']):
+            label_map = preds[label_name][i]
+            label_map = label_map.reshape(label_map.shape[-2:]).astype(
+                'uint8')
+            score_map = np.transpose(preds[score_name][i], (1, 2, 0))
+            for info in preprocessed_inputs['im_info'][i][::-1]:
+                if info[0] == 'resize':
+                    w, h = info[1][1], info[1][0]
+                    label_map = cv2.resize(label_map, (w, h),
+                                           cv2.INTER_NEAREST)
+                    score_map = cv2.resize(score_map, (w, h),
+                                           cv2.INTER_LINEAR)
+                elif info[0] == 'padding':
+                    w, h = info[1][1], info[1][0]
+                    label_map = label_map[0:h, 0:w]
+                    score_map = score_map[0:h, 0:w, :]
+            results.append({'label_map': label_map, 'score_map': score_map})
+        return results
 
     def detector_postprocess(self, preds, preprocessed_inputs):
         """对图像检测结果做后处理
@@ -200,15 +248,75 @@ class Predictor:
                 result.append(out.tolist())
             else:
                 pass
-        return result
+        return [result]
 
-    def predict(self, image, topk=1, threshold=0.5):
-        preprocessed_input = self.preprocess(image)
-        model_pred = self.raw_predict(preprocessed_input)
+    def postprocess(self, preds, preprocessed_input, topk=1):
+        """ 对一个batch的预测结果做后处理，返回每张图像的结果组成的列表
+        """
         if self.model_type == "classifier":
-            results = self.classifier_postprocess(model_pred, topk)
+            results = self.classifier_postprocess(preds, topk,
+                                                  preprocessed_input['num'])
         elif self.model_type == "detector":
-            results = self.detector_postprocess(model_pred, preprocessed_input)
+            results = self.detector_postprocess(preds, preprocessed_input)
         elif self.model_type == "segmenter":
-            results = self.segmenter_postprocess(model_pred,
-                                                 preprocessed_input)
+            results = self.segmenter_postprocess(preds, preprocessed_input)
+        return results
+
+    def predict(self, image, topk=1, threshold=0.5):
+        preprocessed_input = self.preprocess(image)
+        model_pred = self.raw_predict(preprocessed_input)
+        results = self.postprocess(model_pred, preprocessed_input, topk)
+        return results[0]
+
+    def batch_predict(self, image_list, topk=1):
+        """ 按batch_size对图像列表进行同步预测
+
+            Args:
+                image_list(list|tuple): 图像路径或解码后的(H，W，C)BGR数组组成的列表。
+                topk(int): 分类预测时使用，表示预测前topk的结果。
+        """
+        results = list()
+        for i in range(0, len(image_list), self.batch_size):
+            preprocessed_input = self.preprocess(
+                image_list[i:i + self.batch_size])
+            model_pred = self.raw_predict(preprocessed_input)
+            results.extend(
+                self.postprocess(model_pred, preprocessed_input, topk))
+        return results
+
+    def predict_async(self, images, callback, topk=1, userdata=None):
+        """ 异步预测，最多同时执行num_requests个推理请求。当没有空闲的推理请求时，
+            等待其中一个完成后再提交。
+
+            Args:
+                images(str|np.ndarray|list|tuple): 单张图像或不超过batch_size的图像列表。
+                callback(function): 推理完成后的回调函数，调用方式为
+                    callback(results, userdata)，results为每张图像的结果组成的列表。
+                topk(int): 分类预测时使用，表示预测前topk的结果。
+                userdata: 传递给回调函数的自定义数据。
+        """
+        request_id = self.predictor.get_idle_request_id()
+        while request_id < 0:
+            self.predictor.wait(num_requests=1)
+            request_id = self.predictor.get_idle_request_id()
+        request = self.predictor.requests[request_id]
+        preprocessed_input = self.preprocess(images)
+
+        def completion_callback(status, py_data):
+            # 输出内存会被下一次推理复用，需拷贝后再做后处理
+            model_pred = {
+                name: blob.buffer.copy()
+                for name, blob in request.output_blobs.items()
+            }
+            results = self.postprocess(model_pred, preprocessed_input, topk)
+            callback(results, userdata)
+
+        self.count_num += 1
+        request.set_completion_callback(completion_callback)
+        request.async_infer(self.get_feed_dict(preprocessed_input))
+
+    def wait_all(self):
+        """ 等待所有异步推理请求完成
+        """
+        for request in self.predictor.requests:
+            request.wait()
@@ -46,6 +46,20 @@ def arg_parser():
         default=1,
         help="Path to PaddelX model yml file")
 
+    parser.add_argument(
+        "--batch_size",
+        "-b",
+        type=int,
+        default=1,
+        help="number of images in each inference")
+
+    parser.add_argument(
+        "--preprocess_workers",
+        "-pw",
+        type=int,
+        default=1,
+        help="number of processes to preprocess images while inferring")
+
     return parser
 
 
@@ -56,19 +70,28 @@ def main():
     model_yaml = args.cfg_file
     thread_num = args.thread_num
     #model init
-    predictor = deploy.Predictor(model_nb, model_yaml, thread_num)
+    predictor = deploy.Predictor(
+        model_nb,
+        model_yaml,
+        thread_num,
+        batch_size=args.batch_size,
+        preprocess_workers=args.preprocess_workers)
 
     #predict
     if (args.img_list != None):
         f = open(args.img_list)
-        lines = f.readlines()
-        for im_path in lines:
-            print(im_path)
-            predictor.predict(im_path.strip('\n'))
+        im_paths = [line.strip('\n') for line in f.readlines()]
         f.close()
+        results = predictor.predict_stream(im_paths)
+        for im_path, result in zip(im_paths, results):
+            print(im_path)
+            print(result)
     else:
         im_path = args.img
-        predictor.predict(im_path)
+        print(predictor.predict(im_path))
+    latency = predictor.get_latency()
+    print("Average latency per batch(ms): " + ", ".join(
+        "{}={:.2f}".format(k, v) for k, v in latency.items()))
 
 
 if __name__ == "__main__":
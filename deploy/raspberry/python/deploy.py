@@ -19,14 +19,43 @@ import time
 import cv2
 import numpy as np
 import yaml
+import multiprocessing as mp
+from collections import OrderedDict
 from six import text_type as _text_type
 from paddlelite.lite import *
 
 
+# 预处理子进程中使用的transforms，由_init_preprocess_worker设置
+_worker_transforms = None
+
+
+def _init_preprocess_worker(transforms):
+    global _worker_transforms
+    _worker_transforms = transforms
+
+
+def _preprocess_worker(image):
+    return _worker_transforms(image)
+
+
 class Predictor:
-    def __init__(self, model_nb, model_yaml, thread_num):
+    def __init__(self,
+                 model_nb,
+                 model_yaml,
+                 thread_num,
+                 batch_size=1,
+                 preprocess_workers=1):
+        """ 创建Paddle-Lite Predictor
+
+            Args:
+                model_nb: 模型转换生成的.nb文件路径
+                model_yaml: PaddleX模型的.yml配置文件路径
+                thread_num: 推理使用的线程数
+                batch_size: 每次推理的图像数量，默认为1。检测模型仅支持1
+                preprocess_workers: predict_stream中用于预处理的进程数，默认为1
+        """
         if not osp.exists(model_nb):
-            print("model nb file is not exists in {}".format(model_xml))
+            print("model nb file is not exists in {}".format(model_nb))
         self.model_nb = model_nb
         config = MobileConfig()
         config.set_model_from_file(model_nb)
@@ -44,6 +73,11 @@ class Predictor:
                 self.mask_head_resolution = 28
             else:
                 self.mask_head_resolution = 14
+        if self.model_type == "detector" and batch_size != 1:
+            # 检测模型的输出框无法按图像拆分
+            raise Exception("Only batch_size=1 is supported for detector")
+        self.batch_size = batch_size
+        self.preprocess_workers = preprocess_workers
         transforms_mode = self.info.get('TransformsMode', 'RGB')
         if transforms_mode == 'RGB':
             to_rgb = True
@@ -52,8 +86,7 @@ class Predictor:
         self.transforms = self.build_transforms(self.info['Transforms'],
                                                 to_rgb)
         self.predictor = create_paddle_predictor(config)
-        self.total_time = 0
-        self.count_num = 0
+        self.reset_latency()
 
     def build_transforms(self, transforms_info, to_rgb=True):
         if self.model_type == "classifier":
@@ -96,127 +129,190 @@ class Predictor:
         else:
             eval_transforms.transforms.append(arrange_transform(mode='test'))
 
+    def reset_latency(self):
+        self.count_num = 0
+        self.stage_time = OrderedDict(
+            [('preprocess', 0.), ('inference', 0.), ('postprocess', 0.)])
+
+    def get_latency(self):
+        """ 返回每个batch在预处理、推理、后处理阶段的平均耗时（单位ms）。
+            predict_stream中预处理与推理并行，preprocess为推理等待预处理结果的时间。
+        """
+        if self.count_num == 0:
+            return OrderedDict((k, 0.) for k in self.stage_time)
+        return OrderedDict((k, v * 1000 / self.count_num)
+                           for k, v in self.stage_time.items())
+
+    def set_input(self, index, data):
+        tensor = self.predictor.get_input(index)
+        if hasattr(tensor, 'from_numpy'):
+            tensor.from_numpy(data)
+        else:
+            tensor.resize(list(data.shape))
+            tensor.set_float_data(data.ravel())
+
+    def get_output(self, index):
+        tensor = self.predictor.get_output(index)
+        if hasattr(tensor, 'numpy'):
+            return tensor.numpy()
+        return np.array(tensor.float_data()).reshape(tuple(tensor.shape()))
+
     def raw_predict(self, preprocessed_input):
-        self.count_num += 1
-        input_tensor = self.predictor.get_input(0)
-        im_shape = preprocessed_input['image'].shape
-        input_tensor.resize(self.shape)
-        input_tensor.set_float_data(preprocessed_input['image'])
+        self.set_input(0, preprocessed_input['image'])
         if self.model_name == "YOLOv3":
-            input_size_tensor = self.predictor.get_input(1)
-            input_size_tensor.resize([1, 2])
-            input_size_tensor.set_float_data(preprocessed_input['im_size'])
-        #Start  inference
-        start_time = time.time()
+            self.set_input(1, preprocessed_input['im_size'])
         self.predictor.run()
-        time_use = time.time() - start_time
-        if (self.count_num >= 20):
-            self.total_time += time_use
-        if (self.count_num >= 120):
-            print("avgtime:", self.total_time * 10)
-
-        #Processing output blob
-        print("Processing output blob")
-        return
 
-    def preprocess(self, image):
+    def collate(self, samples):
+        """ 将预处理后的多张图像组织为一个batch，图像数据为连续内存，可直接拷贝至输入tensor
+        """
         res = dict()
-        if self.model_type == "classifier":
-            im, = self.transforms(image)
-            self.shape = [1] + list(im.shape)
-            im = np.expand_dims(im, axis=0).copy()
-            im = im.flatten()
-            res['image'] = im
-        elif self.model_type == "detector":
+        res['num'] = len(samples)
+        im = np.stack([sample[0] for sample in samples], axis=0)
+        res['image'] = np.ascontiguousarray(im, dtype='float32')
+        if self.model_type == "detector":
             if self.model_name == "YOLOv3":
-                im, im_shape = self.transforms(image)
-                self.shape = [1] + list(im.shape)
-                im = np.expand_dims(im, axis=0).copy()
-                im_shape = np.expand_dims(im_shape, axis=0).copy()
-                im = im.flatten()
-                im_shape = im_shape.flatten()
-                res['image'] = im
-                res['im_size'] = im_shape
+                res['im_size'] = np.ascontiguousarray(
+                    np.stack([sample[1] for sample in samples], axis=0))
             if self.model_name.count('RCNN') > 0:
-                im, im_resize_info, im_shape = self.transforms(image)
-                self.shape = [1] + list(im.shape)
-                im = np.expand_dims(im, axis=0).copy()
-                im_resize_info = np.expand_dims(im_resize_info, axis=0).copy()
-                im_shape = np.expand_dims(im_shape, axis=0).copy()
-                res['image'] = im
-                res['im_info'] = im_resize_info
-                res['im_shape'] = im_shape
+                res['im_info'] = np.stack(
+                    [sample[1] for sample in samples], axis=0)
+                res['im_shape'] = np.stack(
+                    [sample[2] for sample in samples], axis=0)
         elif self.model_type == "segmenter":
-            im, im_info = self.transforms(image)
-            self.shape = [1] + list(im.shape)
-            im = np.expand_dims(im, axis=0).copy()
-            #np.savetxt('./input_data.txt',im.flatten())
-            res['image'] = im
-            res['im_info'] = im_info
+            res['im_info'] = [sample[1] for sample in samples]
         return res
 
-    def classifier_postprocess(self, topk=1):
-        output_tensor = self.predictor.get_output(0)
-        output_data = output_tensor.float_data()
+    def preprocess(self, images):
+        """ 对图像做预处理
+
+            Args:
+                images(str|np.ndarray|list|tuple): 单张图像或图像列表，元素可以是图像路径，
+                    也可以是解码后的排列格式为（H，W，C）且为BGR格式的数组。
+        """
+        if not isinstance(images, (list, tuple)):
+            images = [images]
+        return self.collate([self.transforms(image) for image in images])
+
+    def classifier_postprocess(self, preprocessed_inputs, topk=1):
+        output_data = self.get_output(0)
         true_topk = min(self.num_classes, topk)
-        pred_label = np.argsort(-np.array(output_data))[:true_topk]
-        result = [{
-            'category_id': l,
-            'category': self.labels[l],
-            'score': output_data[l],
-        } for l in pred_label]
-        print(result)
-        return result
+        results = list()
+        for i in range(preprocessed_inputs['num']):
+            scores = output_data[i]
+            pred_label = np.argsort(-scores)[:true_topk]
+            results.append([{
+                'category_id': l,
+                'category': self.labels[l],
+                'score': scores[l],
+            } for l in pred_label])
+        return results
 
     def segmenter_postprocess(self, preprocessed_inputs):
-        out_label_tensor = self.predictor.get_output(0)
-        out_label = out_label_tensor.float_data()
-        label_shape = tuple(out_label_tensor.shape())
-        label_map = np.array(out_label).astype('uint8')
-        label_map = label_map.reshape(label_shape)
-        label_map = np.squeeze(label_map)
-
-        out_score_tensor = self.predictor.get_output(1)
-        out_score = out_score_tensor.float_data()
-        score_shape = tuple(out_score_tensor.shape())
-        score_map = np.array(out_score)
-        score_map = score_map.reshap(score_shape)
-        score_map = np.transpose(score_map, (1, 2, 0))
-
-        im_info = preprocessed_inputs['im_info']
-        for info in im_info[::-1]:
-            if info[0] == 'resize':
-                w, h = info[1][1], info[1][0]
-                label_map = cv2.resize(label_map, (w, h), cv2.INTER_NEAREST)
-                score_map = cv2.resize(score_map, (w, h), cv2.INTER_LINEAR)
-            elif info[0] == 'padding':
-                w, h = info[1][1], info[1][0]
-                label_map = label_map[0:h, 0:w]
-                score_map = score_map[0:h, 0:w, :]
-            else:
-                raise Exception("Unexpected info '{}' in im_info".format(info[
-                    0]))
-        return {'label_map': label_map, 'score_map': score_map}
+        label_maps = self.get_output(0)
+        score_maps = self.get_output(1)
+        results = list()
+        for i in range(preprocessed_inputs['num']):
+            label_map = label_maps[i]
+            label_map = label_map.reshape(label_map.shape[-2:]).astype(
+                'uint8')
+            score_map = np.transpose(score_maps[i], (1, 2, 0))
+            for info in preprocessed_inputs['im_info'][i][::-1]:
+                if info[0] == 'resize':
+                    w, h = info[1][1], info[1][0]
+                    label_map = cv2.resize(label_map, (w, h),
+                                           cv2.INTER_NEAREST)
+                    score_map = cv2.resize(score_map, (w, h),
+                                           cv2.INTER_LINEAR)
+                elif info[0] == 'padding':
+                    w, h = info[1][1], info[1][0]
+                    label_map = label_map[0:h, 0:w]
+                    score_map = score_map[0:h, 0:w, :]
+                else:
+                    raise Exception("Unexpected info '{}' in im_info".format(
+                        info[0]))
+            results.append({'label_map': label_map, 'score_map': score_map})
+        return results
 
     def detector_postprocess(self, preprocessed_inputs):
-        out_tensor = self.predictor.get_output(0)
-        out_data = out_tensor.float_data()
-        out_shape = tuple(out_tensor.shape())
-        out_data = np.array(out_data)
-        outputs = out_data.reshape(out_shape)
+        outputs = self.get_output(0)
 
         result = []
         for out in outputs:
             result.append(out.tolist())
-        #print(result)
-        return result
+        return [result]
 
-    def predict(self, image, topk=1, threshold=0.5):
-        preprocessed_input = self.preprocess(image)
-        self.raw_predict(preprocessed_input)
+    def postprocess(self, preprocessed_input, topk=1):
+        """ 对一个batch的预测结果做后处理，返回每张图像的结果组成的列表
+        """
         if self.model_type == "classifier":
-            results = self.classifier_postprocess(topk)
+            results = self.classifier_postprocess(preprocessed_input, topk)
         elif self.model_type == "detector":
             results = self.detector_postprocess(preprocessed_input)
         elif self.model_type == "segmenter":
             results = self.segmenter_postprocess(preprocessed_input)
+        return results
+
+    def _predict_batch(self, preprocessed_input, topk=1):
+        start_time = time.time()
+        self.raw_predict(preprocessed_input)
+        inference_time = time.time()
+        results = self.postprocess(preprocessed_input, topk)
+        self.stage_time['inference'] += inference_time - start_time
+        self.stage_time['postprocess'] += time.time() - inference_time
+        self.count_num += 1
+        return results
+
+    def batch_predict(self, image_list, topk=1):
+        """ 按batch_size对图像列表进行预测
+
+            Args:
+                image_list(list|tuple): 图像路径或解码后的(H，W，C)BGR数组组成的列表。
+                topk(int): 分类预测时使用，表示预测前topk的结果。
+        """
+        results = list()
+        for i in range(0, len(image_list), self.batch_size):
+            start_time = time.time()
+            preprocessed_input = self.preprocess(
+                image_list[i:i + self.batch_size])
+            self.stage_time['preprocess'] += time.time() - start_time
+            results.extend(self._predict_batch(preprocessed_input, topk))
+        return results
+
+    def predict(self, image, topk=1, threshold=0.5):
+        return self.batch_predict([image], topk)[0]
+
+    def predict_stream(self, images, topk=1):
+        """ 对图像流进行预测，在子进程中预处理后续图像的同时对当前batch进行推理，
+            按输入顺序逐张返回预测结果。
+
+            Args:
+                images(iterable): 图像路径或解码后的(H，W，C)BGR数组组成的可迭代对象，
+                    如摄像头的帧生成器。
+                topk(int): 分类预测时使用，表示预测前topk的结果。
+        """
+        pool = mp.Pool(
+            self.preprocess_workers,
+            initializer=_init_preprocess_worker,
+            initargs=(self.transforms, ))
+        try:
+            samples = list()
+            wait_start_time = time.time()
+            for sample in pool.imap(_preprocess_worker, images):
+                samples.append(sample)
+                if len(samples) < self.batch_size:
+                    continue
+                preprocessed_input = self.collate(samples)
+                self.stage_time['preprocess'] += time.time() - wait_start_time
+                for result in self._predict_batch(preprocessed_input, topk):
+                    yield result
+                samples = list()
+                wait_start_time = time.time()
+            if len(samples) > 0:
+                preprocessed_input = self.collate(samples)
+                self.stage_time['preprocess'] += time.time() - wait_start_time
+                for result in self._predict_batch(preprocessed_input, topk):
+                    yield result
+        finally:
+            pool.terminate()
+            pool.join()
@@ -19,7 +19,9 @@ import time
 import copy
 import math
 import yaml
+import contextlib
 import json
+import pickle
 import paddle
 from paddle.io import DataLoader, DistributedBatchSampler
 from paddleslim import QAT
@@ -29,12 +31,48 @@ import paddlex
 from paddlex.cv.transforms import arrange_transforms
 from paddlex.utils import (seconds_to_hms, get_single_card_bs, dict2str,
                            get_pretrain_weights, load_pretrain_weights,
-                           SmoothedValue, TrainingStats,
-                           _get_shared_memory_size_in_M, EarlyStop)
+                           SmoothedValue, TrainingStats, StepTimer,
+                           get_queue_size, _get_shared_memory_size_in_M,
+                           EarlyStop, CheckpointWriter, write_checkpoint)
 import paddlex.utils.logging as logging
 from .slim.prune import _pruner_eval_fn, _pruner_template_input, sensitive_prune
 
 
+def _snapshot_state_dict(state_dict):
+    # Copy the tensors to host memory in the format of paddle.save
+    saved_dict = dict()
+    name_table = dict()
+    for k, v in state_dict.items():
+        if isinstance(v, paddle.Tensor):
+            saved_dict[k] = v.numpy()
+            name_table[k] = v.name
+        else:
+            saved_dict[k] = copy.deepcopy(v)
+    saved_dict["StructuredToParameterName@@"] = name_table
+    return saved_dict
+
+
+def _dump_pickle(obj, path):
+    with open(path, 'wb') as f:
+        pickle.dump(obj, f, protocol=4)
+
+
+def _dump_yaml(obj, path):
+    with open(path, encoding='utf-8', mode='w') as f:
+        yaml.dump(obj, f)
+
+
+def _dump_json(obj, path):
+    with open(path, 'w') as f:
+        json.dump(obj, f)
+
+
+@contextlib.contextmanager
+def _null_context():
+    # contextlib.nullcontext is not available in Python 3.6
+    yield
+
+
 class BaseModel:
     def __init__(self, model_type):
         self.model_type = model_type
@@ -137,57 +175,56 @@ class BaseModel:
         info['quant_config'] = self.quant_config
         return info
 
-    def save_model(self, save_dir):
-        if not osp.isdir(save_dir):
-            if osp.exists(save_dir):
-                os.remove(save_dir)
-            os.makedirs(save_dir)
+    def _snapshot_model(self):
+        """Copy the parameters, the optimizer states and the configs of the
+        model to host memory.
+
+        Returns:
+            list: Pairs of a file name and a function writing the file, used by
+                paddlex.utils.checkpoint_writer.
+        """
         model_info = self.get_model_info()
         model_info['status'] = self.status
-
-        paddle.save(self.net.state_dict(),
-                    osp.join(save_dir, 'model.pdparams'))
-        paddle.save(self.optimizer.state_dict(),
-                    osp.join(save_dir, 'model.pdopt'))
-
-        with open(
-                osp.join(save_dir, 'model.yml'), encoding='utf-8',
-                mode='w') as f:
-            yaml.dump(model_info, f)
+        files = [('model.pdparams', partial(
+            _dump_pickle, _snapshot_state_dict(self.net.state_dict()))),
+                 ('model.pdopt', partial(
+                     _dump_pickle,
+                     _snapshot_state_dict(self.optimizer.state_dict()))),
+                 ('model.yml', partial(_dump_yaml, model_info))]
 
         # 评估结果保存
         if hasattr(self, 'eval_details'):
-            with open(osp.join(save_dir, 'eval_details.json'), 'w') as f:
-                json.dump(self.eval_details, f)
+            files.append(('eval_details.json', partial(_dump_json,
+                                                       self.eval_details)))
 
         if self.status == 'Pruned' and self.pruner is not None:
-            pruning_info = self.get_pruning_info()
-            with open(
-                    osp.join(save_dir, 'prune.yml'), encoding='utf-8',
-                    mode='w') as f:
-                yaml.dump(pruning_info, f)
+            files.append(('prune.yml', partial(_dump_yaml,
+                                               self.get_pruning_info())))
 
         if self.status == 'Quantized' and self.quantizer is not None:
-            quant_info = self.get_quant_info()
-            with open(
-                    osp.join(save_dir, 'quant.yml'), encoding='utf-8',
-                    mode='w') as f:
-                yaml.dump(quant_info, f)
-
-        # 模型保存成功的标志
-        open(osp.join(save_dir, '.success'), 'w').close()
-        logging.info("Model saved in {}.".format(save_dir))
+            files.append(('quant.yml', partial(_dump_yaml,
+                                               self.get_quant_info())))
+        return files
 
-    def build_data_loader(self, dataset, batch_size, mode='train'):
-        if dataset.num_samples < batch_size:
+    def save_model(self, save_dir):
+        write_checkpoint(save_dir, self._snapshot_model(), atomic=False)
+
+    def build_data_loader(self,
+                          dataset,
+                          batch_size,
+                          mode='train',
+                          distributed=True):
+        # distributed为False时，dataset为当前卡的数据分片（见_shard_dataset），不再按卡切分
+        if distributed and dataset.num_samples < batch_size:
             raise Exception(
                 'The volume of dataset({}) must be larger than batch size({}).'
                 .format(dataset.num_samples, batch_size))
         batch_size_each_card = get_single_card_bs(batch_size=batch_size)
-        # TODO detection eval阶段需做判断
         batch_sampler = DistributedBatchSampler(
             dataset,
             batch_size=batch_size_each_card,
+            num_replicas=None if distributed else 1,
+            rank=None if distributed else 0,
             shuffle=dataset.shuffle,
             drop_last=mode == 'train')
 
@@ -210,6 +247,22 @@ class BaseModel:
 
         return loader
 
+    def _shard_dataset(self, dataset):
+        """将评估数据集按卡切分为连续且互不重叠的分片，各卡只评估自己的分片，
+           最后按卡的顺序合并各分片的评估状态，结果与单卡评估一致。
+           与DistributedBatchSampler不同，分片不补齐样本，不会重复评估。
+        """
+        nranks = paddle.distributed.get_world_size()
+        if nranks < 2:
+            return dataset
+        local_rank = paddle.distributed.get_rank()
+        start = dataset.num_samples * local_rank // nranks
+        end = dataset.num_samples * (local_rank + 1) // nranks
+        shard = copy.copy(dataset)
+        shard.file_list = dataset.file_list[start:end]
+        shard.num_samples = len(shard.file_list)
+        return shard
+
     def train_loop(self,
                    num_epochs,
                    train_dataset,
@@ -221,7 +274,9 @@ class BaseModel:
                    ema=None,
                    early_stop=False,
                    early_stop_patience=5,
-                   use_vdl=True):
+                   use_vdl=True,
+                   keep_checkpoint_max=None,
+                   accumulate_steps=1):
         arrange_transforms(
             model_type=self.model_type,
             transforms=train_dataset.transforms,
@@ -265,6 +320,19 @@ class BaseModel:
         train_step_each_epoch = math.floor(train_dataset.num_samples /
                                            train_batch_size)
         train_total_step = train_step_each_epoch * (num_epochs - start_epoch)
+        if accumulate_steps < 1:
+            raise Exception("accumulate_steps should be at least 1.")
+        if accumulate_steps > 1 and nranks > 1 and not hasattr(
+                ddp_net, 'no_sync'):
+            # Without no_sync, the gradients accumulated locally are
+            # all-reduced again in every backward.
+            raise Exception(
+                "accumulate_steps > 1 in multi-card training requires paddle.DataParallel.no_sync, which is not available in paddle {}. Please upgrade paddle or train with a single card.".
+                format(paddle.__version__))
+        if accumulate_steps > 1:
+            logging.info(
+                "Gradients are accumulated over {} steps, the effective batch size is {}."
+                .format(accumulate_steps, train_batch_size * accumulate_steps))
         if eval_dataset is not None:
             eval_batch_size = train_batch_size
             eval_epoch_time = 0
@@ -273,108 +341,162 @@ class BaseModel:
         best_accuracy = -1.0
         best_model_epoch = -1
         current_step = 0
-        for i in range(start_epoch, num_epochs):
-            self.net.train()
-            if callable(
-                    getattr(self.train_data_loader.dataset, 'set_epoch',
-                            None)):
-                self.train_data_loader.dataset.set_epoch(i)
-            train_avg_metrics = TrainingStats()
-            step_time_tic = time.time()
-
-            for step, data in enumerate(self.train_data_loader()):
-                if nranks > 1:
-                    outputs = self.run(ddp_net, data, mode='train')
-                else:
-                    outputs = self.run(self.net, data, mode='train')
-                loss = outputs['loss']
-                loss.backward()
-                self.optimizer.step()
-                self.optimizer.clear_grad()
-                lr = self.optimizer.get_lr()
-                if isinstance(self.optimizer._learning_rate,
-                              paddle.optimizer.lr.LRScheduler):
-                    self.optimizer._learning_rate.step()
-
-                train_avg_metrics.update(outputs)
-                outputs['lr'] = lr
-                if ema is not None:
-                    ema.update(self.net)
-                step_time_toc = time.time()
-                train_step_time.update(step_time_toc - step_time_tic)
-                step_time_tic = step_time_toc
-                current_step += 1
-
-                # 每间隔log_interval_steps，输出loss信息
-                if current_step % log_interval_steps == 0 and local_rank == 0:
-                    if use_vdl:
-                        for k, v in outputs.items():
-                            log_writer.add_scalar(
-                                '{}-Metrics/Training(Step): {}'.format(
-                                    task_id, k), v, current_step)
-
-                    # 估算剩余时间
-                    avg_step_time = train_step_time.avg()
-                    eta = avg_step_time * (train_total_step - current_step)
-                    if eval_dataset is not None:
-                        eval_num_epochs = math.ceil(
-                            (num_epochs - i - 1) / save_interval_epochs)
-                        if eval_epoch_time == 0:
-                            eta += avg_step_time * math.ceil(
-                                eval_dataset.num_samples / eval_batch_size)
+        # Time of reading data, running the network and fetching the outputs
+        # of each step. Summaries of the epochs are saved in train_timing.json.
+        step_timer = StepTimer(
+            train_batch_size,
+            summary_file=osp.join(save_dir, 'train_timing.json')
+            if local_rank == 0 else None,
+            start_epoch=start_epoch)
+        # Models are written in a background thread, the training thread only
+        # copies the parameters to host memory.
+        checkpoint_writer = None
+        if local_rank == 0:
+            checkpoint_writer = CheckpointWriter(keep_checkpoint_max)
+        try:
+            for i in range(start_epoch, num_epochs):
+                self.net.train()
+                if callable(
+                        getattr(self.train_data_loader.dataset, 'set_epoch',
+                                None)):
+                    self.train_data_loader.dataset.set_epoch(i)
+                train_avg_metrics = TrainingStats()
+                stop_training = False
+                step_time_tic = time.time()
+                step_timer.start()
+
+                data_loader_iter = iter(self.train_data_loader)
+                for step, data in enumerate(data_loader_iter):
+                    step_timer.record('reader_cost')
+                    # Gradients are accumulated across epochs, the parameters are
+                    # updated once every accumulate_steps steps.
+                    update_params = (current_step + 1) % accumulate_steps == 0
+                    # Gradients of the other steps are only accumulated locally
+                    # and all-reduced together with the updating step.
+                    if nranks > 1 and not update_params:
+                        sync_guard = ddp_net.no_sync()
+                    else:
+                        sync_guard = _null_context()
+                    with sync_guard:
+                        if nranks > 1:
+                            outputs = self.run(ddp_net, data, mode='train')
                         else:
-                            eta += eval_epoch_time * eval_num_epochs
-
-                    logging.info(
-                        "[TRAIN] Epoch={}/{}, Step={}/{}, {}, time_each_step={}s, eta={}"
-                        .format(i + 1, num_epochs, step + 1,
-                                train_step_each_epoch,
-                                dict2str(outputs),
-                                round(avg_step_time, 2), seconds_to_hms(eta)))
-
-            logging.info('[TRAIN] Epoch {} finished, {} .'
-                         .format(i + 1, train_avg_metrics.log()))
-            self.completed_epochs += 1
-
-            # 每间隔save_interval_epochs, 在验证集上评估和对模型进行保存
-            if ema is not None:
-                weight = self.net.state_dict()
-                self.net.set_dict(ema.apply())
-            eval_epoch_tic = time.time()
-            if (i + 1) % save_interval_epochs == 0 or i == num_epochs - 1:
-                if eval_dataset is not None and eval_dataset.num_samples > 0:
-                    eval_result = self.evaluate(
-                        eval_dataset,
-                        batch_size=eval_batch_size,
-                        return_details=True)
-                    # 保存最优模型
+                            outputs = self.run(self.net, data, mode='train')
+                        loss = outputs['loss']
+                        if accumulate_steps > 1:
+                            loss = loss / accumulate_steps
+                        loss.backward()
+                    lr = self.optimizer.get_lr()
+                    if update_params:
+                        self.optimizer.step()
+                        self.optimizer.clear_grad()
+                        if isinstance(self.optimizer._learning_rate,
+                                      paddle.optimizer.lr.LRScheduler):
+                            self.optimizer._learning_rate.step()
+                        if ema is not None:
+                            ema.update(self.net)
+                    step_timer.record('executor_cost')
+
+                    train_avg_metrics.update(outputs)
+                    outputs['lr'] = lr
+                    step_timer.record('fetch_cost')
+                    step_timer.step(get_queue_size(data_loader_iter))
+                    step_time_toc = time.time()
+                    train_step_time.update(step_time_toc - step_time_tic)
+                    step_time_tic = step_time_toc
+                    current_step += 1
+
+                    # 每间隔log_interval_steps，输出loss信息
+                    if current_step % log_interval_steps == 0 and local_rank == 0:
+                        step_timing = step_timer.log_values()
+                        if use_vdl:
+                            for k, v in outputs.items():
+                                log_writer.add_scalar(
+                                    '{}-Metrics/Training(Step): {}'.format(
+                                        task_id, k), v, current_step)
+                            for k, v in step_timing.items():
+                                log_writer.add_scalar(
+                                    '{}-Timing/Training(Step): {}'.format(
+                                        task_id, k), v, current_step)
+
+                        # 估算剩余时间
+                        avg_step_time = train_step_time.avg()
+                        eta = avg_step_time * (train_total_step - current_step)
+                        if eval_dataset is not None:
+                            eval_num_epochs = math.ceil(
+                                (num_epochs - i - 1) / save_interval_epochs)
+                            if eval_epoch_time == 0:
+                                eta += avg_step_time * math.ceil(
+                                    eval_dataset.num_samples / eval_batch_size)
+                            else:
+                                eta += eval_epoch_time * eval_num_epochs
+
+                        logging.info(
+                            "[TRAIN] Epoch={}/{}, Step={}/{}, {}, time_each_step={}s, {}, eta={}"
+                            .format(i + 1, num_epochs, step + 1,
+                                    train_step_each_epoch,
+                                    dict2str(outputs),
+                                    round(avg_step_time, 2),
+                                    StepTimer.format(step_timing),
+                                    seconds_to_hms(eta)))
+
+                logging.info('[TRAIN] Epoch {} finished, {} .'
+                             .format(i + 1, train_avg_metrics.log()))
+                self.completed_epochs += 1
+
+                # 每间隔save_interval_epochs, 在验证集上评估和对模型进行保存
+                if ema is not None:
+                    ema.apply(self.net)
+                eval_epoch_tic = time.time()
+                if (i + 1) % save_interval_epochs == 0 or i == num_epochs - 1:
+                    is_best_model = False
+                    if eval_dataset is not None and eval_dataset.num_samples > 0:
+                        eval_result = self.evaluate(
+                            eval_dataset,
+                            batch_size=eval_batch_size,
+                            return_details=True)
+                        step_timer.add('eval_cost', time.time() - eval_epoch_tic)
+                        # 保存最优模型
+                        if local_rank == 0:
+                            self.eval_metrics, self.eval_details = eval_result
+                            logging.info('[EVAL] Finished, Epoch={}, {} .'.format(
+                                i + 1, dict2str(self.eval_metrics)))
+                            best_accuracy_key = list(self.eval_metrics.keys())[0]
+                            current_accuracy = self.eval_metrics[best_accuracy_key]
+                            if current_accuracy > best_accuracy:
+                                best_accuracy = current_accuracy
+                                best_model_epoch = i + 1
+                                is_best_model = True
+                            if best_model_epoch > 0:
+                                logging.info(
+                                    'Current evaluated best model in eval_dataset is epoch_{}, {}={}'
+                                    .format(best_model_epoch, best_accuracy_key,
+                                            best_accuracy))
+                        eval_epoch_time = time.time() - eval_epoch_tic
+
+                    current_save_dir = osp.join(save_dir, "epoch_{}".format(i + 1))
                     if local_rank == 0:
-                        self.eval_metrics, self.eval_details = eval_result
-                        logging.info('[EVAL] Finished, Epoch={}, {} .'.format(
-                            i + 1, dict2str(self.eval_metrics)))
-                        best_accuracy_key = list(self.eval_metrics.keys())[0]
-                        current_accuracy = self.eval_metrics[best_accuracy_key]
-                        if current_accuracy > best_accuracy:
-                            best_accuracy = current_accuracy
-                            best_model_epoch = i + 1
-                            best_model_dir = osp.join(save_dir, "best_model")
-                            self.save_model(save_dir=best_model_dir)
-                        if best_model_epoch > 0:
-                            logging.info(
-                                'Current evaluated best model in eval_dataset is epoch_{}, {}={}'
-                                .format(best_model_epoch, best_accuracy_key,
-                                        best_accuracy))
-                    eval_epoch_time = time.time() - eval_epoch_tic
-
-                current_save_dir = osp.join(save_dir, "epoch_{}".format(i + 1))
+                        save_tic = time.time()
+                        checkpoint_writer.save(current_save_dir,
+                                               self._snapshot_model())
+                        if is_best_model:
+                            # The best model is the model of the current epoch,
+                            # save it by hard links.
+                            checkpoint_writer.link(
+                                current_save_dir, osp.join(save_dir, "best_model"))
+                        step_timer.add('checkpoint_cost', time.time() - save_tic)
+
+                        if eval_dataset is not None and early_stop:
+                            stop_training = earlystop(current_accuracy)
+                if ema is not None:
+                    ema.restore(self.net)
                 if local_rank == 0:
-                    self.save_model(save_dir=current_save_dir)
-
-                    if eval_dataset is not None and early_stop:
-                        if earlystop(current_accuracy):
-                            break
-            if ema is not None:
-                self.net.set_dict(weight)
+                    step_timer.end_epoch(i + 1)
+                if stop_training:
+                    break
+        finally:
+            if checkpoint_writer is not None:
+                checkpoint_writer.close()
 
     def analyze_sensitivity(self,
                             dataset,
@@ -21,7 +21,7 @@ import paddle
 from paddle import to_tensor
 import paddle.nn.functional as F
 from paddle.static import InputSpec
-from paddlex.utils import logging, TrainingStats, DisablePrint
+from paddlex.utils import logging, DisablePrint, all_gather_object
 from paddlex.cv.models.base import BaseModel
 from paddlex.cv.transforms import arrange_transforms
 from paddlex.cv.transforms.operators import Resize
@@ -101,24 +101,14 @@ class BaseClassifier(BaseModel):
         elif mode == 'eval':
             labels = to_tensor(inputs[1].numpy().astype('int64').reshape(-1,
                                                                          1))
-            acc1 = paddle.metric.accuracy(softmax_out, label=labels)
             k = min(5, self.num_classes)
-            acck = paddle.metric.accuracy(softmax_out, label=labels, k=k)
-            prediction = softmax_out
-            # multi cards eval
-            if paddle.distributed.get_world_size() > 1:
-                acc1 = paddle.distributed.all_reduce(
-                    acc1, op=paddle.distributed.ReduceOp.
-                    SUM) / paddle.distributed.get_world_size()
-                acck = paddle.distributed.all_reduce(
-                    acck, op=paddle.distributed.ReduceOp.
-                    SUM) / paddle.distributed.get_world_size()
-                prediction = []
-                paddle.distributed.all_gather(prediction, softmax_out)
-                prediction = paddle.concat(prediction, axis=0)
-
-            outputs = OrderedDict([('acc1', acc1), ('acc{}'.format(k), acck),
-                                   ('prediction', prediction)])
+            _, topk_idx = paddle.topk(softmax_out, k=k)
+            correct = paddle.cast(topk_idx == labels, 'int64')
+            # 当前batch的top1/topk正确数，多卡评估时在evaluate结束时汇总
+            outputs = OrderedDict(
+                [('correct1', paddle.sum(correct[:, 0])),
+                 ('correct{}'.format(k), paddle.sum(correct)),
+                 ('prediction', softmax_out)])
 
         else:
             # mode == 'train'
@@ -189,7 +179,9 @@ class BaseClassifier(BaseModel):
               lr_decay_gamma=0.1,
               early_stop=False,
               early_stop_patience=5,
-              use_vdl=True):
+              use_vdl=True,
+              keep_checkpoint_max=None,
+              accumulate_steps=1):
         """
         Train the model.
         Args:
@@ -214,13 +206,20 @@ class BaseClassifier(BaseModel):
             early_stop(bool, optional): Whether to adopt early stop strategy. Defaults to False.
             early_stop_patience(int, optional): Early stop patience. Defaults to 5.
             use_vdl(bool, optional): Whether to use VisualDL to monitor the training process. Defaults to True.
+            keep_checkpoint_max(int or None, optional): Maximum number of `epoch_N` models to keep. The models of the
+                earliest epochs are removed after saving a new one, and the best model is always kept. If None, all the
+                models are kept. Defaults to None.
+            accumulate_steps(int, optional): The number of steps to accumulate gradients over before updating the
+                parameters, which gives an effective batch size of train_batch_size * accumulate_steps. The learning
+                rate schedule and warmup_steps are counted in parameter updates. Defaults to 1.
 
         """
         self.labels = train_dataset.labels
 
         # build optimizer if not defined
         if optimizer is None:
-            num_steps_each_epoch = len(train_dataset) // train_batch_size
+            num_steps_each_epoch = len(train_dataset) // (
+                train_batch_size * accumulate_steps)
             self.optimizer = self.default_optimizer(
                 parameters=self.net.parameters(),
                 learning_rate=learning_rate,
@@ -263,7 +262,9 @@ class BaseClassifier(BaseModel):
             save_dir=save_dir,
             early_stop=early_stop,
             early_stop_patience=early_stop_patience,
-            use_vdl=use_vdl)
+            use_vdl=use_vdl,
+            keep_checkpoint_max=keep_checkpoint_max,
+            accumulate_steps=accumulate_steps)
 
     def quant_aware_train(self,
                           num_epochs,
@@ -282,7 +283,9 @@ class BaseClassifier(BaseModel):
                           early_stop=False,
                           early_stop_patience=5,
                           use_vdl=True,
-                          quant_config=None):
+                          quant_config=None,
+                          keep_checkpoint_max=None,
+                          accumulate_steps=1):
         """
         Quantization-aware training.
         Args:
@@ -307,6 +310,12 @@ class BaseClassifier(BaseModel):
             use_vdl(bool, optional): Whether to use VisualDL to monitor the training process. Defaults to True.
             quant_config(dict or None, optional): Quantization configuration. If None, a default rule of thumb
                 configuration will be used. Defaults to None.
+            keep_checkpoint_max(int or None, optional): Maximum number of `epoch_N` models to keep. The models of the
+                earliest epochs are removed after saving a new one, and the best model is always kept. If None, all the
+                models are kept. Defaults to None.
+            accumulate_steps(int, optional): The number of steps to accumulate gradients over before updating the
+                parameters, which gives an effective batch size of train_batch_size * accumulate_steps. The learning
+                rate schedule and warmup_steps are counted in parameter updates. Defaults to 1.
 
         """
         self._prepare_qat(quant_config)
@@ -327,7 +336,9 @@ class BaseClassifier(BaseModel):
             lr_decay_gamma=lr_decay_gamma,
             early_stop=early_stop,
             early_stop_patience=early_stop_patience,
-            use_vdl=use_vdl)
+            use_vdl=use_vdl,
+            keep_checkpoint_max=keep_checkpoint_max,
+            accumulate_steps=accumulate_steps)
 
     def evaluate(self, eval_dataset, batch_size=1, return_details=False):
         """
@@ -355,9 +366,15 @@ class BaseClassifier(BaseModel):
             if not paddle.distributed.parallel.parallel_helper._is_parallel_ctx_initialized(
             ):
                 paddle.distributed.init_parallel_env()
+        # 各卡评估数据集中互不重叠的分片，最后汇总各卡的正确数
         self.eval_data_loader = self.build_data_loader(
-            eval_dataset, batch_size=batch_size, mode='eval')
-        eval_metrics = TrainingStats()
+            self._shard_dataset(eval_dataset),
+            batch_size=batch_size,
+            mode='eval',
+            distributed=False)
+        k = min(5, self.num_classes)
+        correct1 = paddle.zeros([1], dtype='int64')
+        correctk = paddle.zeros([1], dtype='int64')
         eval_details = None
         if return_details:
             eval_details = list()
@@ -371,12 +388,22 @@ class BaseClassifier(BaseModel):
                 outputs = self.run(self.net, data, mode='eval')
                 if return_details:
                     eval_details.append(outputs['prediction'].tolist())
-                outputs.pop('prediction')
-                eval_metrics.update(outputs)
+                correct1 += outputs['correct1']
+                correctk += outputs['correct{}'.format(k)]
+        if nranks > 1:
+            paddle.distributed.all_reduce(correct1)
+            paddle.distributed.all_reduce(correctk)
+            if return_details:
+                eval_details = sum(all_gather_object(eval_details), [])
+        eval_metrics = OrderedDict(
+            zip(['acc1', 'acc{}'.format(k)], [
+                float(correct1.numpy()[0]) / eval_dataset.num_samples,
+                float(correctk.numpy()[0]) / eval_dataset.num_samples
+            ]))
         if return_details:
-            return eval_metrics.get(), eval_details
+            return eval_metrics, eval_details
         else:
-            return eval_metrics.get()
+            return eval_metrics
 
     def predict(self, img_file, transforms=None, topk=1):
         """
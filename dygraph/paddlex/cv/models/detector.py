@@ -26,6 +26,7 @@ import ppdet
 from ppdet.modeling.proposal_generator.target_layer import BBoxAssigner, MaskAssigner
 import paddlex
 import paddlex.utils.logging as logging
+from paddlex.utils import all_gather_object
 from paddlex.cv.transforms.operators import _NormalizeBox, _PadBox, _BboxXYXY2XYWH, Resize, Padding
 from paddlex.cv.transforms.batch_operators import BatchCompose, BatchRandomResize, BatchRandomResizeByShort, _BatchPadding, _Gt2YoloTarget
 from paddlex.cv.transforms import arrange_transforms
@@ -152,7 +153,10 @@ class BaseDetector(BaseModel):
               use_ema=False,
               early_stop=False,
               early_stop_patience=5,
-              use_vdl=True):
+              use_vdl=True,
+              keep_checkpoint_max=None,
+              ema_update_interval=1,
+              accumulate_steps=1):
         """
         Train the model.
         Args:
@@ -179,6 +183,14 @@ class BaseDetector(BaseModel):
             early_stop(bool, optional): Whether to adopt early stop strategy. Defaults to False.
             early_stop_patience(int, optional): Early stop patience. Defaults to 5.
             use_vdl(bool, optional): Whether to use VisualDL to monitor the training process. Defaults to True.
+            keep_checkpoint_max(int or None, optional): Maximum number of `epoch_N` models to keep. The models of the
+                earliest epochs are removed after saving a new one, and the best model is always kept. If None, all the
+                models are kept. Defaults to None.
+            ema_update_interval(int, optional): Update the exponential moving average every ema_update_interval steps
+                with the decay adjusted to match, which reduces the time of each step. Defaults to 1.
+            accumulate_steps(int, optional): The number of steps to accumulate gradients over before updating the
+                parameters, which gives an effective batch size of train_batch_size * accumulate_steps. The learning
+                rate schedule and warmup_steps are counted in parameter updates. Defaults to 1.
 
         """
         if train_dataset.__class__.__name__ == 'VOCDetection':
@@ -215,7 +227,8 @@ class BaseDetector(BaseModel):
 
         # build optimizer if not defined
         if optimizer is None:
-            num_steps_each_epoch = len(train_dataset) // train_batch_size
+            num_steps_each_epoch = len(train_dataset) // (
+                train_batch_size * accumulate_steps)
             self.optimizer = self.default_optimizer(
                 parameters=self.net.parameters(),
                 learning_rate=learning_rate,
@@ -251,7 +264,10 @@ class BaseDetector(BaseModel):
 
         if use_ema:
             ema = ExponentialMovingAverage(
-                decay=.9998, model=self.net, use_thres_step=True)
+                decay=.9998,
+                model=self.net,
+                use_thres_step=True,
+                update_interval=ema_update_interval)
         else:
             ema = None
         # start train loop
@@ -266,7 +282,9 @@ class BaseDetector(BaseModel):
             ema=ema,
             early_stop=early_stop,
             early_stop_patience=early_stop_patience,
-            use_vdl=use_vdl)
+            use_vdl=use_vdl,
+            keep_checkpoint_max=keep_checkpoint_max,
+            accumulate_steps=accumulate_steps)
 
     def quant_aware_train(self,
                           num_epochs,
@@ -287,7 +305,10 @@ class BaseDetector(BaseModel):
                           early_stop=False,
                           early_stop_patience=5,
                           use_vdl=True,
-                          quant_config=None):
+                          quant_config=None,
+                          keep_checkpoint_max=None,
+                          ema_update_interval=1,
+                          accumulate_steps=1):
         """
         Quantization-aware training.
         Args:
@@ -314,6 +335,14 @@ class BaseDetector(BaseModel):
             use_vdl(bool, optional): Whether to use VisualDL to monitor the training process. Defaults to True.
             quant_config(dict or None, optional): Quantization configuration. If None, a default rule of thumb
                 configuration will be used. Defaults to None.
+            keep_checkpoint_max(int or None, optional): Maximum number of `epoch_N` models to keep. The models of the
+                earliest epochs are removed after saving a new one, and the best model is always kept. If None, all the
+                models are kept. Defaults to None.
+            ema_update_interval(int, optional): Update the exponential moving average every ema_update_interval steps
+                with the decay adjusted to match, which reduces the time of each step. Defaults to 1.
+            accumulate_steps(int, optional): The number of steps to accumulate gradients over before updating the
+                parameters, which gives an effective batch size of train_batch_size * accumulate_steps. The learning
+                rate schedule and warmup_steps are counted in parameter updates. Defaults to 1.
 
         """
         self._prepare_qat(quant_config)
@@ -336,7 +365,10 @@ class BaseDetector(BaseModel):
             use_ema=use_ema,
             early_stop=early_stop,
             early_stop_patience=early_stop_patience,
-            use_vdl=use_vdl)
+            use_vdl=use_vdl,
+            keep_checkpoint_max=keep_checkpoint_max,
+            ema_update_interval=ema_update_interval,
+            accumulate_steps=accumulate_steps)
 
     def evaluate(self,
                  eval_dataset,
@@ -402,43 +434,55 @@ class BaseDetector(BaseModel):
 
         if batch_size > 1:
             logging.warning(
-                "Detector only supports single card evaluation with batch_size=1 "
-                "during evaluation, so batch_size is forcibly set to 1.")
+                "Detector only supports batch_size=1 for each card during "
+                "evaluation, so batch_size is forcibly set to 1.")
             batch_size = 1
 
-        if nranks < 2 or local_rank == 0:
-            self.eval_data_loader = self.build_data_loader(
-                eval_dataset, batch_size=batch_size, mode='eval')
-            is_bbox_normalized = False
-            if eval_dataset.batch_transforms is not None:
-                is_bbox_normalized = any(
-                    isinstance(t, _NormalizeBox)
-                    for t in eval_dataset.batch_transforms.batch_transforms)
-            if self.metric == 'voc':
-                eval_metric = VOCMetric(
-                    labels=eval_dataset.labels,
-                    coco_gt=copy.deepcopy(eval_dataset.coco_gt),
-                    is_bbox_normalized=is_bbox_normalized,
-                    classwise=False)
-            else:
-                eval_metric = COCOMetric(
-                    coco_gt=copy.deepcopy(eval_dataset.coco_gt),
-                    classwise=False)
-            scores = collections.OrderedDict()
-            logging.info(
-                "Start to evaluate(total_samples={}, total_steps={})...".
-                format(eval_dataset.num_samples, eval_dataset.num_samples))
-            with paddle.no_grad():
-                for step, data in enumerate(self.eval_data_loader):
-                    outputs = self.run(self.net, data, 'eval')
-                    eval_metric.update(data, outputs)
-                eval_metric.accumulate()
-                self.eval_details = eval_metric.details
-                scores.update(eval_metric.get())
+        # 各卡评估数据集中互不重叠的分片，最后将各卡的评估状态合并到0号卡计算指标
+        self.eval_data_loader = self.build_data_loader(
+            self._shard_dataset(eval_dataset),
+            batch_size=batch_size,
+            mode='eval',
+            distributed=False)
+        is_bbox_normalized = False
+        if eval_dataset.batch_transforms is not None:
+            is_bbox_normalized = any(
+                isinstance(t, _NormalizeBox)
+                for t in eval_dataset.batch_transforms.batch_transforms)
+        if self.metric == 'voc':
+            eval_metric = VOCMetric(
+                labels=eval_dataset.labels,
+                coco_gt=eval_dataset.coco_gt,
+                is_bbox_normalized=is_bbox_normalized,
+                classwise=False,
+                return_details=return_details)
+        else:
+            eval_metric = COCOMetric(
+                coco_gt=eval_dataset.coco_gt, classwise=False)
+        scores = collections.OrderedDict()
+        logging.info(
+            "Start to evaluate(total_samples={}, total_steps={})...".format(
+                eval_dataset.num_samples,
+                len(self.eval_data_loader.batch_sampler)))
+        with paddle.no_grad():
+            for step, data in enumerate(self.eval_data_loader):
+                outputs = self.run(self.net, data, 'eval')
+                eval_metric.update(data, outputs)
+        if nranks > 1:
+            states = all_gather_object(eval_metric.get_state())
+            if local_rank == 0:
                 eval_metric.reset()
+                for state in states:
+                    eval_metric.merge_state(state)
 
+        if nranks < 2 or local_rank == 0:
+            eval_metric.accumulate()
+            scores.update(eval_metric.get())
             if return_details:
+                self.eval_details = eval_metric.get_details()
+                eval_metric.reset()
                 return scores, self.eval_details
+            eval_metric.reset()
             return scores
 
     def predict(self, img_file, transforms=None):
@@ -193,7 +193,9 @@ class BaseSegmenter(BaseModel):
               lr_decay_power=0.9,
               early_stop=False,
               early_stop_patience=5,
-              use_vdl=True):
+              use_vdl=True,
+              keep_checkpoint_max=None,
+              accumulate_steps=1):
         """
         Train the model.
         Args:
@@ -214,6 +216,12 @@ class BaseSegmenter(BaseModel):
             early_stop(bool, optional): Whether to adopt early stop strategy. Defaults to False.
             early_stop_patience(int, optional): Early stop patience. Defaults to 5.
             use_vdl(bool, optional): Whether to use VisualDL to monitor the training process. Defaults to True.
+            keep_checkpoint_max(int or None, optional): Maximum number of `epoch_N` models to keep. The models of the
+                earliest epochs are removed after saving a new one, and the best model is always kept. If None, all the
+                models are kept. Defaults to None.
+            accumulate_steps(int, optional): The number of steps to accumulate gradients over before updating the
+                parameters, which gives an effective batch size of train_batch_size * accumulate_steps. The learning
+                rate schedule and warmup_steps are counted in parameter updates. Defaults to 1.
 
         """
         self.labels = train_dataset.labels
@@ -221,7 +229,8 @@ class BaseSegmenter(BaseModel):
             self.losses = self.default_loss()
 
         if optimizer is None:
-            num_steps_each_epoch = train_dataset.num_samples // train_batch_size
+            num_steps_each_epoch = train_dataset.num_samples // (
+                train_batch_size * accumulate_steps)
             self.optimizer = self.default_optimizer(
                 self.net.parameters(), learning_rate, num_epochs,
                 num_steps_each_epoch, lr_decay_power)
@@ -260,7 +269,9 @@ class BaseSegmenter(BaseModel):
             save_dir=save_dir,
             early_stop=early_stop,
             early_stop_patience=early_stop_patience,
-            use_vdl=use_vdl)
+            use_vdl=use_vdl,
+            keep_checkpoint_max=keep_checkpoint_max,
+            accumulate_steps=accumulate_steps)
 
     def quant_aware_train(self,
                           num_epochs,
@@ -276,7 +287,9 @@ class BaseSegmenter(BaseModel):
                           early_stop=False,
                           early_stop_patience=5,
                           use_vdl=True,
-                          quant_config=None):
+                          quant_config=None,
+                          keep_checkpoint_max=None,
+                          accumulate_steps=1):
         """
         Quantization-aware training.
         Args:
@@ -297,6 +310,12 @@ class BaseSegmenter(BaseModel):
             use_vdl(bool, optional): Whether to use VisualDL to monitor the training process. Defaults to True.
             quant_config(dict or None, optional): Quantization configuration. If None, a default rule of thumb
                 configuration will be used. Defaults to None.
+            keep_checkpoint_max(int or None, optional): Maximum number of `epoch_N` models to keep. The models of the
+                earliest epochs are removed after saving a new one, and the best model is always kept. If None, all the
+                models are kept. Defaults to None.
+            accumulate_steps(int, optional): The number of steps to accumulate gradients over before updating the
+                parameters, which gives an effective batch size of train_batch_size * accumulate_steps. The learning
+                rate schedule and warmup_steps are counted in parameter updates. Defaults to 1.
 
         """
         self._prepare_qat(quant_config)
@@ -314,7 +333,9 @@ class BaseSegmenter(BaseModel):
             lr_decay_power=lr_decay_power,
             early_stop=early_stop,
             early_stop_patience=early_stop_patience,
-            use_vdl=use_vdl)
+            use_vdl=use_vdl,
+            keep_checkpoint_max=keep_checkpoint_max,
+            accumulate_steps=accumulate_steps)
 
     def evaluate(self, eval_dataset, batch_size=1, return_details=False):
         """
@@ -356,13 +377,22 @@ class BaseSegmenter(BaseModel):
                 "Segmenter only supports batch_size=1 for each gpu/cpu card " \
                 "during evaluation, so batch_size " \
                 "is forcibly set to {}.".format(batch_size))
+        # 各卡评估数据集中互不重叠的分片，最后汇总各卡的统计量
         self.eval_data_loader = self.build_data_loader(
-            eval_dataset, batch_size=batch_size, mode='eval')
-
-        intersect_area_all = 0
-        pred_area_all = 0
-        label_area_all = 0
-        conf_mat_all = []
+            self._shard_dataset(eval_dataset),
+            batch_size=batch_size,
+            mode='eval',
+            distributed=False)
+
+        area_keys = ['intersect_area', 'pred_area', 'label_area', 'conf_mat']
+        areas = OrderedDict(
+            zip(area_keys, [
+                paddle.zeros(
+                    [self.num_classes], dtype='int64') for _ in range(3)
+            ] + [
+                paddle.zeros(
+                    [self.num_classes, self.num_classes], dtype='int64')
+            ]))
         logging.info(
             "Start to evaluate(total_samples={}, total_steps={})...".format(
                 eval_dataset.num_samples,
@@ -371,41 +401,13 @@ class BaseSegmenter(BaseModel):
             for step, data in enumerate(self.eval_data_loader):
                 data.append(eval_dataset.transforms.transforms)
                 outputs = self.run(self.net, data, 'eval')
-                pred_area = outputs['pred_area']
-                label_area = outputs['label_area']
-                intersect_area = outputs['intersect_area']
-                conf_mat = outputs['conf_mat']
-
-                # Gather from all ranks
-                if nranks > 1:
-                    intersect_area_list = []
-                    pred_area_list = []
-                    label_area_list = []
-                    conf_mat_list = []
-                    paddle.distributed.all_gather(intersect_area_list,
-                                                  intersect_area)
-                    paddle.distributed.all_gather(pred_area_list, pred_area)
-                    paddle.distributed.all_gather(label_area_list, label_area)
-                    paddle.distributed.all_gather(conf_mat_list, conf_mat)
-
-                    # Some image has been evaluated and should be eliminated in last iter
-                    if (step + 1) * nranks > len(eval_dataset):
-                        valid = len(eval_dataset) - step * nranks
-                        intersect_area_list = intersect_area_list[:valid]
-                        pred_area_list = pred_area_list[:valid]
-                        label_area_list = label_area_list[:valid]
-                        conf_mat_list = conf_mat_list[:valid]
-
-                    intersect_area_all += sum(intersect_area_list)
-                    pred_area_all += sum(pred_area_list)
-                    label_area_all += sum(label_area_list)
-                    conf_mat_all.extend(conf_mat_list)
-
-                else:
-                    intersect_area_all = intersect_area_all + intersect_area
-                    pred_area_all = pred_area_all + pred_area
-                    label_area_all = label_area_all + label_area
-                    conf_mat_all.append(conf_mat)
+                for k in area_keys:
+                    areas[k] += paddle.cast(outputs[k], 'int64')
+        if nranks > 1:
+            for area in areas.values():
+                paddle.distributed.all_reduce(area)
+        intersect_area_all, pred_area_all, label_area_all, conf_mat_all = \
+            areas.values()
         class_iou, miou = paddleseg.utils.metrics.mean_iou(
             intersect_area_all, pred_area_all, label_area_all)
         # TODO 确认是按oacc还是macc
@@ -422,8 +424,7 @@ class BaseSegmenter(BaseModel):
             ], [miou, class_iou, oacc, class_acc, kappa, category_f1score]))
 
         if return_details:
-            conf_mat = sum(conf_mat_all)
-            eval_details = {'confusion_matrix': conf_mat.tolist()}
+            eval_details = {'confusion_matrix': conf_mat_all.tolist()}
             return eval_metrics, eval_details
         return eval_metrics
 
@@ -16,8 +16,10 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import io
 import sys
 import copy
+import contextlib
 import numpy as np
 import itertools
 from ppdet.metrics.map_utils import draw_pr_curve
@@ -82,6 +84,8 @@ def cocoapi_eval(anns,
 
     if coco_gt is None:
         coco_gt = COCO(anno_file)
+    else:
+        coco_gt = _shallow_copy_coco(coco_gt)
     logging.info("Start evaluate...")
     coco_dt = loadRes(coco_gt, anns)
     if style == 'proposal':
@@ -143,6 +147,25 @@ def cocoapi_eval(anns,
     return coco_eval.stats
 
 
+def _shallow_copy_coco(coco_gt):
+    """
+    COCOeval adds keys to the ground truth annotations and converts their
+    segmentation to RLE in place. Evaluate on shallow copies of the
+    annotations so that the ground truth, which is shared with the dataset,
+    is left untouched without deep copying it.
+    """
+    from pycocotools.coco import COCO
+
+    res = COCO()
+    res.dataset = dict(coco_gt.dataset)
+    res.dataset['annotations'] = [
+        dict(ann) for ann in coco_gt.dataset['annotations']
+    ]
+    with contextlib.redirect_stdout(io.StringIO()):
+        res.createIndex()
+    return res
+
+
 def loadRes(coco_obj, anns):
     """
     Load result file and return a result api object.
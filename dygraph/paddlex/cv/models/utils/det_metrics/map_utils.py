@@ -0,0 +1,305 @@
+# Copyright (c) 2021 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import paddlex.utils.logging as logging
+
+__all__ = ['prune_zero_padding', 'jaccard_overlap_matrix', 'DetectionMAP']
+
+
+def prune_zero_padding(gt_box, gt_label, difficult=None):
+    valid_cnt = 0
+    for i in range(len(gt_box)):
+        if gt_box[i, 0] == 0 and gt_box[i, 1] == 0 and \
+                gt_box[i, 2] == 0 and gt_box[i, 3] == 0:
+            break
+        valid_cnt += 1
+    return (gt_box[:valid_cnt], gt_label[:valid_cnt], difficult[:valid_cnt]
+            if difficult is not None else None)
+
+
+def jaccard_overlap_matrix(pred, gt, is_bbox_normalized=False):
+    """
+    Calculate jaccard overlap ratio between every pair of prediction
+    and ground truth bounding boxes, the result equals calling
+    jaccard_overlap pair by pair.
+
+    Args:
+        pred (np.ndarray): prediction boxes with shape [P, 4].
+        gt (np.ndarray): ground truth boxes with shape [G, 4].
+        is_bbox_normalized (bool): whether bbox is normalized
+            to range [0, 1].
+
+    Returns:
+        np.ndarray: overlap matrix with shape [P, G].
+    """
+    pred = np.asarray(pred, dtype=np.float64).reshape(-1, 4)
+    gt = np.asarray(gt, dtype=np.float64).reshape(-1, 4)
+    norm = 1. - float(is_bbox_normalized)
+    inter_xmin = np.maximum(pred[:, None, 0], gt[None, :, 0])
+    inter_ymin = np.maximum(pred[:, None, 1], gt[None, :, 1])
+    inter_xmax = np.minimum(pred[:, None, 2], gt[None, :, 2])
+    inter_ymax = np.minimum(pred[:, None, 3], gt[None, :, 3])
+    inter_size = (inter_xmax - inter_xmin + norm) * (
+        inter_ymax - inter_ymin + norm)
+    pred_size = (pred[:, 2] - pred[:, 0] + norm) * (
+        pred[:, 3] - pred[:, 1] + norm)
+    gt_size = (gt[:, 2] - gt[:, 0] + norm) * (gt[:, 3] - gt[:, 1] + norm)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        overlap = inter_size / (
+            pred_size[:, None] + gt_size[None, :] - inter_size)
+    disjoint = (pred[:, None, 0] >= gt[None, :, 2]) | \
+               (pred[:, None, 2] <= gt[None, :, 0]) | \
+               (pred[:, None, 1] >= gt[None, :, 3]) | \
+               (pred[:, None, 3] <= gt[None, :, 1])
+    overlap[disjoint] = 0.
+    return overlap
+
+
+class DetectionMAP(object):
+    """
+    Calculate detection mean average precision.
+    Currently support two types: 11point and integral
+
+    Matching is done per image on an IoU matrix and the precision/recall
+    curves are built with cumulative sums, so several overlap thresholds
+    (e.g. 0.5:0.95) can be evaluated in one pass.
+
+    Args:
+        class_num (int): the class number.
+        overlap_thresh (float|list): The threshold of overlap
+            ratio between prediction bounding box and
+            ground truth bounding box for deciding
+            true/false positive. If it is a list, mAP is
+            calculated for each threshold and get_map returns
+            their average. Default 0.5.
+        map_type (str): calculation method of mean average
+            precision, currently support '11point' and
+            'integral'. Default '11point'.
+        is_bbox_normalized (bool): whther bounding boxes
+            is normalized to range[0, 1]. Default False.
+        evaluate_difficult (bool): whether to evaluate
+            difficult bounding boxes. Default False.
+        catid2name (dict): mapping between category id and category name.
+        classwise (bool): whether per-category AP is logged. Default False.
+    """
+
+    def __init__(self,
+                 class_num,
+                 overlap_thresh=0.5,
+                 map_type='11point',
+                 is_bbox_normalized=False,
+                 evaluate_difficult=False,
+                 catid2name=None,
+                 classwise=False):
+        self.class_num = class_num
+        self.classes = [
+            catid2name[i] if catid2name is not None else i
+            for i in range(class_num)
+        ]
+        self.classwise = classwise
+        self.overlap_thresh = overlap_thresh
+        self.overlap_threshs = np.array(
+            overlap_thresh, dtype=np.float64, ndmin=1)
+        assert map_type in ['11point', 'integral'], \
+                "map_type currently only support '11point' "\
+                "and 'integral'"
+        self.map_type = map_type
+        self.is_bbox_normalized = is_bbox_normalized
+        self.evaluate_difficult = evaluate_difficult
+        self.reset()
+
+    def update(self, bbox, score, label, gt_box, gt_label, difficult=None):
+        """
+        Update metric statics from given prediction and ground
+        truth infomations of one image.
+
+        Args:
+            bbox (np.ndarray): prediction boxes with shape [P, 4].
+            score (np.ndarray): prediction scores with shape [P].
+            label (np.ndarray): prediction labels with shape [P].
+            gt_box (np.ndarray): ground truth boxes with shape [G, 4].
+            gt_label (np.ndarray): ground truth labels with shape [G, 1].
+            difficult (np.ndarray): whether ground truth boxes are
+                difficult, with shape [G, 1]. Default None.
+        """
+        self.update_arrays(label, score, bbox, gt_box, gt_label, difficult)
+
+    def update_arrays(self,
+                      label,
+                      score,
+                      bbox,
+                      gt_box,
+                      gt_label,
+                      difficult=None):
+        """
+        Update metric statics with predictions of one image given as
+        separate label [P], score [P] and bbox [P, 4] arrays.
+        """
+        gt_box = np.asarray(gt_box).reshape(-1, 4)
+        gt_label = np.asarray(gt_label).reshape(-1).astype(np.int64)
+        if difficult is None:
+            difficult = np.zeros(gt_label.shape, dtype=np.bool_)
+        else:
+            difficult = np.asarray(difficult).reshape(-1).astype(
+                np.int64) != 0
+        if self.evaluate_difficult:
+            difficult = np.zeros(gt_label.shape, dtype=np.bool_)
+
+        # record class gt count
+        np.add.at(self.class_gt_counts, gt_label[~difficult], 1)
+
+        label = np.asarray(label).reshape(-1).astype(np.int64)
+        score = np.asarray(score, dtype=np.float64).reshape(-1)
+        if label.size == 0:
+            return
+        num_thresh = len(self.overlap_threshs)
+        tp = np.zeros((label.size, num_thresh), dtype=np.bool_)
+        valid = np.ones((label.size, num_thresh), dtype=np.bool_)
+        if gt_label.size > 0:
+            overlaps = jaccard_overlap_matrix(bbox, gt_box,
+                                              self.is_bbox_normalized)
+            overlaps[label[:, None] != gt_label[None, :]] = -1.
+            # argmax keeps the first ground truth among equal overlaps
+            max_idx = overlaps.argmax(axis=1)
+            max_overlap = overlaps[np.arange(label.size), max_idx]
+            matched = max_overlap[:, None] > self.overlap_threshs[None, :]
+            # predictions matched with difficult ground truth are ignored
+            valid = ~(matched & difficult[max_idx][:, None])
+            for t in range(num_thresh):
+                cand = np.nonzero(matched[:, t] & valid[:, t])[0]
+                # only the first prediction matched with a ground truth
+                # is a true positive, the rest are duplicates
+                _, first = np.unique(max_idx[cand], return_index=True)
+                tp[cand[first], t] = True
+        self.labels.append(label)
+        self.scores.append(score)
+        self.tps.append(tp)
+        self.valids.append(valid)
+
+    def get_state(self):
+        """
+        Get the mergeable statics of the images updated so far, used
+        to reduce the results of evaluation shards
+        """
+        return {
+            'labels': self.labels,
+            'scores': self.scores,
+            'tps': self.tps,
+            'valids': self.valids,
+            'class_gt_counts': self.class_gt_counts
+        }
+
+    def merge_state(self, state):
+        """
+        Merge the statics got by `get_state` of another shard
+        """
+        self.labels.extend(state['labels'])
+        self.scores.extend(state['scores'])
+        self.tps.extend(state['tps'])
+        self.valids.extend(state['valids'])
+        self.class_gt_counts += state['class_gt_counts']
+
+    def reset(self):
+        """
+        Reset metric statics
+        """
+        self.labels = []
+        self.scores = []
+        self.tps = []
+        self.valids = []
+        self.class_gt_counts = np.zeros(self.class_num, dtype=np.int64)
+        self.mAP = None
+        self.mAPs = None
+        self.APs = [None] * self.class_num
+
+    def _get_ap(self, score, tp, count):
+        """
+        Calculate average precision of one class from the scores and
+        true positive flags of its predictions
+        """
+        order = np.argsort(-score, kind='stable')
+        accum_tp = np.cumsum(tp[order], dtype=np.int64)
+        precision = accum_tp / np.arange(1., accum_tp.size + 1.)
+        recall = accum_tp / float(count)
+        if self.map_type == '11point':
+            max_precisions = np.zeros(11)
+            for j in range(11):
+                mask = recall >= j / 10.
+                if mask.any():
+                    max_precisions[j] = precision[mask].max()
+            return max_precisions.sum() / 11.
+        elif self.map_type == 'integral':
+            recall_gap = np.diff(recall, prepend=0.)
+            mask = np.abs(recall_gap) > 1e-6
+            return float(np.sum(precision[mask] * recall_gap[mask]))
+        else:
+            raise Exception("Unspported mAP type {}".format(self.map_type))
+
+    def accumulate(self):
+        """
+        Accumulate metric results and calculate mAP
+        """
+        num_thresh = len(self.overlap_threshs)
+        if len(self.labels) > 0:
+            labels = np.concatenate(self.labels)
+            scores = np.concatenate(self.scores)
+            tps = np.concatenate(self.tps)
+            valids = np.concatenate(self.valids)
+        else:
+            labels = np.zeros((0, ), dtype=np.int64)
+            scores = np.zeros((0, ))
+            tps = np.zeros((0, num_thresh), dtype=np.bool_)
+            valids = np.zeros((0, num_thresh), dtype=np.bool_)
+        # group predictions by class, keeping the order of update
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(self.class_num + 1))
+
+        mAPs = np.zeros(num_thresh)
+        valid_cnt = 0
+        for id, count in enumerate(self.class_gt_counts):
+            if count == 0: continue
+            valid_cnt += 1
+            idx = order[bounds[id]:bounds[id + 1]]
+            aps = np.zeros(num_thresh)
+            for t in range(num_thresh):
+                mask = valids[idx, t]
+                if not mask.any():
+                    continue
+                aps[t] = self._get_ap(scores[idx][mask], tps[idx, t][mask],
+                                      count)
+            mAPs += aps
+            self.APs[id] = float(aps.mean())
+
+        if valid_cnt > 0:
+            mAPs = mAPs / float(valid_cnt)
+        self.mAPs = mAPs.tolist()
+        self.mAP = float(mAPs.mean())
+        if self.classwise:
+            for id, ap in enumerate(self.APs):
+                if ap is not None:
+                    logging.info("AP of category '{}': {:.3f}".format(
+                        self.classes[id], ap))
+
+    def get_map(self):
+        """
+        Get mAP result
+        """
+        if self.mAP is None:
+            raise Exception("mAP is not calculated.")
+        return self.mAP
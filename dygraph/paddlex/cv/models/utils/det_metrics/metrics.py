@@ -21,11 +21,11 @@ import sys
 from collections import OrderedDict
 import paddle
 import numpy as np
-from ppdet.metrics.map_utils import prune_zero_padding, DetectionMAP
-from .coco_utils import get_infer_results, cocoapi_eval
+from .map_utils import prune_zero_padding, DetectionMAP
+from .coco_utils import get_seg_res, cocoapi_eval
 import paddlex.utils.logging as logging
 
-__all__ = ['Metric', 'VOCMetric', 'COCOMetric']
+__all__ = ['Metric', 'VOCMetric', 'COCOMetric', 'DetectionResults']
 
 
 class Metric(paddle.metric.Metric):
@@ -49,6 +49,78 @@ class Metric(paddle.metric.Metric):
     def get_results(self):
         pass
 
+    # get the mergeable state of the samples updated so far and merge the
+    # state of another evaluation shard, used in multi cards evaluation
+    def get_state(self):
+        return {}
+
+    def merge_state(self, state):
+        pass
+
+
+class DetectionResults(object):
+    """
+    Detections stored as compact arrays of image id, class id, box
+    ([xmin, ymin, xmax, ymax]) and score, turned into COCO results
+    only when `to_coco` is called.
+
+    Args:
+        clsid2catid (dict): mapping from class id to category id.
+        bias (int): bias added to the width and height of boxes.
+    """
+
+    def __init__(self, clsid2catid, bias=0):
+        self.clsid2catid = clsid2catid
+        self.bias = bias
+        self.im_ids = []
+        self.labels = []
+        self.scores = []
+        self.bboxes = []
+
+    def __len__(self):
+        return sum(len(l) for l in self.labels)
+
+    def update(self, im_id, label, score, bbox):
+        """
+        Add detections given as arrays im_id [P], label [P], score [P]
+        and bbox [P, 4].
+        """
+        self.im_ids.append(np.asarray(im_id, dtype=np.int64).reshape(-1))
+        self.labels.append(np.asarray(label, dtype=np.int64).reshape(-1))
+        self.scores.append(np.asarray(score, dtype=np.float32).reshape(-1))
+        self.bboxes.append(np.asarray(bbox, dtype=np.float32).reshape(-1, 4))
+
+    def merge(self, other):
+        self.im_ids.extend(other.im_ids)
+        self.labels.extend(other.labels)
+        self.scores.extend(other.scores)
+        self.bboxes.extend(other.bboxes)
+
+    def to_coco(self):
+        """
+        Returns:
+            list: detections in COCO result format.
+        """
+        if len(self) == 0:
+            return []
+        im_ids = np.concatenate(self.im_ids).tolist()
+        labels = np.concatenate(self.labels).tolist()
+        scores = np.concatenate(self.scores).tolist()
+        bboxes = np.concatenate(self.bboxes).tolist()
+        results = []
+        for im_id, label, score, (xmin, ymin, xmax, ymax) in zip(
+                im_ids, labels, scores, bboxes):
+            results.append({
+                'image_id': im_id,
+                'category_id': self.clsid2catid[label],
+                'bbox': [
+                    xmin, ymin, xmax - xmin + self.bias,
+                    ymax - ymin + self.bias
+                ],
+                'score': score
+            })
+        return results
+
 
 class VOCMetric(Metric):
     def __init__(self,
@@ -58,7 +130,8 @@ class VOCMetric(Metric):
                  map_type='11point',
                  is_bbox_normalized=False,
                  evaluate_difficult=False,
-                 classwise=False):
+                 classwise=False,
+                 return_details=False):
         self.cid2cname = {i: name for i, name in enumerate(labels)}
         self.coco_gt = coco_gt
         self.clsid2catid = {
@@ -67,6 +140,11 @@ class VOCMetric(Metric):
                 self.coco_gt.loadCats(self.coco_gt.getCatIds()))
         }
         self.overlap_thresh = overlap_thresh
+        if isinstance(overlap_thresh, (list, tuple)):
+            self.thresh_str = "{:.2f}:{:.2f}".format(
+                min(overlap_thresh), max(overlap_thresh))
+        else:
+            self.thresh_str = "{:.2f}".format(overlap_thresh)
         self.map_type = map_type
         self.evaluate_difficult = evaluate_difficult
         self.detection_map = DetectionMAP(
@@ -77,11 +155,13 @@ class VOCMetric(Metric):
             evaluate_difficult=evaluate_difficult,
             catid2name=self.cid2cname,
             classwise=classwise)
+        # whether detections are kept for `get_details`
+        self.return_details = return_details
 
         self.reset()
 
     def reset(self):
-        self.details = {'gt': copy.deepcopy(self.coco_gt.dataset), 'bbox': []}
+        self.results = DetectionResults(self.clsid2catid)
         self.detection_map.reset()
 
     def update(self, inputs, outputs):
@@ -101,6 +181,7 @@ class VOCMetric(Metric):
         scale_factor = inputs['scale_factor'].numpy(
         ) if 'scale_factor' in inputs else np.ones(
             (gt_boxes.shape[0], 2)).astype('float32')
+        im_ids = inputs['im_id'].numpy().reshape(-1)
 
         bbox_idx = 0
         for i in range(len(gt_boxes)):
@@ -120,18 +201,27 @@ class VOCMetric(Metric):
                                       difficult)
             bbox_idx += bbox_num
 
-            for l, s, b in zip(label, score, bbox):
-                xmin, ymin, xmax, ymax = b.tolist()
-                w = xmax - xmin
-                h = ymax - ymin
-                bbox = [xmin, ymin, w, h]
-                coco_res = {
-                    'image_id': int(inputs['im_id']),
-                    'category_id': self.clsid2catid[int(l)],
-                    'bbox': bbox,
-                    'score': float(s)
-                }
-                self.details['bbox'].append(coco_res)
+            if self.return_details:
+                self.results.update(
+                    np.full(len(label), im_ids[i]), label, score, bbox)
+
+    def get_state(self):
+        return {
+            'detection_map': self.detection_map.get_state(),
+            'results': self.results
+        }
+
+    def merge_state(self, state):
+        self.detection_map.merge_state(state['detection_map'])
+        self.results.merge(state['results'])
+
+    def get_details(self):
+        """
+        Get the ground truth (referenced, not copied) and the detections
+        in COCO result format, which are only kept if `return_details`
+        is True.
+        """
+        return {'gt': self.coco_gt.dataset, 'bbox': self.results.to_coco()}
 
     def accumulate(self):
         logging.info("Accumulating evaluatation results...")
@@ -139,8 +229,8 @@ class VOCMetric(Metric):
 
     def log(self):
         map_stat = 100. * self.detection_map.get_map()
-        logging.info("mAP({:.2f}, {}) = {:.2f}%".format(
-            self.overlap_thresh, self.map_type, map_stat))
+        logging.info("mAP({}, {}) = {:.2f}%".format(
+            self.thresh_str, self.map_type, map_stat))
 
     def get_results(self):
         return {'bbox': [self.detection_map.get_map()]}
@@ -148,7 +238,7 @@ class VOCMetric(Metric):
     def get(self):
         map_stat = 100. * self.detection_map.get_map()
         stats = {
-            "mAP({:.2f}, {})".format(self.overlap_thresh, self.map_type):
+            "mAP({}, {})".format(self.thresh_str, self.map_type):
             map_stat
         }
         return stats
@@ -167,11 +257,8 @@ class COCOMetric(Metric):
 
     def reset(self):
         # only bbox and mask evaluation support currently
-        self.details = {
-            'gt': copy.deepcopy(self.coco_gt.dataset),
-            'bbox': [],
-            'mask': []
-        }
+        self.results = DetectionResults(self.clsid2catid, bias=self.bias)
+        self.mask_results = []
         self.eval_stats = {}
 
     def update(self, inputs, outputs):
@@ -181,29 +268,55 @@ class COCOMetric(Metric):
             outs[k] = v.numpy() if isinstance(v, paddle.Tensor) else v
 
         im_id = inputs['im_id']
-        outs['im_id'] = im_id.numpy() if isinstance(im_id,
-                                                    paddle.Tensor) else im_id
-
-        infer_results = get_infer_results(
-            outs, self.clsid2catid, bias=self.bias)
-        self.details['bbox'] += infer_results[
-            'bbox'] if 'bbox' in infer_results else []
-        self.details['mask'] += infer_results[
-            'mask'] if 'mask' in infer_results else []
+        im_id = im_id.numpy() if isinstance(im_id, paddle.Tensor) else im_id
+        im_id = np.asarray(im_id).reshape(-1)
+
+        bbox = np.asarray(outs['bbox'])
+        if bbox.ndim == 2 and bbox.shape[1] == 6:
+            bbox_num = np.asarray(outs['bbox_num']).reshape(-1)
+            im_ids = np.repeat(im_id[:len(bbox_num)], bbox_num)
+            bbox = bbox[:len(im_ids)]
+            # boxes with negative class id are paddings
+            keep = bbox[:, 0].astype(np.int64) >= 0
+            self.results.update(im_ids[keep], bbox[keep, 0], bbox[keep, 1],
+                                bbox[keep, 2:])
+        if 'mask' in outs:
+            self.mask_results += get_seg_res(
+                outs['mask'], outs['bbox'], outs['bbox_num'],
+                im_id.reshape(-1, 1), self.clsid2catid)
+
+    def get_state(self):
+        return {'results': self.results, 'mask': self.mask_results}
+
+    def merge_state(self, state):
+        self.results.merge(state['results'])
+        self.mask_results.extend(state['mask'])
+
+    def get_details(self):
+        """
+        Get the ground truth (referenced, not copied) and the detections
+        in COCO result format.
+        """
+        return {
+            'gt': self.coco_gt.dataset,
+            'bbox': self.results.to_coco(),
+            'mask': self.mask_results
+        }
 
     def accumulate(self):
-        if len(self.details['bbox']) > 0:
+        if len(self.results) > 0:
+            # loadRes adds keys to the results, which are built afresh
             bbox_stats = cocoapi_eval(
-                copy.deepcopy(self.details['bbox']),
+                self.results.to_coco(),
                 'bbox',
                 coco_gt=self.coco_gt,
                 classwise=self.classwise)
             self.eval_stats['bbox'] = bbox_stats
             sys.stdout.flush()
 
-        if len(self.details['mask']) > 0:
+        if len(self.mask_results) > 0:
             seg_stats = cocoapi_eval(
-                copy.deepcopy(self.details['mask']),
+                copy.deepcopy(self.mask_results),
                 'segm',
                 coco_gt=self.coco_gt,
                 classwise=self.classwise)
@@ -12,37 +12,125 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import numpy as np
 import paddle
 
 
 class ExponentialMovingAverage(object):
-    def __init__(self, decay, model, use_thres_step=False):
+    """Exponential moving average of the floating point entries of the model
+    state dict. The entries of the same dtype share one flattened shadow
+    buffer, which is updated in place, and non-float buffers are skipped.
+
+    Args:
+        decay (float): Decay of each training step.
+        model (paddle.nn.Layer): The model to average.
+        use_thres_step (bool, optional): Whether to limit the decay by
+            (1 + step) / (10 + step) in the early steps. Defaults to False.
+        update_interval (int, optional): Update the shadow every
+            update_interval steps with the decay raised to the power of
+            update_interval, which approximates updating every step.
+            Defaults to 1.
+    """
+
+    def __init__(self, decay, model, use_thres_step=False, update_interval=1):
         self.step = 0
         self.decay = decay
-        self.shadow = dict()
-        for k, v in model.state_dict().items():
-            self.shadow[k] = paddle.zeros_like(v)
+        self._decay = decay
         self.use_thres_step = use_thres_step
+        self.update_interval = max(int(update_interval), 1)
+        float_dtypes = [paddle.float16, paddle.float32, paddle.float64]
+        # Keys, shapes and shadow buffer of each dtype
+        self.groups = list()
+        for k, v in model.state_dict().items():
+            if v.dtype not in float_dtypes:
+                continue
+            for group in self.groups:
+                if group['dtype'] == v.dtype:
+                    break
+            else:
+                group = {'dtype': v.dtype, 'keys': list(), 'shapes': list()}
+                self.groups.append(group)
+            group['keys'].append(k)
+            group['shapes'].append(v.shape)
+        for group in self.groups:
+            numel = sum(int(np.prod(shape)) for shape in group['shapes'])
+            group['shadow'] = paddle.zeros([numel], dtype=group['dtype'])
+        self._backup = None
+
+    def _flatten(self, model_dict, group):
+        return paddle.concat(
+            [paddle.flatten(model_dict[k]) for k in group['keys']])
 
+    def _unflatten(self, flat, group):
+        sizes = [int(np.prod(shape)) for shape in group['shapes']]
+        return [
+            paddle.reshape(v, shape)
+            for v, shape in zip(paddle.split(flat, sizes), group['shapes'])
+        ]
+
+    @paddle.no_grad()
     def update(self, model):
         if self.use_thres_step:
             decay = min(self.decay, (1 + self.step) / (10 + self.step))
         else:
             decay = self.decay
+        self.step += 1
+        if self.step % self.update_interval != 0:
+            return
         self._decay = decay
+        decay = decay**self.update_interval
         model_dict = model.state_dict()
-        for k, v in self.shadow.items():
-            v = decay * v + (1 - decay) * model_dict[k]
-            v.stop_gradient = True
-            self.shadow[k] = v
-        self.step += 1
+        for group in self.groups:
+            flat = self._flatten(model_dict, group)
+            group['shadow'].scale_(decay)
+            group['shadow'].add_(flat.scale_(1 - decay))
+
+    def _averaged(self, group):
+        # Number of steps the shadow has been decayed over
+        num_steps = self.step // self.update_interval * self.update_interval
+        if num_steps == 0:
+            return group['shadow']
+        return group['shadow'].scale(1. / (1 - self._decay**num_steps))
+
+    @paddle.no_grad()
+    def apply(self, model=None):
+        """Get the averaged weights.
+
+        Args:
+            model (paddle.nn.Layer or None, optional): If not None, back up the
+                weights of the model and replace them in place with the
+                averaged ones, until restore() is called. Defaults to None.
+
+        Returns:
+            dict: The averaged weights, only if model is None.
+        """
+        if model is None:
+            state_dict = dict()
+            for group in self.groups:
+                state_dict.update(
+                    zip(group['keys'],
+                        self._unflatten(self._averaged(group), group)))
+            return state_dict
+        if self.step < self.update_interval:
+            return
+        model_dict = model.state_dict()
+        self._backup = [
+            self._flatten(model_dict, group) for group in self.groups
+        ]
+        for group in self.groups:
+            self._assign(model_dict, group, self._averaged(group))
+
+    @paddle.no_grad()
+    def restore(self, model):
+        """Restore the weights of the model backed up by apply(model).
+        """
+        if self._backup is None:
+            return
+        model_dict = model.state_dict()
+        for group, backup in zip(self.groups, self._backup):
+            self._assign(model_dict, group, backup)
+        self._backup = None
 
-    def apply(self):
-        if self.step == 0:
-            return self.shadow
-        state_dict = dict()
-        for k, v in self.shadow.items():
-            v = v / (1 - self._decay**self.step)
-            v.stop_gradient = True
-            state_dict[k] = v
-        return state_dict
+    def _assign(self, model_dict, group, flat):
+        for k, v in zip(group['keys'], self._unflatten(flat, group)):
+            paddle.assign(v, output=model_dict[k])
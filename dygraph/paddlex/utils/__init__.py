@@ -18,7 +18,9 @@ from .utils import (seconds_to_hms, get_encoding, get_single_card_bs, dict2str,
                     EarlyStop, path_normalization, is_pic, MyEncoder,
                     DisablePrint)
 from .checkpoint import get_pretrain_weights, load_pretrain_weights
-from .env import get_environ_info, get_num_workers, init_parallel_env
+from .checkpoint_writer import CheckpointWriter, write_checkpoint
+from .env import (get_environ_info, get_num_workers, init_parallel_env,
+                  all_gather_object)
 from .download import download_and_decompress, decompress
-from .stats import SmoothedValue, TrainingStats
+from .stats import SmoothedValue, TrainingStats, StepTimer, get_queue_size
 from .shm import _get_shared_memory_size_in_M
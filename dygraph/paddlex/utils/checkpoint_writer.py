@@ -0,0 +1,192 @@
+# Copyright (c) 2021 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import os.path as osp
+import re
+import shutil
+import threading
+import queue
+import paddlex.utils.logging as logging
+
+
+def _replace_dir(src_dir, save_dir):
+    # Rename the existing directory out of the way first, so that save_dir
+    # always holds a complete model.
+    if osp.isdir(save_dir):
+        old_dir = save_dir + '.old'
+        if osp.exists(old_dir):
+            shutil.rmtree(old_dir)
+        os.rename(save_dir, old_dir)
+        os.rename(src_dir, save_dir)
+        shutil.rmtree(old_dir)
+    else:
+        if osp.exists(save_dir):
+            os.remove(save_dir)
+        os.rename(src_dir, save_dir)
+
+
+def _new_tmp_dir(save_dir):
+    tmp_dir = save_dir + '.tmp'
+    if osp.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    return tmp_dir
+
+
+def write_checkpoint(save_dir, files, atomic=True):
+    """Write the model files and the `.success` flag.
+
+    Args:
+        save_dir (str): Directory to save the model.
+        files (list): Pairs of a file name and a function writing the file to
+            the path passed to it.
+        atomic (bool): Whether to write into a temporary directory and rename
+            it to save_dir, replacing the existing files in save_dir as a
+            whole. If False, the files are written into save_dir directly.
+            Defaults to True.
+    """
+    parent_dir = osp.dirname(osp.abspath(save_dir))
+    if not osp.isdir(parent_dir):
+        os.makedirs(parent_dir)
+    if atomic:
+        write_dir = _new_tmp_dir(save_dir)
+    else:
+        if not osp.isdir(save_dir):
+            if osp.exists(save_dir):
+                os.remove(save_dir)
+            os.makedirs(save_dir)
+        write_dir = save_dir
+    for name, write_func in files:
+        write_func(osp.join(write_dir, name))
+    # The flag of a successfully saved model
+    open(osp.join(write_dir, '.success'), 'w').close()
+    if atomic:
+        _replace_dir(write_dir, save_dir)
+    logging.info("Model saved in {}.".format(save_dir))
+
+
+def link_checkpoint(src_dir, save_dir):
+    """Copy the saved model in src_dir to save_dir by hard links, falling back
+    to copying the files where hard links are not supported.
+    """
+    tmp_dir = _new_tmp_dir(save_dir)
+    for name in os.listdir(src_dir):
+        src = osp.join(src_dir, name)
+        if not osp.isfile(src):
+            continue
+        try:
+            os.link(src, osp.join(tmp_dir, name))
+        except OSError:
+            shutil.copy2(src, osp.join(tmp_dir, name))
+    _replace_dir(tmp_dir, save_dir)
+    logging.info("Model saved in {}.".format(save_dir))
+
+
+def remove_old_checkpoints(save_dir, keep_checkpoint_max, current_epoch=None):
+    """Keep only the keep_checkpoint_max `epoch_N` directories with the largest
+    epochs in save_dir. If current_epoch is given, directories of later epochs
+    are left from a previous longer run, so they are neither counted nor
+    removed, and the directory of current_epoch is always kept.
+    """
+    epochs = list()
+    for name in os.listdir(save_dir):
+        match = re.match(r'^epoch_(\d+)$', name)
+        if match and osp.isdir(osp.join(save_dir, name)):
+            epochs.append(int(match.group(1)))
+    if current_epoch is not None:
+        epochs = [epoch for epoch in epochs if epoch <= current_epoch]
+    if keep_checkpoint_max > 0:
+        epochs = sorted(epochs)[:-keep_checkpoint_max]
+    for epoch in epochs:
+        shutil.rmtree(
+            osp.join(save_dir, 'epoch_{}'.format(epoch)), ignore_errors=True)
+
+
+class CheckpointWriter(object):
+    """Save models in a background thread in the order they are submitted, so
+    that the training thread only copies the parameters to host memory.
+
+    Args:
+        keep_checkpoint_max (int): After saving an `epoch_N` directory, keep only
+            the keep_checkpoint_max ones with the largest epochs. If None, all
+            of them are kept. Defaults to None.
+        max_pending (int): Maximum number of tasks waiting to be written.
+            Submitting blocks beyond it to bound the models held in memory.
+            Defaults to 1.
+    """
+
+    def __init__(self, keep_checkpoint_max=None, max_pending=1):
+        if keep_checkpoint_max is not None and keep_checkpoint_max < 1:
+            raise Exception("keep_checkpoint_max should be at least 1.")
+        self.keep_checkpoint_max = keep_checkpoint_max
+        self.tasks = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            task = self.tasks.get()
+            try:
+                if task is None:
+                    break
+                if self.error is None:
+                    task()
+            except Exception as e:
+                self.error = e
+                logging.warning("Failed to save the model: {}".format(e))
+            finally:
+                self.tasks.task_done()
+
+    def _submit(self, task):
+        if self.error is not None:
+            raise self.error
+        self.tasks.put(task)
+
+    def save(self, save_dir, files):
+        """Submit a saving task.
+
+        Args:
+            save_dir (str): Directory to save the model. Old models are removed
+                by keep_checkpoint_max if its name is `epoch_N`.
+            files (list): Pairs of a file name and a function writing the file
+                to the path passed to it.
+        """
+
+        def task():
+            write_checkpoint(save_dir, files)
+            match = re.match(r'^epoch_(\d+)$',
+                             osp.basename(osp.normpath(save_dir)))
+            if self.keep_checkpoint_max is not None and match:
+                remove_old_checkpoints(
+                    osp.dirname(osp.abspath(save_dir)),
+                    self.keep_checkpoint_max, int(match.group(1)))
+
+        self._submit(task)
+
+    def link(self, src_dir, save_dir):
+        """Submit a task linking src_dir to save_dir once src_dir is written,
+        used when the best model is the model of the current epoch.
+        """
+        self._submit(lambda: link_checkpoint(src_dir, save_dir))
+
+    def close(self):
+        """Wait for all the tasks and stop the background thread.
+        """
+        self.tasks.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
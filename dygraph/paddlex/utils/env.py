@@ -18,6 +18,7 @@ import os
 import os.path as osp
 import platform
 import random
+import pickle
 import numpy as np
 import multiprocessing as mp
 import paddle
@@ -69,3 +70,35 @@ def init_parallel_env():
         np.random.seed(local_seed)
 
     paddle.distributed.init_parallel_env()
+
+
+def all_gather_object(obj):
+    """Gather a picklable object from all ranks.
+
+    Args:
+        obj: the object of the current rank.
+
+    Returns:
+        list: objects of all ranks, in the order of rank.
+    """
+    nranks = paddle.distributed.get_world_size()
+    if nranks < 2:
+        return [obj]
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    size = len(data)
+    # all_gather works on int32 tensors with the same shape on all ranks
+    data = data + b'\0' * (-size % 4)
+    size_list = list()
+    paddle.distributed.all_gather(size_list,
+                                  paddle.to_tensor(
+                                      np.array(
+                                          [size], dtype='int64')))
+    sizes = [int(s.numpy()[0]) for s in size_list]
+    buf = np.zeros((max(sizes) + 3) // 4, dtype='int32')
+    buf[:len(data) // 4] = np.frombuffer(data, dtype='int32')
+    tensor_list = list()
+    paddle.distributed.all_gather(tensor_list, paddle.to_tensor(buf))
+    return [
+        pickle.loads(t.numpy().tobytes()[:s])
+        for t, s in zip(tensor_list, sizes)
+    ]
@@ -12,6 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os.path as osp
+import time
+import json
 import collections
 import numpy as np
 import datetime
@@ -36,19 +39,33 @@ class SmoothedValue(object):
 
 
 class TrainingStats(object):
+    """Accumulate the training outputs of the steps. The values are kept on
+    the device and only copied to the host in get() or log(), so updating
+    does not wait for the device.
+    """
+
     def __init__(self, window_size=None, delimiter=', '):
         self.meters = None
         self.window_size = window_size
         self.delimiter = delimiter
+        self.count = 0
 
     def update(self, stats):
         if self.meters is None:
-            self.meters = {
-                k: SmoothedValue(self.window_size)
-                for k in stats.keys()
-            }
-        for k, v in self.meters.items():
-            v.update(stats[k].numpy())
+            if self.window_size is None:
+                self.meters = {k: 0 for k in stats.keys()}
+            else:
+                self.meters = {
+                    k: collections.deque(maxlen=self.window_size)
+                    for k in stats.keys()
+                }
+        self.count += 1
+        for k in self.meters.keys():
+            v = stats[k].detach()
+            if self.window_size is None:
+                self.meters[k] = self.meters[k] + v
+            else:
+                self.meters[k].append(v)
 
     def get(self, extras=None):
         stats = collections.OrderedDict()
@@ -56,7 +73,10 @@ class TrainingStats(object):
             for k, v in extras.items():
                 stats[k] = v
         for k, v in self.meters.items():
-            stats[k] = v.avg()
+            if self.window_size is None:
+                stats[k] = (v / self.count).numpy().mean()
+            else:
+                stats[k] = np.mean([x.numpy() for x in v])
 
         return stats
 
@@ -66,3 +86,135 @@ class TrainingStats(object):
         for k, v in d.items():
             strs.append("{}={}".format(k, str(v).format('8.6f')))
         return self.delimiter.join(strs)
+
+
+def get_queue_size(data_loader):
+    """Get the number of batches waiting in the queue of a data loader, or
+    None if the data loader does not expose its queue.
+    """
+    for attr in ['_blocking_queue', '_queue']:
+        queue = getattr(data_loader, attr, None)
+        if queue is not None and hasattr(queue, 'size'):
+            try:
+                return int(queue.size())
+            except Exception:
+                return None
+    return None
+
+
+class StepTimer(object):
+    """Record the time of the stages of each training step, the throughput
+    and the number of batches waiting in the reader queue. The averages
+    since the last log are used in the step log, and a summary of each
+    epoch is dumped to a json file for regression tracking.
+
+    Args:
+        batch_size (int): number of samples of a step on all the cards.
+        stages (list): names of the stages, recorded in order in a step.
+        summary_file (str): path of the json file of the epoch summaries.
+            Summaries of epochs after start_epoch in an existing file are
+            dropped, as they are trained again when resuming.
+        start_epoch (int): the epoch the training starts from.
+    """
+
+    def __init__(self,
+                 batch_size,
+                 stages=('reader_cost', 'executor_cost', 'fetch_cost'),
+                 summary_file=None,
+                 start_epoch=0):
+        self.batch_size = batch_size
+        self.stages = list(stages)
+        self.summary_file = summary_file
+        self.summaries = list()
+        if summary_file is not None and osp.exists(summary_file):
+            with open(summary_file) as f:
+                self.summaries = [
+                    s for s in json.load(f) if s['epoch'] <= start_epoch
+                ]
+        self.step_costs = collections.OrderedDict()
+        self.window = collections.defaultdict(self._new_window)
+        self.epoch_values = collections.defaultdict(list)
+        self.epoch_costs = collections.OrderedDict()
+        self.tic = time.time()
+
+    @staticmethod
+    def _new_window():
+        # bounded in case the averages are never taken, e.g. on other ranks
+        return collections.deque(maxlen=1000)
+
+    def start(self):
+        self.tic = time.time()
+
+    def record(self, stage):
+        toc = time.time()
+        self.step_costs[stage] = toc - self.tic
+        self.tic = toc
+
+    def step(self, queue_size=None):
+        values = collections.OrderedDict()
+        for stage in self.stages:
+            values[stage] = self.step_costs.get(stage, 0.)
+        values['batch_cost'] = sum(self.step_costs.values())
+        values['ips'] = self.batch_size / max(values['batch_cost'], 1e-6)
+        if queue_size is not None:
+            values['queue_size'] = queue_size
+        for k, v in values.items():
+            self.window[k].append(v)
+            self.epoch_values[k].append(v)
+        self.step_costs = collections.OrderedDict()
+
+    def add(self, name, cost):
+        """Add the time out of the steps in an epoch, e.g. evaluation or
+        checkpointing.
+        """
+        self.epoch_costs[name] = self.epoch_costs.get(name, 0.) + cost
+
+    def log_values(self):
+        """Get the averages since the last call.
+        """
+        values = collections.OrderedDict()
+        for k, v in self.window.items():
+            values[k] = float(np.mean(v))
+        self.window = collections.defaultdict(self._new_window)
+        return values
+
+    @staticmethod
+    def format(values):
+        strs = list()
+        for k, v in values.items():
+            if k == 'ips':
+                strs.append("ips={:.2f} samples/s".format(v))
+            elif k == 'queue_size':
+                strs.append("queue_size={:.1f}".format(v))
+            else:
+                strs.append("{}={:.4f}s".format(k, v))
+        return ", ".join(strs)
+
+    def end_epoch(self, epoch):
+        """Summarize the epoch and dump the summaries to summary_file.
+        """
+        batch_costs = np.array(self.epoch_values['batch_cost'])
+        summary = collections.OrderedDict()
+        summary['epoch'] = epoch
+        summary['steps'] = int(batch_costs.size)
+        summary['train_cost'] = float(batch_costs.sum())
+        if batch_costs.size > 0:
+            for stage in self.stages:
+                summary[stage] = float(np.mean(self.epoch_values[stage]))
+            summary['batch_cost'] = float(batch_costs.mean())
+            summary['batch_cost_p50'] = float(np.percentile(batch_costs, 50))
+            summary['batch_cost_p90'] = float(np.percentile(batch_costs, 90))
+            summary['ips'] = self.batch_size * batch_costs.size / max(
+                batch_costs.sum(), 1e-6)
+            if len(self.epoch_values['queue_size']) > 0:
+                summary['queue_size'] = float(
+                    np.mean(self.epoch_values['queue_size']))
+        for k, v in self.epoch_costs.items():
+            summary[k] = v
+        self.summaries.append(summary)
+        self.epoch_values = collections.defaultdict(list)
+        self.epoch_costs = collections.OrderedDict()
+        if self.summary_file is not None:
+            with open(self.summary_file, 'w') as f:
+                json.dump(self.summaries, f, indent=1)
+        return summary
@@ -17,6 +17,7 @@ from __future__ import absolute_import
 __version__ = '1.3.11'
 
 import os
+import sys
 if 'FLAGS_eager_delete_tensor_gb' not in os.environ:
     os.environ['FLAGS_eager_delete_tensor_gb'] = '0.0'
 if 'FLAGS_allocator_strategy' not in os.environ:
@@ -42,30 +43,39 @@ if hasattr(paddle, 'enable_static'):
     gui_mode = True
 
 from .utils.utils import get_environ_info
-from . import cv
-from . import det
-from . import seg
-from . import cls
-from . import slim
-from . import converter
-from . import tools
-from . import deploy
+from .utils.lazy_import import lazy_getattr, import_all
 
-try:
-    import pycocotools
-except:
-    print(
-        "[WARNING] pycocotools is not installed, detection model is not available now."
-    )
-    print(
-        "[WARNING] pycocotools install: https://paddlex.readthedocs.io/zh_CN/develop/install.html#pycocotools"
-    )
+log_level = 2
 
-env_info = get_environ_info()
-load_model = cv.models.load_model
-datasets = cv.datasets
-transforms = cv.transforms
+# 子模块及常用接口在首次访问时才导入，仅使用paddlex.deploy进行部署时
+# 无需加载训练相关的模块及依赖
+_LAZY_ATTRS = {
+    'cv': ('.cv', None),
+    'det': ('.det', None),
+    'seg': ('.seg', None),
+    'cls': ('.cls', None),
+    'slim': ('.slim', None),
+    'converter': ('.converter', None),
+    'tools': ('.tools', None),
+    'deploy': ('.deploy', None),
+    'interpret': ('.interpret', None),
+    'load_model': ('.cv.models', 'load_model'),
+    'tune_train_config': ('.cv.models.utils.tuner', 'tune_train_config'),
+    'datasets': ('.cv.datasets', None),
+    'transforms': ('.cv.transforms', None),
+}
+
+_lazy_getattr = lazy_getattr(__name__, _LAZY_ATTRS)
+
+
+def __getattr__(name):
+    if name == 'env_info':
+        global env_info
+        env_info = get_environ_info()
+        return env_info
+    return _lazy_getattr(name)
 
-log_level = 2
 
-from . import interpret
+if sys.version_info < (3, 7):
+    env_info = get_environ_info()
+    import_all(__name__, _LAZY_ATTRS)
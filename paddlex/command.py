@@ -120,15 +120,31 @@ def arg_parser():
         "-tv",
         default=None,
         help="define the value of test dataset(E.g 0.1)")
+    parser.add_argument(
+        "--warmup",
+        "-wu",
+        action="store_true",
+        default=False,
+        help="warm up the inference model with all the input shapes it can receive"
+    )
+    parser.add_argument(
+        "--use_gpu",
+        "-ug",
+        action="store_true",
+        default=False,
+        help="use gpu while warming up the inference model")
+    parser.add_argument(
+        "--use_trt",
+        "-ut",
+        action="store_true",
+        default=False,
+        help="use TensorRT while warming up the inference model")
 
     return parser
 
 
 def main():
     import os
-    os.environ['CUDA_VISIBLE_DEVICES'] = ""
-
-    import paddlex as pdx
 
     if len(sys.argv) < 2:
         print("Use command 'paddlex -h` to print the help information\n")
@@ -136,6 +152,11 @@ def main():
     parser = arg_parser()
     args = parser.parse_args()
 
+    if not (args.warmup and args.use_gpu):
+        os.environ['CUDA_VISIBLE_DEVICES'] = ""
+
+    import paddlex as pdx
+
     if args.version:
         print("PaddleX-{}".format(pdx.__version__))
         print("Repo: https://github.com/PaddlePaddle/PaddleX.git")
@@ -227,7 +248,27 @@ def main():
         pdx.tools.split.dataset_split(dataset_dir, dataset_format, val_value,
                                       test_value, save_dir)
 
-    
+    if args.warmup:
+        assert args.model_dir is not None, "--model_dir should be defined while warming up inference model"
+
+        images = None
+        if args.pics is not None:
+            if not osp.isdir(args.pics):
+                logging.error("The path of pictures {} doesn't exist.".format(
+                    args.pics))
+            images = [
+                osp.join(args.pics, f) for f in sorted(os.listdir(args.pics))
+            ]
+        predictor = pdx.deploy.Predictor(
+            args.model_dir,
+            use_gpu=args.use_gpu,
+            use_trt=args.use_trt,
+            optim_cache_dir=args.save_dir)
+        predictor.warmup(images=images)
+        if args.save_dir is not None:
+            logging.info("Optimized engine caches saved in {}.".format(
+                args.save_dir))
+
 
 
 if __name__ == "__main__":
@@ -12,23 +12,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from . import models
-from . import nets
-from . import transforms
-from . import datasets
+import sys
+from paddlex.utils.lazy_import import lazy_getattr, import_all
 
-cls_transforms = transforms.cls_transforms
-det_transforms = transforms.det_transforms
-seg_transforms = transforms.seg_transforms
+_LAZY_ATTRS = {
+    'models': ('.models', None),
+    'nets': ('.nets', None),
+    'transforms': ('.transforms', None),
+    'datasets': ('.datasets', None),
+    'cls_transforms': ('.transforms.cls_transforms', None),
+    'det_transforms': ('.transforms.det_transforms', None),
+    'seg_transforms': ('.transforms.seg_transforms', None),
+    # classification
+    'ResNet50': ('.models', 'ResNet50'),
+    'DarkNet53': ('.models', 'DarkNet53'),
+    # detection
+    'YOLOv3': ('.models', 'YOLOv3'),
+    'PPYOLO': ('.models', 'PPYOLO'),
+    'FasterRCNN': ('.models', 'FasterRCNN'),
+    'MaskRCNN': ('.models', 'MaskRCNN'),
+    'UNet': ('.models', 'UNet'),
+    'DeepLabv3p': ('.models', 'DeepLabv3p'),
+}
 
-# classification
-ResNet50 = models.ResNet50
-DarkNet53 = models.DarkNet53
-# detection
-YOLOv3 = models.YOLOv3
-PPYOLO = models.PPYOLO
-#EAST = models.EAST
-FasterRCNN = models.FasterRCNN
-MaskRCNN = models.MaskRCNN
-UNet = models.UNet
-DeepLabv3p = models.DeepLabv3p
+__getattr__ = lazy_getattr(__name__, _LAZY_ATTRS)
+
+if sys.version_info < (3, 7):
+    import_all(__name__, _LAZY_ATTRS)
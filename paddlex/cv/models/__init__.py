@@ -12,38 +12,50 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .classifier import BaseClassifier
-from .classifier import ResNet18
-from .classifier import ResNet34
-from .classifier import ResNet50
-from .classifier import ResNet101
-from .classifier import ResNet50_vd
-from .classifier import ResNet101_vd
-from .classifier import ResNet50_vd_ssld
-from .classifier import ResNet101_vd_ssld
-from .classifier import DarkNet53
-from .classifier import MobileNetV1
-from .classifier import MobileNetV2
-from .classifier import MobileNetV3_small
-from .classifier import MobileNetV3_large
-from .classifier import MobileNetV3_small_ssld
-from .classifier import MobileNetV3_large_ssld
-from .classifier import Xception41
-from .classifier import Xception65
-from .classifier import DenseNet121
-from .classifier import DenseNet161
-from .classifier import DenseNet201
-from .classifier import ShuffleNetV2
-from .classifier import HRNet_W18
-from .classifier import AlexNet
-from .base import BaseAPI
-from .yolo_v3 import YOLOv3
-from .ppyolo import PPYOLO
-from .faster_rcnn import FasterRCNN
-from .mask_rcnn import MaskRCNN
-from .unet import UNet
-from .deeplabv3p import DeepLabv3p
-from .hrnet import HRNet
-from .fast_scnn import FastSCNN
-from .load_model import load_model
-from .slim import prune
+import sys
+from paddlex.utils.lazy_import import lazy_getattr, import_all
+
+# 模型类在首次访问时才导入对应模块
+_LAZY_ATTRS = {
+    'BaseClassifier': ('.classifier', 'BaseClassifier'),
+    'ResNet18': ('.classifier', 'ResNet18'),
+    'ResNet34': ('.classifier', 'ResNet34'),
+    'ResNet50': ('.classifier', 'ResNet50'),
+    'ResNet101': ('.classifier', 'ResNet101'),
+    'ResNet50_vd': ('.classifier', 'ResNet50_vd'),
+    'ResNet101_vd': ('.classifier', 'ResNet101_vd'),
+    'ResNet50_vd_ssld': ('.classifier', 'ResNet50_vd_ssld'),
+    'ResNet101_vd_ssld': ('.classifier', 'ResNet101_vd_ssld'),
+    'DarkNet53': ('.classifier', 'DarkNet53'),
+    'MobileNetV1': ('.classifier', 'MobileNetV1'),
+    'MobileNetV2': ('.classifier', 'MobileNetV2'),
+    'MobileNetV3_small': ('.classifier', 'MobileNetV3_small'),
+    'MobileNetV3_large': ('.classifier', 'MobileNetV3_large'),
+    'MobileNetV3_small_ssld': ('.classifier', 'MobileNetV3_small_ssld'),
+    'MobileNetV3_large_ssld': ('.classifier', 'MobileNetV3_large_ssld'),
+    'Xception41': ('.classifier', 'Xception41'),
+    'Xception65': ('.classifier', 'Xception65'),
+    'DenseNet121': ('.classifier', 'DenseNet121'),
+    'DenseNet161': ('.classifier', 'DenseNet161'),
+    'DenseNet201': ('.classifier', 'DenseNet201'),
+    'ShuffleNetV2': ('.classifier', 'ShuffleNetV2'),
+    'HRNet_W18': ('.classifier', 'HRNet_W18'),
+    'AlexNet': ('.classifier', 'AlexNet'),
+    'BaseAPI': ('.base', 'BaseAPI'),
+    'YOLOv3': ('.yolo_v3', 'YOLOv3'),
+    'PPYOLO': ('.ppyolo', 'PPYOLO'),
+    'FasterRCNN': ('.faster_rcnn', 'FasterRCNN'),
+    'MaskRCNN': ('.mask_rcnn', 'MaskRCNN'),
+    'UNet': ('.unet', 'UNet'),
+    'DeepLabv3p': ('.deeplabv3p', 'DeepLabv3p'),
+    'HRNet': ('.hrnet', 'HRNet'),
+    'FastSCNN': ('.fast_scnn', 'FastSCNN'),
+    'load_model': ('.load_model', 'load_model'),
+    'prune': ('.slim.prune', None),
+    'utils': ('.utils', None),
+}
+
+__getattr__ = lazy_getattr(__name__, _LAZY_ATTRS)
+
+if sys.version_info < (3, 7):
+    import_all(__name__, _LAZY_ATTRS)
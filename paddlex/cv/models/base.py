@@ -13,6 +13,7 @@
 # limitations under the License.
 
 from __future__ import absolute_import
+import paddle
 import paddle.fluid as fluid
 import os
 import sys
@@ -22,10 +23,13 @@ import math
 import yaml
 import copy
 import json
+import pickle
 import functools
 import multiprocessing as mp
 import paddlex.utils.logging as logging
 from paddlex.utils import seconds_to_hms
+from paddlex.utils.stats import StepTimer, get_queue_size
+from paddlex.utils.checkpoint_writer import CheckpointWriter, write_checkpoint
 from paddlex.utils.utils import EarlyStop
 from paddlex.cv.transforms import arrange_transforms
 import paddlex
@@ -33,6 +37,7 @@ from collections import OrderedDict
 from os import path as osp
 from paddle.fluid.framework import Program
 from .utils.pretrain_weights import get_pretrain_weights
+from .utils.staged_eval import StagedEval
 
 
 def dict2str(dict_input):
@@ -46,6 +51,39 @@ def dict2str(dict_input):
     return out.strip(', ')
 
 
+def _to_json_serializable(obj):
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    raise TypeError("Object of type {} is not JSON serializable".format(
+        type(obj).__name__))
+
+
+def _mean_outputs(outputs):
+    # 各卡输出的均值
+    outputs = [np.array(output) for output in outputs]
+    return np.mean(np.array(outputs), axis=1)
+
+
+def _dump_pickle(obj, path):
+    with open(path, 'wb') as f:
+        pickle.dump(obj, f, protocol=2)
+
+
+def _dump_yaml(obj, path):
+    with open(path, encoding='utf-8', mode='w') as f:
+        yaml.dump(obj, f)
+
+
+def _dump_json(obj, path):
+    with open(path, 'w') as f:
+        json.dump(obj, f, default=_to_json_serializable)
+
+
+def _dump_bytes(obj, path):
+    with open(path, 'wb') as f:
+        f.write(obj)
+
+
 class BaseAPI:
     def __init__(self, model_type):
         self.model_type = model_type
@@ -96,13 +134,35 @@ class BaseAPI:
                             .format(paddlex.env_info['num'], paddlex.env_info[
                                 'place']))
 
-    def build_program(self):
+    def build_program(self, accumulate_steps=1):
         if hasattr(paddlex, 'model_built') and paddlex.model_built:
             logging.error(
                 "Function model.train() only can be called once in your code.")
         paddlex.model_built = True
-        # 构建训练网络
-        self.train_inputs, self.train_outputs = self.build_net(mode='train')
+        if accumulate_steps < 1:
+            raise Exception("accumulate_steps should be at least 1.")
+        # GradientMergeOptimizer去除了梯度的op_role_var属性，多卡训练时不再插入
+        # 梯度的allreduce，各卡参数会各自更新
+        if accumulate_steps > 1 and paddlex.env_info['num'] > 1:
+            raise Exception(
+                "accumulate_steps > 1 is only supported in single card training, but {} cards are used now.".
+                format(paddlex.env_info['num']))
+        # Paddle 1.8中没有GradientMergeOptimizer
+        if accumulate_steps > 1 and not hasattr(fluid.optimizer,
+                                                'GradientMergeOptimizer'):
+            raise Exception(
+                "accumulate_steps > 1 requires fluid.optimizer.GradientMergeOptimizer, which is not available in paddle {}. Please upgrade paddle to 2.0 or later, or set accumulate_steps to 1.".
+                format(paddle.__version__))
+        # 构建训练网络，梯度累积时每accumulate_steps步才执行一次参数更新
+        optimizer = self.optimizer
+        if accumulate_steps > 1:
+            self.optimizer = fluid.optimizer.GradientMergeOptimizer(
+                optimizer, k_steps=accumulate_steps, avg=True)
+        try:
+            self.train_inputs, self.train_outputs = self.build_net(
+                mode='train')
+        finally:
+            self.optimizer = optimizer
         self.train_prog = fluid.default_main_program()
         startup_prog = fluid.default_startup_program()
 
@@ -195,7 +255,9 @@ class BaseAPI:
                        save_dir='.',
                        sensitivities_file=None,
                        eval_metric_loss=0.05,
-                       resume_checkpoint=None):
+                       resume_checkpoint=None,
+                       latency_file=None,
+                       target_latency_ms=None):
         if not resume_checkpoint:
             pretrain_dir = osp.join(save_dir, 'pretrain')
             if not os.path.isdir(pretrain_dir):
@@ -267,14 +329,28 @@ class BaseAPI:
             sensitivities_file = get_sensitivities(sensitivities_file, self,
                                                    save_dir)
             from .slim.prune import get_params_ratios, prune_program
-            logging.info(
-                "Start to prune program with eval_metric_loss = {}".format(
-                    eval_metric_loss),
-                use_color=True)
+            from .slim.prune import get_params_ratios_by_latency
             origin_flops = paddleslim.analysis.flops(self.test_prog)
-            prune_params_ratios = get_params_ratios(
-                sensitivities_file, eval_metric_loss=eval_metric_loss)
-            prune_program(self, prune_params_ratios)
+            if target_latency_ms is not None:
+                if latency_file is None:
+                    raise Exception(
+                        "latency_file should be set when target_latency_ms is set."
+                    )
+                logging.info(
+                    "Start to prune program with target_latency_ms = {}".
+                    format(target_latency_ms),
+                    use_color=True)
+                prune_params_ratios = get_params_ratios_by_latency(
+                    self, sensitivities_file, latency_file, target_latency_ms)
+            else:
+                logging.info(
+                    "Start to prune program with eval_metric_loss = {}".format(
+                        eval_metric_loss),
+                    use_color=True)
+                prune_params_ratios = get_params_ratios(
+                    sensitivities_file, eval_metric_loss=eval_metric_loss)
+            if len(prune_params_ratios) > 0:
+                prune_program(self, prune_params_ratios)
             current_flops = paddleslim.analysis.flops(self.test_prog)
             remaining_ratio = current_flops / origin_flops
             logging.info(
@@ -340,42 +416,60 @@ class BaseAPI:
         info['completed_epochs'] = self.completed_epochs
         return info
 
-    def save_model(self, save_dir):
-        if not osp.isdir(save_dir):
-            if osp.exists(save_dir):
-                os.remove(save_dir)
-            os.makedirs(save_dir)
-        if self.train_prog is not None:
-            fluid.save(self.train_prog, osp.join(save_dir, 'model'))
-        else:
-            fluid.save(self.test_prog, osp.join(save_dir, 'model'))
+    def _snapshot_model(self):
+        """将模型参数、优化器状态及配置复制到内存，文件格式与fluid.save一致。
+
+        Returns:
+            list: 由文件名和写文件的函数组成的列表，用于paddlex.utils.checkpoint_writer。
+        """
+        program = self.train_prog
+        if program is None:
+            program = self.test_prog
+
+        def get_tensor(var):
+            return np.array(fluid.global_scope().find_var(var.name)
+                            .get_tensor())
+
+        param_dict = {
+            var.name: get_tensor(var)
+            for var in filter(fluid.io.is_parameter, program.list_vars())
+        }
+        opt_dict = {
+            var.name: get_tensor(var)
+            for var in filter(fluid.io.is_belong_to_optimizer,
+                              program.list_vars())
+        }
+        program.desc.flush()
+        files = [
+            ('model.pdparams', functools.partial(_dump_pickle, param_dict)),
+            ('model.pdopt', functools.partial(_dump_pickle, opt_dict)),
+            ('model.pdmodel', functools.partial(
+                _dump_bytes, program.desc.serialize_to_string())),
+        ]
         model_info = self.get_model_info()
         model_info['status'] = self.status
-        with open(
-                osp.join(save_dir, 'model.yml'), encoding='utf-8',
-                mode='w') as f:
-            yaml.dump(model_info, f)
+        files.append(('model.yml', functools.partial(_dump_yaml, model_info)))
         # 评估结果保存
-        if hasattr(self, 'eval_details'):
-            with open(osp.join(save_dir, 'eval_details.json'), 'w') as f:
-                json.dump(self.eval_details, f)
+        if getattr(self, 'eval_details', None) is not None:
+            files.append(('eval_details.json', functools.partial(
+                _dump_json, self.eval_details)))
 
         if self.status == 'Prune':
             # 保存裁剪的shape
             shapes = {}
             for block in self.train_prog.blocks:
                 for param in block.all_parameters():
-                    pd_var = fluid.global_scope().find_var(param.name)
-                    pd_param = pd_var.get_tensor()
-                    shapes[param.name] = np.array(pd_param).shape
-            with open(
-                    osp.join(save_dir, 'prune.yml'), encoding='utf-8',
-                    mode='w') as f:
-                yaml.dump(shapes, f)
+                    if param.name in param_dict:
+                        shapes[param.name] = param_dict[param.name].shape
+                    else:
+                        pd_var = fluid.global_scope().find_var(param.name)
+                        shapes[param.name] = np.array(pd_var.get_tensor(
+                        )).shape
+            files.append(('prune.yml', functools.partial(_dump_yaml, shapes)))
+        return files
 
-        # 模型保存成功的标志
-        open(osp.join(save_dir, '.success'), 'w').close()
-        logging.info("Model saved in {}.".format(save_dir))
+    def save_model(self, save_dir):
+        write_checkpoint(save_dir, self._snapshot_model(), atomic=False)
 
     def export_inference_model(self, save_dir):
         test_input_names = [
@@ -422,7 +516,10 @@ class BaseAPI:
                    save_dir='output',
                    use_vdl=False,
                    early_stop=False,
-                   early_stop_patience=5):
+                   early_stop_patience=5,
+                   staged_eval_ratio=None,
+                   keep_checkpoint_max=None,
+                   accumulate_steps=1):
         if train_dataset.num_samples < train_batch_size:
             raise Exception(
                 'The amount of training datset must be larger than batch size.')
@@ -470,6 +567,10 @@ class BaseAPI:
 
         total_num_steps = math.floor(train_dataset.num_samples /
                                      train_batch_size)
+        if accumulate_steps > 1:
+            logging.info(
+                "Gradients are accumulated over {} steps, the effective batch size is {}."
+                .format(accumulate_steps, train_batch_size * accumulate_steps))
         num_steps = 0
         time_stat = list()
         time_train_one_epoch = None
@@ -486,6 +587,11 @@ class BaseAPI:
             total_num_steps_eval = math.ceil(eval_dataset.num_samples /
                                              eval_batch_size)
 
+        staged_eval = None
+        if eval_dataset is not None and staged_eval_ratio is not None:
+            staged_eval = StagedEval(eval_dataset, self.model_type,
+                                     staged_eval_ratio)
+
         if use_vdl:
             # VisualDL component
             log_writer = LogWriter(vdl_logdir)
@@ -500,115 +606,170 @@ class BaseAPI:
         # task_id: 目前由PaddleX GUI赋值
         # 用于在VisualDL日志中注明所属任务id
         task_id = getattr(paddlex, "task_id", "")
-        for i in range(start_epoch, num_epochs):
-            records = list()
-            step_start_time = time.time()
-            epoch_start_time = time.time()
-            for step, data in enumerate(self.train_data_loader()):
-                outputs = self.exe.run(
-                    self.parallel_train_prog,
-                    feed=data,
-                    fetch_list=list(self.train_outputs.values()))
-                outputs_avg = np.mean(np.array(outputs), axis=1)
-                records.append(outputs_avg)
-
-                # 训练完成剩余时间预估
-                current_time = time.time()
-                step_cost_time = current_time - step_start_time
-                step_start_time = current_time
-                if len(time_stat) < 20:
-                    time_stat.append(step_cost_time)
-                else:
-                    time_stat[num_steps % 20] = step_cost_time
-
-                # 每间隔log_interval_steps，输出loss信息
-                num_steps += 1
-                if num_steps % log_interval_steps == 0:
-                    step_metrics = OrderedDict(
-                        zip(list(self.train_outputs.keys()), outputs_avg))
-
-                    if use_vdl:
-                        for k, v in step_metrics.items():
-                            log_writer.add_scalar(
-                                '{}-Metrics/Training(Step): {}'.format(
-                                    task_id, k), v, num_steps)
-
-                    # 估算剩余时间
-                    avg_step_time = np.mean(time_stat)
-                    if time_train_one_epoch is not None:
-                        eta = (num_epochs - i - 1) * time_train_one_epoch + (
-                            total_num_steps - step - 1) * avg_step_time
-                    else:
-                        eta = ((num_epochs - i) * total_num_steps - step - 1
-                               ) * avg_step_time
-                    if time_eval_one_epoch is not None:
-                        eval_eta = (
-                            total_eval_times - i // save_interval_epochs
-                        ) * time_eval_one_epoch
+        # 统计每步读取数据、执行网络、获取输出的耗时，每轮的统计结果保存在train_timing.json中
+        step_timer = StepTimer(
+            train_batch_size,
+            summary_file=osp.join(save_dir, 'train_timing.json'),
+            start_epoch=start_epoch)
+        # 模型在后台线程中保存，训练线程只需将参数复制到内存
+        checkpoint_writer = CheckpointWriter(keep_checkpoint_max)
+        try:
+            for i in range(start_epoch, num_epochs):
+                # 各步输出的均值，及尚未转换为numpy的输出
+                records = list()
+                pending_outputs = list()
+                stop_training = False
+                step_start_time = time.time()
+                epoch_start_time = time.time()
+                step_timer.start()
+                for step, data in enumerate(self.train_data_loader()):
+                    step_timer.record('reader_cost')
+                    outputs = self.exe.run(
+                        self.parallel_train_prog,
+                        feed=data,
+                        fetch_list=list(self.train_outputs.values()),
+                        return_numpy=False)
+                    step_timer.record('executor_cost')
+                    # 输出在日志步或每轮结束时才转换为numpy，转换耗时计入当步的fetch_cost
+                    pending_outputs.append(outputs)
+                    if (num_steps + 1) % log_interval_steps == 0:
+                        records.extend(
+                            _mean_outputs(r) for r in pending_outputs)
+                        pending_outputs = list()
+                    step_timer.record('fetch_cost')
+                    step_timer.step(get_queue_size(self.train_data_loader))
+
+                    # 训练完成剩余时间预估
+                    current_time = time.time()
+                    step_cost_time = current_time - step_start_time
+                    step_start_time = current_time
+                    if len(time_stat) < 20:
+                        time_stat.append(step_cost_time)
                     else:
-                        eval_eta = (
-                            total_eval_times - i // save_interval_epochs
-                        ) * total_num_steps_eval * avg_step_time
-                    eta_str = seconds_to_hms(eta + eval_eta)
-
-                    logging.info(
-                        "[TRAIN] Epoch={}/{}, Step={}/{}, {}, time_each_step={}s, eta={}"
-                        .format(i + 1, num_epochs, step + 1, total_num_steps,
-                                dict2str(step_metrics),
-                                round(avg_step_time, 2), eta_str))
-            train_metrics = OrderedDict(
-                zip(list(self.train_outputs.keys()), np.mean(
-                    records, axis=0)))
-            logging.info('[TRAIN] Epoch {} finished, {} .'.format(
-                i + 1, dict2str(train_metrics)))
-            time_train_one_epoch = time.time() - epoch_start_time
-            epoch_start_time = time.time()
-
-            # 每间隔save_interval_epochs, 在验证集上评估和对模型进行保存
-            self.completed_epochs += 1
-            eval_epoch_start_time = time.time()
-            if (i + 1) % save_interval_epochs == 0 or i == num_epochs - 1:
-                current_save_dir = osp.join(save_dir, "epoch_{}".format(i + 1))
-                if not osp.isdir(current_save_dir):
-                    os.makedirs(current_save_dir)
-                if getattr(self, 'use_ema', False):
-                    self.exe.run(self.ema.apply_program)
-                if eval_dataset is not None and eval_dataset.num_samples > 0:
-                    self.eval_metrics, self.eval_details = self.evaluate(
-                        eval_dataset=eval_dataset,
-                        batch_size=eval_batch_size,
-                        epoch_id=i + 1,
-                        return_details=True)
-                    logging.info('[EVAL] Finished, Epoch={}, {} .'.format(
-                        i + 1, dict2str(self.eval_metrics)))
-                    # 保存最优模型
-                    best_accuracy_key = list(self.eval_metrics.keys())[0]
-                    current_accuracy = self.eval_metrics[best_accuracy_key]
-                    if current_accuracy > best_accuracy:
-                        best_accuracy = current_accuracy
-                        best_model_epoch = i + 1
-                        best_model_dir = osp.join(save_dir, "best_model")
-                        self.save_model(save_dir=best_model_dir)
-                    if use_vdl:
-                        for k, v in self.eval_metrics.items():
-                            if isinstance(v, list):
-                                continue
-                            if isinstance(v, np.ndarray):
-                                if v.size > 1:
-                                    continue
-                            log_writer.add_scalar(
-                                "{}-Metrics/Eval(Epoch): {}".format(
-                                    task_id, k), v, i + 1)
-                self.save_model(save_dir=current_save_dir)
-                if getattr(self, 'use_ema', False):
-                    self.exe.run(self.ema.restore_program)
-                time_eval_one_epoch = time.time() - eval_epoch_start_time
+                        time_stat[num_steps % 20] = step_cost_time
+
+                    # 每间隔log_interval_steps，输出loss信息
+                    num_steps += 1
+                    if num_steps % log_interval_steps == 0:
+                        step_metrics = OrderedDict(
+                            zip(list(self.train_outputs.keys()), records[-1]))
+
+                        step_timing = step_timer.log_values()
+                        if use_vdl:
+                            for k, v in step_metrics.items():
+                                log_writer.add_scalar(
+                                    '{}-Metrics/Training(Step): {}'.format(
+                                        task_id, k), v, num_steps)
+                            for k, v in step_timing.items():
+                                log_writer.add_scalar(
+                                    '{}-Timing/Training(Step): {}'.format(
+                                        task_id, k), v, num_steps)
+
+                        # 估算剩余时间
+                        avg_step_time = np.mean(time_stat)
+                        if time_train_one_epoch is not None:
+                            eta = (num_epochs - i - 1) * time_train_one_epoch + (
+                                total_num_steps - step - 1) * avg_step_time
+                        else:
+                            eta = ((num_epochs - i) * total_num_steps - step - 1
+                                   ) * avg_step_time
+                        if time_eval_one_epoch is not None:
+                            eval_eta = (
+                                total_eval_times - i // save_interval_epochs
+                            ) * time_eval_one_epoch
+                        else:
+                            eval_eta = (
+                                total_eval_times - i // save_interval_epochs
+                            ) * total_num_steps_eval * avg_step_time
+                        eta_str = seconds_to_hms(eta + eval_eta)
+
+                        logging.info(
+                            "[TRAIN] Epoch={}/{}, Step={}/{}, {}, time_each_step={}s, {}, eta={}"
+                            .format(i + 1, num_epochs, step + 1, total_num_steps,
+                                    dict2str(step_metrics),
+                                    round(avg_step_time, 2),
+                                    StepTimer.format(step_timing), eta_str))
+                fetch_start_time = time.time()
+                records.extend(_mean_outputs(r) for r in pending_outputs)
+                step_timer.amend('fetch_cost', time.time() - fetch_start_time)
+                train_metrics = OrderedDict(
+                    zip(list(self.train_outputs.keys()),
+                        np.mean(records, axis=0)))
+                logging.info('[TRAIN] Epoch {} finished, {} .'.format(
+                    i + 1, dict2str(train_metrics)))
+                time_train_one_epoch = time.time() - epoch_start_time
+                epoch_start_time = time.time()
+
+                # 每间隔save_interval_epochs, 在验证集上评估和对模型进行保存
+                self.completed_epochs += 1
                 eval_epoch_start_time = time.time()
-                if best_model_epoch > 0:
-                    logging.info(
-                        'Current evaluated best model in eval_dataset is epoch_{}, {}={}'
-                        .format(best_model_epoch, best_accuracy_key,
-                                best_accuracy))
-                if eval_dataset is not None and early_stop:
-                    if earlystop(current_accuracy):
-                        break
+                if (i + 1) % save_interval_epochs == 0 or i == num_epochs - 1:
+                    current_save_dir = osp.join(save_dir, "epoch_{}".format(i + 1))
+                    is_best_model = False
+                    if getattr(self, 'use_ema', False):
+                        self.exe.run(self.ema.apply_program)
+                    if eval_dataset is not None and eval_dataset.num_samples > 0:
+                        staged_metrics = None
+                        if staged_eval is not None and best_model_epoch > 0:
+                            staged_metrics = staged_eval(
+                                self, eval_batch_size, i + 1, best_accuracy)
+                        if staged_metrics is not None:
+                            # 当前模型不可能成为最优模型，跳过完整验证集的评估
+                            self.eval_metrics = staged_metrics
+                            self.eval_details = None
+                            logging.info(
+                                '[EVAL] Finished on the staged subset, Epoch={}, {} .'.
+                                format(i + 1, dict2str(self.eval_metrics)))
+                        else:
+                            eval_start_time = time.time()
+                            self.eval_metrics, self.eval_details = self.evaluate(
+                                eval_dataset=eval_dataset,
+                                batch_size=eval_batch_size,
+                                epoch_id=i + 1,
+                                return_details=True)
+                            step_timer.add('eval_cost',
+                                           time.time() - eval_start_time)
+                            logging.info('[EVAL] Finished, Epoch={}, {} .'.format(
+                                i + 1, dict2str(self.eval_metrics)))
+                        # 保存最优模型
+                        best_accuracy_key = list(self.eval_metrics.keys())[0]
+                        current_accuracy = self.eval_metrics[best_accuracy_key]
+                        if current_accuracy > best_accuracy:
+                            best_accuracy = current_accuracy
+                            best_model_epoch = i + 1
+                            is_best_model = True
+                        if use_vdl:
+                            for k, v in self.eval_metrics.items():
+                                if isinstance(v, list):
+                                    continue
+                                if isinstance(v, np.ndarray):
+                                    if v.size > 1:
+                                        continue
+                                log_writer.add_scalar(
+                                    "{}-Metrics/Eval(Epoch): {}".format(
+                                        task_id, k), v, i + 1)
+                    save_start_time = time.time()
+                    checkpoint_writer.save(current_save_dir,
+                                           self._snapshot_model())
+                    if is_best_model:
+                        # 最优模型与当前轮的模型相同，以硬链接的方式保存
+                        checkpoint_writer.link(current_save_dir,
+                                               osp.join(save_dir, "best_model"))
+                    step_timer.add('checkpoint_cost',
+                                   time.time() - save_start_time)
+                    if getattr(self, 'use_ema', False):
+                        self.exe.run(self.ema.restore_program)
+                    time_eval_one_epoch = time.time() - eval_epoch_start_time
+                    eval_epoch_start_time = time.time()
+                    if best_model_epoch > 0:
+                        logging.info(
+                            'Current evaluated best model in eval_dataset is epoch_{}, {}={}'
+                            .format(best_model_epoch, best_accuracy_key,
+                                    best_accuracy))
+                    if eval_dataset is not None and early_stop:
+                        stop_training = earlystop(current_accuracy)
+                step_timer.end_epoch(i + 1)
+                if stop_training:
+                    break
+        finally:
+            checkpoint_writer.close()
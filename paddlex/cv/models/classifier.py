@@ -13,6 +13,8 @@
 # limitations under the License.
 
 from __future__ import absolute_import
+import os
+import os.path as osp
 import numpy as np
 import time
 import math
@@ -26,6 +28,7 @@ from paddlex.cv.transforms import arrange_transforms
 from paddlex.cv.datasets import generate_minibatch
 from collections import OrderedDict
 from .base import BaseAPI
+from .utils.eval_pipeline import EvalPipeline
 
 
 class BaseClassifier(BaseAPI):
@@ -148,7 +151,12 @@ class BaseClassifier(BaseAPI):
               eval_metric_loss=0.05,
               early_stop=False,
               early_stop_patience=5,
-              resume_checkpoint=None):
+              resume_checkpoint=None,
+              staged_eval_ratio=None,
+              latency_file=None,
+              target_latency_ms=None,
+              keep_checkpoint_max=None,
+              accumulate_steps=1):
         """训练。
         Args:
             num_epochs (int): 训练迭代轮数。
@@ -175,6 +183,16 @@ class BaseClassifier(BaseAPI):
             early_stop_patience (int): 当使用提前终止训练策略时，如果验证集精度在`early_stop_patience`个epoch内
                 连续下降或持平，则终止训练。默认值为5。
             resume_checkpoint (str): 恢复训练时指定上次训练保存的模型路径。若为None，则不会恢复训练。默认值为None。
+            staged_eval_ratio (float): 分阶段评估时首先评估的验证集分层子集的比例，取值范围为(0, 1)。
+                若当前模型在子集上精度的置信区间上界低于历史最优精度，则跳过完整验证集的评估；
+                若为None，则每次均在完整验证集上评估。默认为None。
+            latency_file (str): cal_latency_table保存的延时表路径，与target_latency_ms同时设置时按延时目标裁剪。默认为None。
+            target_latency_ms (float): 裁剪后卷积在目标机器CPU上的估计总耗时（ms）。若不为None，则在满足该延时目标的前提下
+                选择敏感度之和最小的裁剪率，eval_metric_loss不再生效。默认为None。
+            keep_checkpoint_max (int): 最多保留的`epoch_N`模型个数，保存新模型后删除轮数最小的模型，best_model总是保留。
+                若为None，则保留所有模型。默认为None。
+            accumulate_steps (int): 梯度累积的步数，每accumulate_steps步更新一次参数，等效的batch大小为
+                train_batch_size * accumulate_steps。默认优化器的warmup_steps按参数更新的次数计算。目前仅支持单卡训练。默认为1。
         Raises:
             ValueError: 模型从inference model进行加载。
         """
@@ -185,14 +203,14 @@ class BaseClassifier(BaseAPI):
             num_steps_each_epoch = train_dataset.num_samples // train_batch_size
             optimizer = self.default_optimizer(
                 learning_rate=learning_rate,
-                warmup_steps=warmup_steps,
+                warmup_steps=warmup_steps * accumulate_steps,
                 warmup_start_lr=warmup_start_lr,
                 lr_decay_epochs=lr_decay_epochs,
                 lr_decay_gamma=lr_decay_gamma,
                 num_steps_each_epoch=num_steps_each_epoch)
         self.optimizer = optimizer
         # 构建训练、验证、预测网络
-        self.build_program()
+        self.build_program(accumulate_steps=accumulate_steps)
         # 初始化网络权重
         self.net_initialize(
             startup_prog=fluid.default_startup_program(),
@@ -200,7 +218,9 @@ class BaseClassifier(BaseAPI):
             save_dir=save_dir,
             sensitivities_file=sensitivities_file,
             eval_metric_loss=eval_metric_loss,
-            resume_checkpoint=resume_checkpoint)
+            resume_checkpoint=resume_checkpoint,
+            latency_file=latency_file,
+            target_latency_ms=target_latency_ms)
         # 训练
         self.train_loop(
             num_epochs=num_epochs,
@@ -212,24 +232,31 @@ class BaseClassifier(BaseAPI):
             save_dir=save_dir,
             use_vdl=use_vdl,
             early_stop=early_stop,
-            early_stop_patience=early_stop_patience)
+            early_stop_patience=early_stop_patience,
+            staged_eval_ratio=staged_eval_ratio,
+            keep_checkpoint_max=keep_checkpoint_max,
+            accumulate_steps=accumulate_steps)
 
     def evaluate(self,
                  eval_dataset,
                  batch_size=1,
                  epoch_id=None,
-                 return_details=False):
+                 return_details=False,
+                 score_cache_dir=None):
         """评估。
         Args:
             eval_dataset (paddlex.datasets): 验证数据读取器。
             batch_size (int): 验证数据批大小。默认为1。
             epoch_id (int): 当前评估模型所在的训练轮数。
             return_details (bool): 是否返回详细信息。
+            score_cache_dir (str): 当return_details为True时，若指定该目录，各样本的预测得分以float16
+                格式写入该目录下的pred_scores.npy并以内存映射的方式返回，以降低大规模评估时的内存占用。默认为None。
         Returns:
           dict: 当return_details为False时，返回dict, 包含关键字：'acc1'、'acc5'，
               分别表示最大值的accuracy、前5个最大值的accuracy。
           tuple (metrics, eval_details): 当return_details为True时，增加返回dict，
-              包含关键字：'true_labels'、'pred_scores'，分别代表真实类别id、每个类别的预测得分。
+              包含关键字：'true_labels'、'pred_scores'，分别代表真实类别id（shape为(N,)的np.ndarray）、
+              每个类别的预测得分（shape为(N, num_classes)的np.ndarray）。
         """
         input_channel = getattr(self, 'input_channel', 3)
         arrange_transforms(
@@ -242,22 +269,37 @@ class BaseClassifier(BaseAPI):
             batch_size=batch_size, drop_last=False)
         k = min(5, self.num_classes)
         total_steps = math.ceil(eval_dataset.num_samples * 1.0 / batch_size)
-        true_labels = list()
-        pred_scores = list()
+        true_labels = np.zeros(eval_dataset.num_samples, dtype='int32')
+        pred_scores = None
+        if return_details:
+            if score_cache_dir is not None:
+                if not osp.isdir(score_cache_dir):
+                    os.makedirs(score_cache_dir)
+                pred_scores = np.lib.format.open_memmap(
+                    osp.join(score_cache_dir, 'pred_scores.npy'),
+                    mode='w+',
+                    dtype='float16',
+                    shape=(eval_dataset.num_samples, self.num_classes))
+            else:
+                pred_scores = np.zeros(
+                    (eval_dataset.num_samples, self.num_classes),
+                    dtype='float32')
         if not hasattr(self, 'parallel_test_prog'):
             with fluid.scope_guard(self.scope):
                 self.parallel_test_prog = fluid.CompiledProgram(
                     self.test_prog).with_data_parallel(
                         share_vars_from=self.parallel_train_prog)
         batch_size_each_gpu = self._get_single_card_bs(batch_size)
+        pipeline = EvalPipeline()
+        offset = 0
         logging.info(
             "Start to evaluating(total_samples={}, total_steps={})...".format(
                 eval_dataset.num_samples, total_steps))
         for step, data in tqdm.tqdm(
                 enumerate(data_generator()), total=total_steps):
             images = np.array([d[0] for d in data]).astype('float32')
-            labels = [d[1] for d in data]
             num_samples = images.shape[0]
+            true_labels[offset:offset + num_samples] = [d[1] for d in data]
             if num_samples < batch_size:
                 num_pad_samples = batch_size - num_samples
                 pad_images = np.tile(images[0:1], (num_pad_samples, 1, 1, 1))
@@ -267,27 +309,46 @@ class BaseClassifier(BaseAPI):
                     self.parallel_test_prog,
                     feed={'image': images},
                     fetch_list=list(self.test_outputs.values()))
-            outputs = [outputs[0][:num_samples]]
-            true_labels.extend(labels)
-            pred_scores.extend(outputs[0].tolist())
+            pipeline.submit(BaseClassifier._count_correct,
+                            outputs[0][:num_samples],
+                            true_labels[offset:offset + num_samples], k,
+                            pred_scores, offset)
+            offset += num_samples
             logging.debug("[EVAL] Epoch={}, Step={}/{}".format(epoch_id, step +
                                                                1, total_steps))
-
-        pred_top1_label = np.argsort(pred_scores)[:, -1]
-        pred_topk_label = np.argsort(pred_scores)[:, -k:]
-        acc1 = sum(pred_top1_label == true_labels) / len(true_labels)
-        acck = sum(
-            [np.isin(x, y)
-             for x, y in zip(true_labels, pred_topk_label)]) / len(true_labels)
+        num_correct1 = 0
+        num_correctk = 0
+        for correct1, correctk in pipeline.join():
+            num_correct1 += correct1
+            num_correctk += correctk
+
+        acc1 = num_correct1 / float(offset)
+        acck = num_correctk / float(offset)
         metrics = OrderedDict([('acc1', acc1), ('acc{}'.format(k), acck)])
         if return_details:
             eval_details = {
-                'true_labels': true_labels,
-                'pred_scores': pred_scores
+                'true_labels': true_labels[:offset],
+                'pred_scores': pred_scores[:offset]
             }
             return metrics, eval_details
         return metrics
 
+    @staticmethod
+    def _count_correct(scores, labels, k, pred_scores=None, offset=0):
+        """统计一个batch中top1及topk预测正确的样本数，pred_scores不为None时将得分写入其中。
+        """
+        if pred_scores is not None:
+            pred_scores[offset:offset + scores.shape[0]] = scores
+        top1 = np.argmax(scores, axis=1)
+        correct1 = int(np.sum(top1 == labels))
+        if k < scores.shape[1]:
+            topk = np.argpartition(scores, -k, axis=1)[:, -k:]
+            correctk = int(
+                np.sum(np.any(topk == labels[:, np.newaxis], axis=1)))
+        else:
+            correctk = scores.shape[0]
+        return correct1, correctk
+
     @staticmethod
     def _preprocess(images,
                     transforms,
@@ -462,7 +523,12 @@ class ResNet50_vd(BaseClassifier):
               eval_metric_loss=0.05,
               early_stop=False,
               early_stop_patience=5,
-              resume_checkpoint=None):
+              resume_checkpoint=None,
+              staged_eval_ratio=None,
+              latency_file=None,
+              target_latency_ms=None,
+              keep_checkpoint_max=None,
+              accumulate_steps=1):
         """训练。
         Args:
             num_epochs (int): 训练迭代轮数。
@@ -489,6 +555,16 @@ class ResNet50_vd(BaseClassifier):
             early_stop_patience (int): 当使用提前终止训练策略时，如果验证集精度在`early_stop_patience`个epoch内
                 连续下降或持平，则终止训练。默认值为5。
             resume_checkpoint (str): 恢复训练时指定上次训练保存的模型路径。若为None，则不会恢复训练。默认值为None。
+            staged_eval_ratio (float): 分阶段评估时首先评估的验证集分层子集的比例，取值范围为(0, 1)。
+                若当前模型在子集上精度的置信区间上界低于历史最优精度，则跳过完整验证集的评估；
+                若为None，则每次均在完整验证集上评估。默认为None。
+            latency_file (str): cal_latency_table保存的延时表路径，与target_latency_ms同时设置时按延时目标裁剪。默认为None。
+            target_latency_ms (float): 裁剪后卷积在目标机器CPU上的估计总耗时（ms）。若不为None，则在满足该延时目标的前提下
+                选择敏感度之和最小的裁剪率，eval_metric_loss不再生效。默认为None。
+            keep_checkpoint_max (int): 最多保留的`epoch_N`模型个数，保存新模型后删除轮数最小的模型，best_model总是保留。
+                若为None，则保留所有模型。默认为None。
+            accumulate_steps (int): 梯度累积的步数，每accumulate_steps步更新一次参数，等效的batch大小为
+                train_batch_size * accumulate_steps。默认优化器的warmup_steps按参数更新的次数计算。目前仅支持单卡训练。默认为1。
         Raises:
             ValueError: 模型从inference model进行加载。
         """
@@ -498,7 +574,12 @@ class ResNet50_vd(BaseClassifier):
             pretrain_weights, optimizer, learning_rate, warmup_steps,
             warmup_start_lr, lr_decay_epochs, lr_decay_gamma, use_vdl,
             sensitivities_file, eval_metric_loss, early_stop,
-            early_stop_patience, resume_checkpoint)
+            early_stop_patience, resume_checkpoint,
+            staged_eval_ratio=staged_eval_ratio,
+            latency_file=latency_file,
+            target_latency_ms=target_latency_ms,
+            keep_checkpoint_max=keep_checkpoint_max,
+            accumulate_steps=accumulate_steps)
 
 
 class ResNet101_vd(BaseClassifier):
@@ -28,6 +28,7 @@ from paddlex.cv.transforms.seg_transforms import Compose
 from collections import OrderedDict
 from .base import BaseAPI
 from .utils.seg_eval import ConfusionMatrix
+from .utils.eval_pipeline import EvalPipeline
 from .utils.visualize import visualize_segmentation
 
 
@@ -289,7 +290,12 @@ class DeepLabv3p(BaseAPI):
               eval_metric_loss=0.05,
               early_stop=False,
               early_stop_patience=5,
-              resume_checkpoint=None):
+              resume_checkpoint=None,
+              staged_eval_ratio=None,
+              latency_file=None,
+              target_latency_ms=None,
+              keep_checkpoint_max=None,
+              accumulate_steps=1):
         """训练。
 
         Args:
@@ -316,6 +322,16 @@ class DeepLabv3p(BaseAPI):
             early_stop_patience (int): 当使用提前终止训练策略时，如果验证集精度在`early_stop_patience`个epoch内
                 连续下降或持平，则终止训练。默认值为5。
             resume_checkpoint (str): 恢复训练时指定上次训练保存的模型路径。若为None，则不会恢复训练。默认值为None。
+            staged_eval_ratio (float): 分阶段评估时首先评估的验证集分层子集的比例，取值范围为(0, 1)。
+                若当前模型在子集上精度的置信区间上界低于历史最优精度，则跳过完整验证集的评估；
+                若为None，则每次均在完整验证集上评估。默认为None。
+            latency_file (str): cal_latency_table保存的延时表路径，与target_latency_ms同时设置时按延时目标裁剪。默认为None。
+            target_latency_ms (float): 裁剪后卷积在目标机器CPU上的估计总耗时（ms）。若不为None，则在满足该延时目标的前提下
+                选择敏感度之和最小的裁剪率，eval_metric_loss不再生效。默认为None。
+            keep_checkpoint_max (int): 最多保留的`epoch_N`模型个数，保存新模型后删除轮数最小的模型，best_model总是保留。
+                若为None，则保留所有模型。默认为None。
+            accumulate_steps (int): 梯度累积的步数，每accumulate_steps步更新一次参数，等效的batch大小为
+                train_batch_size * accumulate_steps。默认优化器的warmup_steps按参数更新的次数计算。目前仅支持单卡训练。默认为1。
 
         Raises:
             ValueError: 模型从inference model进行加载。
@@ -335,7 +351,7 @@ class DeepLabv3p(BaseAPI):
 
         self.optimizer = optimizer
         # 构建训练、验证、预测网络
-        self.build_program()
+        self.build_program(accumulate_steps=accumulate_steps)
         # 初始化网络权重
         self.net_initialize(
             startup_prog=fluid.default_startup_program(),
@@ -343,7 +359,9 @@ class DeepLabv3p(BaseAPI):
             save_dir=save_dir,
             sensitivities_file=sensitivities_file,
             eval_metric_loss=eval_metric_loss,
-            resume_checkpoint=resume_checkpoint)
+            resume_checkpoint=resume_checkpoint,
+            latency_file=latency_file,
+            target_latency_ms=target_latency_ms)
         # 训练
         self.train_loop(
             num_epochs=num_epochs,
@@ -355,7 +373,10 @@ class DeepLabv3p(BaseAPI):
             save_dir=save_dir,
             use_vdl=use_vdl,
             early_stop=early_stop,
-            early_stop_patience=early_stop_patience)
+            early_stop_patience=early_stop_patience,
+            staged_eval_ratio=staged_eval_ratio,
+            keep_checkpoint_max=keep_checkpoint_max,
+            accumulate_steps=accumulate_steps)
 
     def evaluate(self,
                  eval_dataset,
@@ -383,6 +404,7 @@ class DeepLabv3p(BaseAPI):
             mode='eval')
         total_steps = math.ceil(eval_dataset.num_samples * 1.0 / batch_size)
         conf_mat = ConfusionMatrix(self.num_classes, streaming=True)
+        pipeline = EvalPipeline()
         data_generator = eval_dataset.generator(
             batch_size=batch_size, drop_last=False)
         if not hasattr(self, 'parallel_test_prog'):
@@ -415,25 +437,12 @@ class DeepLabv3p(BaseAPI):
             if num_samples < batch_size:
                 pred = pred[0:num_samples]
 
-            for i in range(num_samples):
-                one_pred = np.squeeze(pred[i]).astype('uint8')
-                one_label = labels[i]
-                for info in im_info[i][::-1]:
-                    if info[0] == 'resize':
-                        w, h = info[1][1], info[1][0]
-                        one_pred = cv2.resize(one_pred, (w, h),
-                                              cv2.INTER_NEAREST)
-                    elif info[0] == 'padding':
-                        w, h = info[1][1], info[1][0]
-                        one_pred = one_pred[0:h, 0:w]
-                one_pred = one_pred.astype('int64')
-                one_pred = one_pred[np.newaxis, :, :, np.newaxis]
-                one_label = one_label[np.newaxis, np.newaxis, :, :]
-                mask = one_label != self.ignore_index
-                conf_mat.calculate(pred=one_pred, label=one_label, ignore=mask)
-            _, iou = conf_mat.mean_iou()
-            logging.debug("[EVAL] Epoch={}, Step={}/{}, iou={}".format(
-                epoch_id, step + 1, total_steps, iou))
+            pipeline.submit(self._update_confusion_matrix, pred, im_info,
+                            labels)
+            logging.debug("[EVAL] Epoch={}, Step={}/{}".format(
+                epoch_id, step + 1, total_steps))
+        for batch_conf_mat in pipeline.join():
+            conf_mat.merge(batch_conf_mat)
 
         category_iou, miou = conf_mat.mean_iou()
         category_acc, oacc = conf_mat.accuracy()
@@ -454,6 +463,13 @@ class DeepLabv3p(BaseAPI):
             return metrics, eval_details
         return metrics
 
+    def _update_confusion_matrix(self, pred, im_info, labels):
+        label_maps, _ = DeepLabv3p._restore(pred, im_info)
+        conf_mat = ConfusionMatrix(self.num_classes, streaming=True)
+        conf_mat.update(
+            pred=label_maps, label=labels, ignore_index=self.ignore_index)
+        return conf_mat
+
     @staticmethod
     def _preprocess(images,
                     transforms,
@@ -481,28 +497,80 @@ class DeepLabv3p(BaseAPI):
         return im, im_info
 
     @staticmethod
-    def _postprocess(results, im_info):
-        pred_list = list()
-        logit_list = list()
-        for i, (pred, logit) in enumerate(zip(results[0], results[1])):
-            pred = pred.astype('uint8')
-            pred = np.squeeze(pred).astype('uint8')
-            logit = np.transpose(logit, (1, 2, 0))
-            for info in im_info[i][::-1]:
+    def _resize_stack(im, size, interpolation):
+        # cv2.resize限制了通道数，对堆叠的多通道图分段缩放
+        max_channels = 128
+        h, w = size[1], size[0]
+        num_channels = im.shape[2]
+        resized = np.empty((h, w, num_channels), dtype=im.dtype)
+        for c in range(0, num_channels, max_channels):
+            chunk = np.ascontiguousarray(im[:, :, c:c + max_channels])
+            resized[:, :, c:c + max_channels] = cv2.resize(
+                chunk, size,
+                interpolation=interpolation).reshape(h, w, chunk.shape[2])
+        return resized
+
+    @staticmethod
+    def _restore(pred, im_info, logit=None):
+        """将一个batch的预测结果按im_info还原回原图尺寸。im_info相同的样本归为一组，
+           组内样本沿通道维堆叠后整体缩放和裁剪。
+
+        Args:
+            pred (np.ndarray): 网络输出的类别图，shape为(N, H, W, 1)。
+            im_info (list): 各样本预处理时记录的resize及padding信息。
+            logit (np.ndarray): 网络输出的概率图，shape为(N, C, H, W)。默认为None，
+                此时不还原概率图。
+
+        Returns:
+            tuple (label_maps, score_maps): label_maps为各样本还原后的类别图列表，类型为uint8；
+                score_maps为各样本还原后shape为(h, w, C)的概率图列表，logit为None时为None。
+        """
+        num_samples = len(im_info)
+        groups = OrderedDict()
+        for i in range(num_samples):
+            key = tuple((info[0], tuple(info[1])) for info in im_info[i])
+            groups.setdefault(key, list()).append(i)
+
+        label_maps = [None] * num_samples
+        score_maps = None if logit is None else [None] * num_samples
+        for key, indices in groups.items():
+            num = len(indices)
+            label_map = np.transpose(
+                pred[indices].reshape(num, pred.shape[1], pred.shape[2]),
+                (1, 2, 0)).astype('uint8')
+            if logit is not None:
+                num_classes = logit.shape[1]
+                score_map = np.transpose(logit[indices], (2, 3, 0, 1))
+                score_map = score_map.reshape(score_map.shape[0],
+                                              score_map.shape[1], -1)
+            for info in key[::-1]:
+                h, w = info[1][0], info[1][1]
                 if info[0] == 'resize':
-                    w, h = info[1][1], info[1][0]
-                    pred = cv2.resize(pred, (w, h), cv2.INTER_NEAREST)
-                    logit = cv2.resize(logit, (w, h), cv2.INTER_LINEAR)
+                    label_map = DeepLabv3p._resize_stack(
+                        label_map, (w, h), cv2.INTER_NEAREST)
+                    if logit is not None:
+                        score_map = DeepLabv3p._resize_stack(
+                            score_map, (w, h), cv2.INTER_LINEAR)
                 elif info[0] == 'padding':
-                    w, h = info[1][1], info[1][0]
-                    pred = pred[0:h, 0:w]
-                    logit = logit[0:h, 0:w, :]
-            pred_list.append(pred)
-            logit_list.append(logit)
+                    label_map = label_map[0:h, 0:w]
+                    if logit is not None:
+                        score_map = score_map[0:h, 0:w]
+            h, w = label_map.shape[:2]
+            if logit is not None:
+                score_map = score_map.reshape(h, w, num, num_classes)
+            for j, i in enumerate(indices):
+                label_maps[i] = np.ascontiguousarray(label_map[:, :, j])
+                if logit is not None:
+                    score_maps[i] = np.ascontiguousarray(score_map[:, :, j])
+        return label_maps, score_maps
 
+    @staticmethod
+    def _postprocess(results, im_info):
+        label_maps, score_maps = DeepLabv3p._restore(results[0], im_info,
+                                                     results[1])
         preds = list()
-        for pred, logit in zip(pred_list, logit_list):
-            preds.append({'label_map': pred, 'score_map': logit})
+        for label_map, score_map in zip(label_maps, score_maps):
+            preds.append({'label_map': label_map, 'score_map': score_map})
         return preds
 
     def predict(self, img_file, transforms=None):
@@ -137,7 +137,12 @@ class FastSCNN(DeepLabv3p):
               eval_metric_loss=0.05,
               early_stop=False,
               early_stop_patience=5,
-              resume_checkpoint=None):
+              resume_checkpoint=None,
+              staged_eval_ratio=None,
+              latency_file=None,
+              target_latency_ms=None,
+              keep_checkpoint_max=None,
+              accumulate_steps=1):
         """训练。
 
         Args:
@@ -162,6 +167,16 @@ class FastSCNN(DeepLabv3p):
             early_stop_patience (int): 当使用提前终止训练策略时，如果验证集精度在`early_stop_patience`个epoch内
                 连续下降或持平，则终止训练。默认值为5。
             resume_checkpoint (str): 恢复训练时指定上次训练保存的模型路径。若为None，则不会恢复训练。默认值为None。
+            staged_eval_ratio (float): 分阶段评估时首先评估的验证集分层子集的比例，取值范围为(0, 1)。
+                若当前模型在子集上精度的置信区间上界低于历史最优精度，则跳过完整验证集的评估；
+                若为None，则每次均在完整验证集上评估。默认为None。
+            latency_file (str): cal_latency_table保存的延时表路径，与target_latency_ms同时设置时按延时目标裁剪。默认为None。
+            target_latency_ms (float): 裁剪后卷积在目标机器CPU上的估计总耗时（ms）。若不为None，则在满足该延时目标的前提下
+                选择敏感度之和最小的裁剪率，eval_metric_loss不再生效。默认为None。
+            keep_checkpoint_max (int): 最多保留的`epoch_N`模型个数，保存新模型后删除轮数最小的模型，best_model总是保留。
+                若为None，则保留所有模型。默认为None。
+            accumulate_steps (int): 梯度累积的步数，每accumulate_steps步更新一次参数，等效的batch大小为
+                train_batch_size * accumulate_steps。默认优化器的warmup_steps按参数更新的次数计算。目前仅支持单卡训练。默认为1。
 
         Raises:
             ValueError: 模型从inference model进行加载。
@@ -171,4 +186,9 @@ class FastSCNN(DeepLabv3p):
             save_interval_epochs, log_interval_steps, save_dir,
             pretrain_weights, optimizer, learning_rate, lr_decay_power,
             use_vdl, sensitivities_file, eval_metric_loss, early_stop,
-            early_stop_patience, resume_checkpoint)
+            early_stop_patience, resume_checkpoint,
+            staged_eval_ratio=staged_eval_ratio,
+            latency_file=latency_file,
+            target_latency_ms=target_latency_ms,
+            keep_checkpoint_max=keep_checkpoint_max,
+            accumulate_steps=accumulate_steps)
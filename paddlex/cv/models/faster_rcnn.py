@@ -26,7 +26,8 @@ from paddlex.cv.transforms import arrange_transforms
 from paddlex.cv.datasets import generate_minibatch
 from .base import BaseAPI
 from collections import OrderedDict
-from .utils.detection_eval import eval_results, bbox2out
+from .utils.detection_eval import eval_results, bbox2out, COCOEvaluator
+from .utils.eval_pipeline import EvalPipeline
 
 
 class FasterRCNN(BaseAPI):
@@ -285,7 +286,12 @@ class FasterRCNN(BaseAPI):
               early_stop_patience=5,
               resume_checkpoint=None,
               sensitivities_file=None,
-              eval_metric_loss=0.05):
+              eval_metric_loss=0.05,
+              staged_eval_ratio=None,
+              latency_file=None,
+              target_latency_ms=None,
+              keep_checkpoint_max=None,
+              accumulate_steps=1):
         """训练。
 
         Args:
@@ -316,6 +322,16 @@ class FasterRCNN(BaseAPI):
             sensitivities_file (str): 若指定为路径时，则加载路径下敏感度信息进行裁剪；若为字符串'DEFAULT'，
                 则自动下载在ImageNet图片数据上获得的敏感度信息进行裁剪；若为None，则不进行裁剪。默认为None。
             eval_metric_loss (float): 可容忍的精度损失。默认为0.05。
+            staged_eval_ratio (float): 分阶段评估时首先评估的验证集分层子集的比例，取值范围为(0, 1)。
+                若当前模型在子集上精度的置信区间上界低于历史最优精度，则跳过完整验证集的评估；
+                若为None，则每次均在完整验证集上评估。默认为None。
+            latency_file (str): cal_latency_table保存的延时表路径，与target_latency_ms同时设置时按延时目标裁剪。默认为None。
+            target_latency_ms (float): 裁剪后卷积在目标机器CPU上的估计总耗时（ms）。若不为None，则在满足该延时目标的前提下
+                选择敏感度之和最小的裁剪率，eval_metric_loss不再生效。默认为None。
+            keep_checkpoint_max (int): 最多保留的`epoch_N`模型个数，保存新模型后删除轮数最小的模型，best_model总是保留。
+                若为None，则保留所有模型。默认为None。
+            accumulate_steps (int): 梯度累积的步数，每accumulate_steps步更新一次参数，等效的batch大小为
+                train_batch_size * accumulate_steps。默认优化器的warmup_steps按参数更新的次数计算。目前仅支持单卡训练。默认为1。
 
         Raises:
             ValueError: 评估类型不在指定列表中。
@@ -342,11 +358,12 @@ class FasterRCNN(BaseAPI):
             # 构建默认的优化策略
             num_steps_each_epoch = train_dataset.num_samples // train_batch_size
             optimizer = self.default_optimizer(
-                learning_rate, warmup_steps, warmup_start_lr, lr_decay_epochs,
-                lr_decay_gamma, num_steps_each_epoch)
+                learning_rate, warmup_steps * accumulate_steps,
+                warmup_start_lr, lr_decay_epochs, lr_decay_gamma,
+                num_steps_each_epoch)
         self.optimizer = optimizer
         # 构建训练、验证、测试网络
-        self.build_program()
+        self.build_program(accumulate_steps=accumulate_steps)
         fuse_bn = True
         if self.with_fpn and self.backbone in [
                 'ResNet18', 'ResNet50', 'HRNet_W18'
@@ -359,7 +376,9 @@ class FasterRCNN(BaseAPI):
             save_dir=save_dir,
             resume_checkpoint=resume_checkpoint,
             sensitivities_file=sensitivities_file,
-            eval_metric_loss=eval_metric_loss)
+            eval_metric_loss=eval_metric_loss,
+            latency_file=latency_file,
+            target_latency_ms=target_latency_ms)
 
         # 训练
         self.train_loop(
@@ -372,7 +391,10 @@ class FasterRCNN(BaseAPI):
             save_dir=save_dir,
             use_vdl=use_vdl,
             early_stop=early_stop,
-            early_stop_patience=early_stop_patience)
+            early_stop_patience=early_stop_patience,
+            staged_eval_ratio=staged_eval_ratio,
+            keep_checkpoint_max=keep_checkpoint_max,
+            accumulate_steps=accumulate_steps)
 
     def evaluate(self,
                  eval_dataset,
@@ -429,6 +451,16 @@ class FasterRCNN(BaseAPI):
 
         total_steps = math.ceil(eval_dataset.num_samples * 1.0 / batch_size)
         results = list()
+        coco_evaluators = None
+        if metric == 'COCO':
+            clsid2catid = {
+                i + 1: catid
+                for i, catid in enumerate(eval_dataset.coco_gt.getCatIds())
+            }
+            coco_evaluators = {
+                'bbox': COCOEvaluator(eval_dataset.coco_gt, 'bbox')
+            }
+        pipeline = EvalPipeline()
         logging.info(
             "Start to evaluating(total_samples={}, total_steps={})...".format(
                 eval_dataset.num_samples, total_steps))
@@ -471,10 +503,22 @@ class FasterRCNN(BaseAPI):
                 res['is_difficult'] = (np.array(res_is_difficult),
                                        [res_is_difficult_lod])
             results.append(res)
+            if metric == 'COCO':
+                pipeline.submit(self._coco_postprocess, res, clsid2catid,
+                                coco_evaluators['bbox'])
             logging.debug("[EVAL] Epoch={}, Step={}/{}".format(epoch_id, step +
                                                                1, total_steps))
+        batch_results = pipeline.join()
+        xywh_results = None
+        if metric == 'COCO':
+            xywh_results = [r for batch in batch_results for r in batch]
         box_ap_stats, eval_details = eval_results(
-            results, metric, eval_dataset.coco_gt, with_background=True)
+            results,
+            metric,
+            eval_dataset.coco_gt,
+            with_background=True,
+            xywh_results=xywh_results,
+            coco_evaluators=coco_evaluators)
         metrics = OrderedDict(
             zip(['bbox_mmap'
                  if metric == 'COCO' else 'bbox_map'], box_ap_stats))
@@ -482,6 +526,13 @@ class FasterRCNN(BaseAPI):
             return metrics, eval_details
         return metrics
 
+    @staticmethod
+    def _coco_postprocess(res, clsid2catid, bbox_evaluator):
+        xywh_results = bbox2out([res], clsid2catid)
+        img_ids = np.array(res['im_id'][0]).flatten()
+        bbox_evaluator.update(xywh_results, img_ids)
+        return xywh_results
+
     @staticmethod
     def _preprocess(images,
                     transforms,
@@ -25,7 +25,9 @@ import os.path as osp
 from paddlex.cv.transforms import arrange_transforms
 from collections import OrderedDict
 from .faster_rcnn import FasterRCNN
-from .utils.detection_eval import eval_results, bbox2out, mask2out
+from .utils.detection_eval import eval_results, bbox2out, mask2out, \
+    COCOEvaluator
+from .utils.eval_pipeline import EvalPipeline
 
 
 class MaskRCNN(FasterRCNN):
@@ -234,7 +236,10 @@ class MaskRCNN(FasterRCNN):
               use_vdl=False,
               early_stop=False,
               early_stop_patience=5,
-              resume_checkpoint=None):
+              resume_checkpoint=None,
+              staged_eval_ratio=None,
+              keep_checkpoint_max=None,
+              accumulate_steps=1):
         """训练。
 
         Args:
@@ -262,6 +267,13 @@ class MaskRCNN(FasterRCNN):
             early_stop_patience (int): 当使用提前终止训练策略时，如果验证集精度在`early_stop_patience`个epoch内
                 连续下降或持平，则终止训练。默认值为5。
             resume_checkpoint (str): 恢复训练时指定上次训练保存的模型路径。若为None，则不会恢复训练。默认值为None。
+            staged_eval_ratio (float): 分阶段评估时首先评估的验证集分层子集的比例，取值范围为(0, 1)。
+                若当前模型在子集上精度的置信区间上界低于历史最优精度，则跳过完整验证集的评估；
+                若为None，则每次均在完整验证集上评估。默认为None。
+            keep_checkpoint_max (int): 最多保留的`epoch_N`模型个数，保存新模型后删除轮数最小的模型，best_model总是保留。
+                若为None，则保留所有模型。默认为None。
+            accumulate_steps (int): 梯度累积的步数，每accumulate_steps步更新一次参数，等效的batch大小为
+                train_batch_size * accumulate_steps。默认优化器的warmup_steps按参数更新的次数计算。目前仅支持单卡训练。默认为1。
 
         Raises:
             ValueError: 评估类型不在指定列表中。
@@ -287,14 +299,14 @@ class MaskRCNN(FasterRCNN):
             num_steps_each_epoch = train_dataset.num_samples // train_batch_size
             optimizer = self.default_optimizer(
                 learning_rate=learning_rate,
-                warmup_steps=warmup_steps,
+                warmup_steps=warmup_steps * accumulate_steps,
                 warmup_start_lr=warmup_start_lr,
                 lr_decay_epochs=lr_decay_epochs,
                 lr_decay_gamma=lr_decay_gamma,
                 num_steps_each_epoch=num_steps_each_epoch)
         self.optimizer = optimizer
         # 构建训练、验证、测试网络
-        self.build_program()
+        self.build_program(accumulate_steps=accumulate_steps)
         fuse_bn = True
         if self.with_fpn and self.backbone in [
                 'ResNet18', 'ResNet50', 'HRNet_W18'
@@ -317,7 +329,10 @@ class MaskRCNN(FasterRCNN):
             save_dir=save_dir,
             use_vdl=use_vdl,
             early_stop=early_stop,
-            early_stop_patience=early_stop_patience)
+            early_stop_patience=early_stop_patience,
+            staged_eval_ratio=staged_eval_ratio,
+            keep_checkpoint_max=keep_checkpoint_max,
+            accumulate_steps=accumulate_steps)
 
     def evaluate(self,
                  eval_dataset,
@@ -374,6 +389,15 @@ class MaskRCNN(FasterRCNN):
 
         total_steps = math.ceil(eval_dataset.num_samples * 1.0 / batch_size)
         results = list()
+        clsid2catid = {
+            i + 1: catid
+            for i, catid in enumerate(eval_dataset.coco_gt.getCatIds())
+        }
+        coco_evaluators = {
+            'bbox': COCOEvaluator(eval_dataset.coco_gt, 'bbox'),
+            'segm': COCOEvaluator(eval_dataset.coco_gt, 'segm')
+        }
+        pipeline = EvalPipeline()
         logging.info(
             "Start to evaluating(total_samples={}, total_steps={})...".format(
                 eval_dataset.num_samples, total_steps))
@@ -404,15 +428,26 @@ class MaskRCNN(FasterRCNN):
             res['im_shape'] = (im_shapes, [])
             res['im_id'] = (np.array(res_im_id), [])
             results.append(res)
+            pipeline.submit(self._coco_postprocess, res, clsid2catid,
+                            coco_evaluators['bbox'], coco_evaluators['segm'],
+                            self.mask_head_resolution)
             logging.debug("[EVAL] Epoch={}, Step={}/{}".format(epoch_id, step +
                                                                1, total_steps))
+        xywh_results = list()
+        segm_results = list()
+        for batch_xywh_results, batch_segm_results in pipeline.join():
+            xywh_results.extend(batch_xywh_results)
+            segm_results.extend(batch_segm_results)
 
         ap_stats, eval_details = eval_results(
             results,
             'COCO',
             eval_dataset.coco_gt,
             with_background=True,
-            resolution=self.mask_head_resolution)
+            resolution=self.mask_head_resolution,
+            xywh_results=xywh_results,
+            segm_results=segm_results,
+            coco_evaluators=coco_evaluators)
         if metric == 'VOC':
             if isinstance(ap_stats[0], np.ndarray) and isinstance(ap_stats[1],
                                                                   np.ndarray):
@@ -435,6 +470,16 @@ class MaskRCNN(FasterRCNN):
             return metrics, eval_details
         return metrics
 
+    @staticmethod
+    def _coco_postprocess(res, clsid2catid, bbox_evaluator, segm_evaluator,
+                          resolution):
+        img_ids = np.array(res['im_id'][0]).flatten()
+        xywh_results = bbox2out([res], clsid2catid)
+        segm_results = mask2out([res], clsid2catid, resolution)
+        bbox_evaluator.update(xywh_results, img_ids)
+        segm_evaluator.update(segm_results, img_ids)
+        return xywh_results, segm_results
+
     @staticmethod
     def _postprocess(res, batch_size, num_classes, mask_head_resolution,
                      labels):
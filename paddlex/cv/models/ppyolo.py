@@ -29,7 +29,10 @@ from paddlex.cv.transforms import arrange_transforms
 from paddlex.cv.datasets import generate_minibatch
 from .base import BaseAPI
 from collections import OrderedDict
-from .utils.detection_eval import eval_results, bbox2out
+from .utils.detection_eval import eval_results, bbox2out, COCOEvaluator
+from .utils.detection_eval import bbox_eval_state, eval_bbox_states
+from .utils.eval_pipeline import EvalPipeline
+from .utils.sharded_eval import evaluate_shards
 
 
 class PPYOLO(BaseAPI):
@@ -237,7 +240,12 @@ class PPYOLO(BaseAPI):
               early_stop_patience=5,
               resume_checkpoint=None,
               use_ema=True,
-              ema_decay=0.9998):
+              ema_decay=0.9998,
+              staged_eval_ratio=None,
+              latency_file=None,
+              target_latency_ms=None,
+              keep_checkpoint_max=None,
+              accumulate_steps=1):
         """训练。
 
         Args:
@@ -269,7 +277,17 @@ class PPYOLO(BaseAPI):
                 连续下降或持平，则终止训练。默认值为5。
             resume_checkpoint (str): 恢复训练时指定上次训练保存的模型路径。若为None，则不会恢复训练。默认值为None。
             use_ema (bool): 是否使用指数衰减计算参数的滑动平均值。默认值为True。
-            ema_decay (float): 指数衰减率。默认值为0.9998。
+            ema_decay (float): 指数衰减率，按参数更新的次数计算。默认值为0.9998。
+            staged_eval_ratio (float): 分阶段评估时首先评估的验证集分层子集的比例，取值范围为(0, 1)。
+                若当前模型在子集上精度的置信区间上界低于历史最优精度，则跳过完整验证集的评估；
+                若为None，则每次均在完整验证集上评估。默认为None。
+            latency_file (str): cal_latency_table保存的延时表路径，与target_latency_ms同时设置时按延时目标裁剪。默认为None。
+            target_latency_ms (float): 裁剪后卷积在目标机器CPU上的估计总耗时（ms）。若不为None，则在满足该延时目标的前提下
+                选择敏感度之和最小的裁剪率，eval_metric_loss不再生效。默认为None。
+            keep_checkpoint_max (int): 最多保留的`epoch_N`模型个数，保存新模型后删除轮数最小的模型，best_model总是保留。
+                若为None，则保留所有模型。默认为None。
+            accumulate_steps (int): 梯度累积的步数，每accumulate_steps步更新一次参数，等效的batch大小为
+                train_batch_size * accumulate_steps。默认优化器的warmup_steps按参数更新的次数计算。目前仅支持单卡训练。默认为1。
 
         Raises:
             ValueError: 评估类型不在指定列表中。
@@ -297,14 +315,16 @@ class PPYOLO(BaseAPI):
             num_steps_each_epoch = train_dataset.num_samples // train_batch_size
             optimizer = self.default_optimizer(
                 learning_rate=learning_rate,
-                warmup_steps=warmup_steps,
+                warmup_steps=warmup_steps * accumulate_steps,
                 warmup_start_lr=warmup_start_lr,
                 lr_decay_epochs=lr_decay_epochs,
                 lr_decay_gamma=lr_decay_gamma,
                 num_steps_each_epoch=num_steps_each_epoch)
         self.optimizer = optimizer
         self.use_ema = use_ema
-        self.ema_decay = ema_decay
+        # 滑动平均在每个累积步都会更新，而参数在累积的步内保持不变，
+        # 每步使用ema_decay的accumulate_steps次方根，使每次参数更新的衰减率仍为ema_decay
+        self.ema_decay = ema_decay**(1. / accumulate_steps)
 
         self.batch_size_per_gpu = self._get_single_card_bs(train_batch_size)
         if self.use_fine_grained_loss:
@@ -343,7 +363,7 @@ class PPYOLO(BaseAPI):
                         num_classes=self.num_classes,
                         downsample_ratios=[32, 16, 8]))
         # 构建训练、验证、预测网络
-        self.build_program()
+        self.build_program(accumulate_steps=accumulate_steps)
         # 初始化网络权重
         self.net_initialize(
             startup_prog=fluid.default_startup_program(),
@@ -351,7 +371,9 @@ class PPYOLO(BaseAPI):
             save_dir=save_dir,
             sensitivities_file=sensitivities_file,
             eval_metric_loss=eval_metric_loss,
-            resume_checkpoint=resume_checkpoint)
+            resume_checkpoint=resume_checkpoint,
+            latency_file=latency_file,
+            target_latency_ms=target_latency_ms)
         # 训练
         self.train_loop(
             num_epochs=num_epochs,
@@ -363,14 +385,18 @@ class PPYOLO(BaseAPI):
             save_dir=save_dir,
             use_vdl=use_vdl,
             early_stop=early_stop,
-            early_stop_patience=early_stop_patience)
+            early_stop_patience=early_stop_patience,
+            staged_eval_ratio=staged_eval_ratio,
+            keep_checkpoint_max=keep_checkpoint_max,
+            accumulate_steps=accumulate_steps)
 
     def evaluate(self,
                  eval_dataset,
                  batch_size=1,
                  epoch_id=None,
                  metric=None,
-                 return_details=False):
+                 return_details=False,
+                 num_workers=1):
         """评估。
 
         Args:
@@ -381,6 +407,10 @@ class PPYOLO(BaseAPI):
                 根据用户传入的Dataset自动选择，如为VOCDetection，则metric为'VOC';
                 如为COCODetection，则metric为'COCO'。
             return_details (bool): 是否返回详细信息。
+            num_workers (int): 并行评估的本地CPU进程数。大于1时验证集被切分为互不相交的
+                连续分片，各进程加载当前模型的副本评估各自的分片，最后合并各分片的评估状态，
+                结果与单进程评估一致。子进程以spawn方式启动，会重新导入主程序，大于1时
+                主程序的代码需放在if __name__ == '__main__':下。默认为1，即在当前进程中评估。
 
         Returns:
             tuple (metrics, eval_details) | dict (metrics): 当return_details为True时，返回(metrics, eval_details)，
@@ -410,9 +440,49 @@ class PPYOLO(BaseAPI):
                     )
         assert metric in ['COCO', 'VOC'], "Metric only support 'VOC' or 'COCO'"
 
-        total_steps = math.ceil(eval_dataset.num_samples * 1.0 / batch_size)
-        results = list()
+        if num_workers > 1:
+            states = evaluate_shards(self, eval_dataset, num_workers,
+                                     '_evaluate_shard', batch_size, metric)
+            box_ap_stats, eval_details = eval_bbox_states(
+                states, metric, eval_dataset.coco_gt)
+        else:
+            results = list()
+            coco_evaluators = None
+            if metric == 'COCO':
+                clsid2catid = dict(
+                    enumerate(eval_dataset.coco_gt.getCatIds()))
+                coco_evaluators = {
+                    'bbox': COCOEvaluator(eval_dataset.coco_gt, 'bbox')
+                }
+            pipeline = EvalPipeline()
+            for res in self._eval_batches(eval_dataset, batch_size, metric,
+                                          epoch_id):
+                results.append(res)
+                if metric == 'COCO':
+                    pipeline.submit(self._coco_postprocess, res, clsid2catid,
+                                    coco_evaluators['bbox'])
+            batch_results = pipeline.join()
+            xywh_results = None
+            if metric == 'COCO':
+                xywh_results = [r for batch in batch_results for r in batch]
+            box_ap_stats, eval_details = eval_results(
+                results,
+                metric,
+                eval_dataset.coco_gt,
+                with_background=False,
+                xywh_results=xywh_results,
+                coco_evaluators=coco_evaluators)
+        evaluate_metrics = OrderedDict(
+            zip(['bbox_mmap'
+                 if metric == 'COCO' else 'bbox_map'], box_ap_stats))
+        if return_details:
+            return evaluate_metrics, eval_details
+        return evaluate_metrics
 
+    def _eval_batches(self, eval_dataset, batch_size, metric, epoch_id=None):
+        """逐batch运行验证程序，生成与eval_results输入格式一致的结果。
+        """
+        total_steps = math.ceil(eval_dataset.num_samples * 1.0 / batch_size)
         data_generator = eval_dataset.generator(
             batch_size=batch_size, drop_last=False)
         logging.info(
@@ -439,21 +509,25 @@ class PPYOLO(BaseAPI):
                 res_gt_box = [d[3].reshape(-1, 4) for d in data]
                 res_gt_label = [d[4].reshape(-1, 1) for d in data]
                 res_is_difficult = [d[5].reshape(-1, 1) for d in data]
-                res_id = [np.array([d[2]]) for d in data]
                 res['gt_box'] = (res_gt_box, [])
                 res['gt_label'] = (res_gt_label, [])
                 res['is_difficult'] = (res_is_difficult, [])
-            results.append(res)
             logging.debug("[EVAL] Epoch={}, Step={}/{}".format(epoch_id, step +
                                                                1, total_steps))
-        box_ap_stats, eval_details = eval_results(
-            results, metric, eval_dataset.coco_gt, with_background=False)
-        evaluate_metrics = OrderedDict(
-            zip(['bbox_mmap'
-                 if metric == 'COCO' else 'bbox_map'], box_ap_stats))
-        if return_details:
-            return evaluate_metrics, eval_details
-        return evaluate_metrics
+            yield res
+
+    def _evaluate_shard(self, eval_dataset, batch_size, metric):
+        """评估验证集的一个分片，返回可合并的评估状态，供evaluate多进程评估时使用。
+        """
+        results = list(self._eval_batches(eval_dataset, batch_size, metric))
+        return bbox_eval_state(results, metric, eval_dataset.coco_gt)
+
+    @staticmethod
+    def _coco_postprocess(res, clsid2catid, bbox_evaluator):
+        xywh_results = bbox2out([res], clsid2catid)
+        img_ids = np.array(res['im_id'][0]).flatten()
+        bbox_evaluator.update(xywh_results, img_ids)
+        return xywh_results
 
     @staticmethod
     def _preprocess(images,
@@ -15,13 +15,19 @@
 from paddle.fluid.contrib.slim.quantization.quantization_pass import QuantizationTransformPass
 from paddle.fluid.contrib.slim.quantization.quantization_pass import AddQuantDequantPass
 from paddle.fluid.contrib.slim.quantization.quantization_pass import _out_scale_op_list
+try:
+    from paddle.fluid.contrib.slim.quantization.quantization_pass import _channelwise_quant_axis1_ops
+except ImportError:
+    # paddle 1.8 quantizes all the weights channel-wise along axis 0
+    _channelwise_quant_axis1_ops = []
 from paddle.fluid.contrib.slim.quantization import PostTrainingQuantization
 import paddlex.utils.logging as logging
+from paddlex.utils.utils import get_default_num_workers
 import paddle.fluid as fluid
-import os
-import re
 import numpy as np
 import time
+import multiprocessing as mp
+from collections import OrderedDict
 
 
 def _load_variable_data(scope, var_name):
@@ -34,6 +40,159 @@ def _load_variable_data(scope, var_name):
     return np.array(var_node.get_tensor())
 
 
+class _AbsHistogram(object):
+    '''
+    Streaming histogram of the absolute values of an activation over
+    [0, upper]. When a batch exceeds the range, upper is multiplied by a
+    power of 2 and the existing bins are merged exactly, so the memory
+    is fixed and independent of the number of samples.
+    '''
+
+    def __init__(self, bins):
+        self.bins = bins
+        self.hist = np.zeros(bins, dtype=np.int64)
+        self.upper = 0.
+        self.max_val = 0.
+
+    def update(self, data):
+        data = np.abs(data.ravel())
+        if data.size == 0:
+            return
+        max_val = float(np.max(data))
+        self.max_val = max(self.max_val, max_val)
+        if max_val > self.upper:
+            if self.upper == 0.:
+                # all the values so far are 0 and counted in the first bin
+                self.upper = max_val
+            else:
+                factor = 1
+                while self.upper * factor < max_val:
+                    factor *= 2
+                factor = min(factor, self.bins)
+                merged = self.hist.reshape(-1, factor).sum(axis=1)
+                self.hist = np.zeros(self.bins, dtype=np.int64)
+                self.hist[:merged.size] = merged
+                self.upper = max(self.upper * factor, max_val)
+        if self.upper == 0.:
+            self.hist[0] += data.size
+            return
+        index = (data * (self.bins / self.upper)).astype(np.int64)
+        np.minimum(index, self.bins - 1, out=index)
+        self.hist += np.bincount(index, minlength=self.bins)
+
+    def get(self, bins):
+        '''
+        Get the histogram resampled to `bins` bins over [0, max of the
+        values], and the width of a bin. The values are assumed to be
+        uniform in each of the finer sampling bins, so resampling e.g.
+        16384 sampling bins to 2048 is an approximation of np.histogram on
+        all the values: counts of a sampling bin may be split between two
+        bins, and bins empty in np.histogram may get fractional counts.
+        '''
+        if self.max_val == 0.:
+            hist = np.zeros(bins, dtype=np.float64)
+            hist[0] = self.hist.sum()
+            return hist, 0.
+        edges = np.linspace(0., self.upper, self.bins + 1)
+        cdf = np.concatenate([[0.], np.cumsum(self.hist)]).astype(np.float64)
+        new_edges = np.linspace(0., self.max_val, bins + 1)
+        hist = np.diff(np.interp(new_edges, edges, cdf))
+        # the values beyond max_val by float error go to the last bin
+        hist[-1] += cdf[-1] - hist.sum()
+        return hist, self.max_val / bins
+
+
+def _get_kl_threshold(hist, bin_width, num_quantized_bins=255):
+    '''
+    Get the KL threshold of an activation from the histogram of its
+    absolute values, the same search as
+    PostTrainingQuantization._get_kl_scaling_factor of Paddle 1.8. Given the
+    same histogram the result is the same, but the histogram resampled by
+    _AbsHistogram.get only approximates the one of Paddle. The thresholds
+    are close on dense histograms, while on sparse ones, e.g. of an
+    activation with few values, the KL divergence is noisy and the
+    threshold may differ by over 10%.
+    '''
+    hist = np.asarray(hist, dtype=np.float64)
+    num_bins = hist.size
+    ending_iter = num_bins - 1
+    starting_iter = int(ending_iter * 0.7)
+    P_sum = hist.sum()
+    outliers = np.cumsum(hist[::-1])[::-1]
+    min_kl_divergence = 0
+    min_kl_index = 0
+    kl_inited = False
+    for i in range(starting_iter, ending_iter + 1):
+        if hist[i - 1] == 0:
+            continue
+        reference_distr_P = hist[:i].copy()
+        if i < num_bins:
+            reference_distr_P[i - 1] += outliers[i]
+        # the last quantized bin takes the remainder
+        num_merged_bins = i // num_quantized_bins
+        group = np.minimum(
+            np.arange(i) // num_merged_bins, num_quantized_bins - 1)
+        candidate_distr_Q_quantized = np.bincount(
+            group, weights=hist[:i], minlength=num_quantized_bins)
+        nonzero = reference_distr_P != 0
+        nonzero_count = np.bincount(
+            group, weights=nonzero, minlength=num_quantized_bins)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            avg_bin_ele = np.where(
+                nonzero_count > 0,
+                candidate_distr_Q_quantized / nonzero_count, 0.)
+            candidate_distr_Q = np.where(nonzero, avg_bin_ele[group], 0.)
+            Q_sum = candidate_distr_Q.sum()
+            p = reference_distr_P[nonzero]
+            q = candidate_distr_Q[nonzero]
+            kl_divergence = np.sum(p * np.log(Q_sum * p) - p * np.log(
+                P_sum * q)) / P_sum
+        if not kl_inited:
+            min_kl_divergence = kl_divergence
+            min_kl_index = i
+            kl_inited = True
+        elif kl_divergence < min_kl_divergence:
+            min_kl_divergence = kl_divergence
+            min_kl_index = i
+    if min_kl_index == 0:
+        while starting_iter > 0:
+            if hist[starting_iter] == 0:
+                starting_iter -= 1
+                continue
+            else:
+                break
+        min_kl_index = starting_iter
+    return (min_kl_index + 0.5) * bin_width
+
+
+def _calculate_act_kl_thresholds(histograms, histogram_bins, num_workers):
+    '''
+    Calculate the KL thresholds of activations from their _AbsHistogram,
+    each activation in a process of a pool of num_workers.
+    '''
+    start = time.time()
+    act_var_names = list(histograms.keys())
+    args = [
+        histograms[var_name].get(histogram_bins) for var_name in act_var_names
+    ]
+    num_workers = min(num_workers, len(args))
+    if num_workers > 1:
+        pool = mp.Pool(num_workers)
+        try:
+            thresholds = pool.starmap(_get_kl_threshold, args)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        thresholds = [_get_kl_threshold(*arg) for arg in args]
+    logging.debug(
+        '[Calculate activation] Activation_num={}, num_workers={}, time={} s.'.
+        format(
+            str(len(act_var_names)), str(num_workers),
+            str(time.time() - start)))
+    return dict(zip(act_var_names, thresholds))
+
+
 class PaddleXPostTrainingQuantization(PostTrainingQuantization):
     def __init__(self,
                  executor,
@@ -48,7 +207,8 @@ class PaddleXPostTrainingQuantization(PostTrainingQuantization):
                  quantizable_op_type=["conv2d", "depthwise_conv2d", "mul"],
                  is_full_quantize=False,
                  is_use_cache_file=False,
-                 cache_dir="./temp_post_training"):
+                 cache_dir="./temp_post_training",
+                 num_workers=None):
         '''
         The class utilizes post training quantization methon to quantize the
         fp32 model. It uses calibrate data to calculate the scale factor of
@@ -77,13 +237,14 @@ class PaddleXPostTrainingQuantization(PostTrainingQuantization):
                 apply quantization to all supported quantizable op type. If set
                 is_full_quantized as False, only apply quantization to the op type
                 according to the input quantizable_op_type.
-            is_use_cache_file(bool, optional): If set is_use_cache_file as False,
-                all temp data will be saved in memory. If set is_use_cache_file as True,
-                it will save temp data to disk. When the fp32 model is complex or
-                the number of calibrate data is large, we should set is_use_cache_file
-                as True. Defalut is False.
-            cache_dir(str, optional): When is_use_cache_file is True, set cache_dir as
-                the directory for saving temp data. Default is ./temp_post_training.
+            is_use_cache_file(bool, optional): This param is deprecated. The
+                activations are sampled into fixed-size histograms, whose memory
+                does not depend on the number of calibrate data.
+            cache_dir(str, optional): This param is deprecated.
+            num_workers(int, optional): The number of processes to calculate the
+                KL thresholds of activations, calculate in the current process
+                if 0. Default is min(8, cpu_count), and 0 on Windows and macOS
+                where the processes are spawned.
         Returns:
             None
         '''
@@ -112,12 +273,13 @@ class PaddleXPostTrainingQuantization(PostTrainingQuantization):
         self._algo = algo
         self._is_use_cache_file = is_use_cache_file
         self._cache_dir = cache_dir
+        if num_workers is None:
+            num_workers = get_default_num_workers()
+        self._num_workers = num_workers
         self._activation_bits = 8
         self._weight_bits = 8
         self._activation_quantize_type = 'range_abs_max'
         self._weight_quantize_type = 'channel_wise_abs_max'
-        if self._is_use_cache_file and not os.path.exists(self._cache_dir):
-            os.mkdir(self._cache_dir)
 
         if is_full_quantize:
             self._quantizable_op_type = self._support_quantize_op_type
@@ -139,10 +301,17 @@ class PaddleXPostTrainingQuantization(PostTrainingQuantization):
         self._quantized_weight_var_name = set()
         self._quantized_act_var_name = set()
         self._sampling_data = {}
+        # histograms of the absolute values of activations for algo = KL
+        self._sampling_act_histogram = {}
+        # bins kept while sampling, merged to _histogram_bins for KL search
+        self._sampling_bins = 16384
+        self._histogram_bins = 2048
         self._quantized_var_kl_threshold = {}
         self._quantized_var_min = {}
         self._quantized_var_max = {}
         self._quantized_var_abs_max = {}
+        # time in seconds of each stage of quantize()
+        self.calibration_report = OrderedDict()
 
     def quantize(self):
         '''
@@ -154,16 +323,19 @@ class PaddleXPostTrainingQuantization(PostTrainingQuantization):
         Returns:
             the program of quantized model.
         '''
+        self.calibration_report = OrderedDict()
+        start = time.time()
         self._load_model_data()
         self._collect_target_varnames()
         self._set_activation_persistable()
-        batch_ct = 0
-        for data in self._data_loader():
-            batch_ct += 1
-            if self._batch_nums and batch_ct >= self._batch_nums:
-                break
+        self._record_stage('load_model', start)
+        # the data loader drops the last incomplete batch
+        batch_ct = self._dataset.num_samples // self._batch_size
+        if self._batch_nums:
+            batch_ct = min(batch_ct, self._batch_nums)
         batch_id = 0
         logging.info("Start to run batch!")
+        run_start = time.time()
         for data in self._data_loader():
             start = time.time()
             with fluid.scope_guard(self._scope):
@@ -182,21 +354,31 @@ class PaddleXPostTrainingQuantization(PostTrainingQuantization):
             batch_id += 1
             if self._batch_nums and batch_id >= self._batch_nums:
                 break
-        logging.info("All run batch: ".format(batch_id))
+        logging.info("All run batch: {}".format(batch_id))
         self._reset_activation_persistable()
+        self._record_stage('run_batch', run_start)
         logging.info("Calculate scale factor ...")
+        start = time.time()
         if self._algo == "KL":
             self._calculate_kl_threshold()
+        self._record_stage('calculate_threshold', start)
         logging.info("Update the program ...")
+        start = time.time()
         if self._algo in ["KL", "abs_max"]:
             self._update_program()
         else:
             self._save_input_threhold()
-        logging.info("Save ...")
         self._save_output_threshold()
+        self._record_stage('update_program', start)
+        logging.info("Calibration report: {}".format(", ".join(
+            "{}={:.2f}s".format(k, v)
+            for k, v in self.calibration_report.items())))
         logging.info("Finish quant!")
         return self._program
 
+    def _record_stage(self, stage, start):
+        self.calibration_report[stage] = time.time() - start
+
     def save_quantized_model(self, save_model_path):
         '''
         Save the quantized model to the disk.
@@ -256,46 +438,11 @@ class PaddleXPostTrainingQuantization(PostTrainingQuantization):
                     str(end - start)))
             ct += 1
 
-        ct = 1
-        # KL threshold for activations
-        if self._is_use_cache_file:
-            for var_name in self._quantized_act_var_name:
-                start = time.time()
-                sampling_data = []
-                file_name = os.path.join(self._cache_dir, var_name)
-                cache_dir, var_name_ = os.path.split(file_name)
-                filenames = [f for f in os.listdir(cache_dir) \
-                    if re.match(var_name_ + '_[0-9]+.npy', f)]
-                for filename in filenames:
-                    file_path = os.path.join(cache_dir, filename)
-                    sampling_data.append(np.load(file_path))
-                    os.remove(file_path)
-                sampling_data = np.concatenate(sampling_data)
-                self._quantized_var_kl_threshold[var_name] = \
-                    self._get_kl_scaling_factor(np.abs(sampling_data))
-                end = time.time()
-                logging.debug(
-                    '[Calculate activation] Activation_id={}/{}, time_each_activation={} s.'.
-                    format(
-                        str(ct),
-                        str(len(self._quantized_act_var_name)),
-                        str(end - start)))
-                ct += 1
-        else:
-            for var_name in self._quantized_act_var_name:
-                start = time.time()
-                self._sampling_data[var_name] = np.concatenate(
-                    self._sampling_data[var_name])
-                self._quantized_var_kl_threshold[var_name] = \
-                    self._get_kl_scaling_factor(np.abs(self._sampling_data[var_name]))
-                end = time.time()
-                logging.debug(
-                    '[Calculate activation] Activation_id={}/{}, time_each_activation={} s.'.
-                    format(
-                        str(ct),
-                        str(len(self._quantized_act_var_name)),
-                        str(end - start)))
-                ct += 1
+        # KL threshold for activations, each activation in a process
+        self._quantized_var_kl_threshold.update(
+            _calculate_act_kl_thresholds(self._sampling_act_histogram,
+                                         self._histogram_bins,
+                                         self._num_workers))
 
     def _sample_data(self, iter):
         '''
@@ -308,23 +455,12 @@ class PaddleXPostTrainingQuantization(PostTrainingQuantization):
                 var_tensor = _load_variable_data(self._scope, var_name)
                 self._sampling_data[var_name] = var_tensor
 
-        if self._is_use_cache_file:
-            for var_name in self._quantized_act_var_name:
-                var_tensor = _load_variable_data(self._scope, var_name)
-                var_tensor = var_tensor.ravel()
-                save_path = os.path.join(self._cache_dir,
-                                         var_name + "_" + str(iter) + ".npy")
-                save_dir, file_name = os.path.split(save_path)
-                if not os.path.exists(save_dir):
-                    os.makedirs(save_dir)
-                np.save(save_path, var_tensor)
-        else:
-            for var_name in self._quantized_act_var_name:
-                if var_name not in self._sampling_data:
-                    self._sampling_data[var_name] = []
-                var_tensor = _load_variable_data(self._scope, var_name)
-                var_tensor = var_tensor.ravel()
-                self._sampling_data[var_name].append(var_tensor)
+        for var_name in self._quantized_act_var_name:
+            if var_name not in self._sampling_act_histogram:
+                self._sampling_act_histogram[var_name] = _AbsHistogram(
+                    self._sampling_bins)
+            var_tensor = _load_variable_data(self._scope, var_name)
+            self._sampling_act_histogram[var_name].update(var_tensor)
 
 
 class PaddleXPostTrainingQuantizationV2(PostTrainingQuantization):
@@ -346,7 +482,8 @@ class PaddleXPostTrainingQuantizationV2(PostTrainingQuantization):
                  weight_quantize_type='channel_wise_abs_max',
                  optimize_model=False,
                  is_use_cache_file=False,
-                 cache_dir="./temp_post_training"):
+                 cache_dir="./temp_post_training",
+                 num_workers=None):
         '''
         Constructor.
 
@@ -397,8 +534,14 @@ class PaddleXPostTrainingQuantizationV2(PostTrainingQuantization):
                 `conv2d/depthwise_conv2d + bn`, the weights scale for all channel will
                 be different. In address this problem, fuse the pattern before
                 quantization. Default False.
-            is_use_cache_file(bool, optional): This param is deprecated.
+            is_use_cache_file(bool, optional): This param is deprecated. The
+                activations are sampled into fixed-size histograms, whose memory
+                does not depend on the number of calibrate data.
             cache_dir(str, optional): This param is deprecated.
+            num_workers(int, optional): The number of processes to calculate the
+                KL thresholds of activations, calculate in the current process
+                if 0. Default is min(8, cpu_count), and 0 on Windows and macOS
+                where the processes are spawned.
         Returns:
             None
 
@@ -462,17 +605,140 @@ class PaddleXPostTrainingQuantizationV2(PostTrainingQuantization):
         self._quantized_weight_var_name = set()
         self._quantized_act_var_name = set()
         self._weight_op_pairs = {}
+        if num_workers is None:
+            num_workers = get_default_num_workers()
+        self._num_workers = num_workers
         # The vars for alog = KL
         self._sampling_act_abs_min_max = {}
+        # histograms of the absolute values of activations
         self._sampling_act_histogram = {}
         self._sampling_data = {}
         self._quantized_var_kl_threshold = {}
+        # bins kept while sampling, merged to _histogram_bins for KL search
+        self._sampling_bins = 16384
         self._histogram_bins = 2048
         # The vars for algo = min_max
         self._quantized_var_min = {}
         self._quantized_var_max = {}
         # The vars for algo = abs_max
         self._quantized_var_abs_max = {}
+        # time in seconds of each stage of quantize()
+        self.calibration_report = OrderedDict()
+
+    def quantize(self):
+        '''
+        Load the FP32 model, and use the calibrate data to calculate the forward-stage.
+        Based on the sample data, we can get the quantization information, and obtain
+        the final quantized model.
+
+        Unlike PostTrainingQuantization.quantize, the activations of algo=KL
+        are sampled into range-adaptive histograms in a single pass over the
+        calibrate data, without the preparation pass for their ranges.
+
+        Args:
+            None
+        Returns:
+            the program of quantized model.
+        '''
+        self.calibration_report = OrderedDict()
+        start = time.time()
+        self._load_model_data()
+        self._collect_target_varnames()
+        self._set_activation_persistable()
+        self._record_stage('load_model', start)
+        # the data loader drops the last incomplete batch
+        batch_ct = self._dataset.num_samples // self._batch_size
+        if self._batch_nums:
+            batch_ct = min(batch_ct, self._batch_nums)
+        batch_id = 0
+        logging.info("Start to run batch!")
+        run_start = time.time()
+        for data in self._data_loader():
+            start = time.time()
+            with fluid.scope_guard(self._scope):
+                self._executor.run(program=self._program,
+                                   feed=data,
+                                   fetch_list=self._fetch_list,
+                                   return_numpy=False)
+            if self._algo == "KL":
+                self._sample_histogram()
+            else:
+                self._sampling()
+            end = time.time()
+            logging.debug(
+                '[Run batch data] Batch={}/{}, time_each_batch={} s.'.format(
+                    str(batch_id + 1), str(batch_ct), str(end - start)))
+            batch_id += 1
+            if self._batch_nums and batch_id >= self._batch_nums:
+                break
+        logging.info("All run batch: {}".format(batch_id))
+        self._reset_activation_persistable()
+        self._record_stage('run_batch', run_start)
+        logging.info("Calculate scale factor ...")
+        start = time.time()
+        if self._algo == "KL":
+            self._calculate_kl_threshold()
+        self._record_stage('calculate_threshold', start)
+        logging.info("Update the program ...")
+        start = time.time()
+        if self._algo in ["KL", "abs_max"]:
+            self._update_program()
+        else:
+            self._save_input_threhold()
+        self._save_output_threshold()
+        if any(op_type in self._quantizable_op_type
+               for op_type in self._dynamic_quantize_op_type):
+            self._collect_dynamic_quantize_op_threshold(
+                self._dynamic_quantize_op_type)
+        self._record_stage('update_program', start)
+        logging.info("Calibration report: {}".format(", ".join(
+            "{}={:.2f}s".format(k, v)
+            for k, v in self.calibration_report.items())))
+        logging.info("Finish quant!")
+        return self._program
+
+    def _record_stage(self, stage, start):
+        self.calibration_report[stage] = time.time() - start
+
+    def _sample_histogram(self):
+        '''
+        Update the histograms of the absolute values of activations.
+        '''
+        for var_name in self._quantized_act_var_name:
+            if var_name not in self._sampling_act_histogram:
+                self._sampling_act_histogram[var_name] = _AbsHistogram(
+                    self._sampling_bins)
+            var_tensor = _load_variable_data(self._scope, var_name)
+            self._sampling_act_histogram[var_name].update(var_tensor)
+
+    def _calculate_kl_threshold(self):
+        '''
+        Calculate the KL threshold of quantized variables.
+        '''
+        assert self._algo == "KL", "The algo should be KL to calculate kl threshold."
+        # Abs_max threshold for weights
+        for var_name in self._quantized_weight_var_name:
+            weight_data = _load_variable_data(self._scope, var_name)
+            if self._weight_quantize_type == "abs_max":
+                weight_threshold = float(np.max(np.abs(weight_data)))
+            elif self._weight_quantize_type == "channel_wise_abs_max":
+                weight_threshold = []
+                if self._weight_op_pairs.get(
+                        var_name) in _channelwise_quant_axis1_ops:
+                    for i in range(weight_data.shape[1]):
+                        weight_threshold.append(
+                            float(np.max(np.abs(weight_data[:, i]))))
+                else:
+                    for i in range(weight_data.shape[0]):
+                        weight_threshold.append(
+                            float(np.max(np.abs(weight_data[i]))))
+            self._quantized_var_kl_threshold[var_name] = weight_threshold
+
+        # KL threshold for activations, each activation in a process
+        self._quantized_var_kl_threshold.update(
+            _calculate_act_kl_thresholds(self._sampling_act_histogram,
+                                         self._histogram_bins,
+                                         self._num_workers))
 
     def _load_model_data(self):
         '''
@@ -15,15 +15,94 @@
 import numpy as np
 import yaml
 import time
+import json
 import pickle
 import os
 import os.path as osp
+import queue
+import shutil
+import tempfile
+import traceback
 from functools import reduce
+import multiprocessing as mp
 import paddle.fluid as fluid
-from multiprocessing import Process, Queue
+import paddlex
 from .prune_config import get_prune_params
+from ..utils.staged_eval import stratified_subset
 import paddlex.utils.logging as logging
 from paddlex.utils import seconds_to_hms
+from paddlex.utils.utils import check_spawn_main_guard, SPAWN_MAIN_GUARD_HINT
+
+
+class _SensitivityJournal(object):
+    """敏感度计算日志。每完成一次评估即追加一行json并落盘，进程中断后重新计算时，
+       从日志中恢复基线精度和已完成的敏感度。
+
+    Args:
+        journal_file (str): 日志文件路径，为None时不记录日志。
+        header (dict): 本次计算的配置，与已有日志的配置不一致时丢弃已有日志。
+    """
+
+    def __init__(self, journal_file, header):
+        self.journal_file = journal_file
+        self.baseline = None
+        self.results = dict()
+        self.f = None
+        if journal_file is None:
+            return
+        records = list()
+        if osp.exists(journal_file):
+            with open(journal_file) as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # 进程中断时最后一行可能不完整
+                        break
+        if len(records) == 0 or records[0].get('header') != header:
+            records = [{'header': header}]
+        for record in records[1:]:
+            if 'baseline' in record:
+                self.baseline = record['baseline']
+            else:
+                self.results.setdefault(record['param'], dict())[record[
+                    'ratio']] = record['loss']
+        if len(records) > 1:
+            logging.info("Resume {} results from {}.".format(
+                sum(len(v) for v in self.results.values()), journal_file))
+        # 去掉不完整的行后再追加
+        with open(journal_file + '.tmp', 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+        os.replace(journal_file + '.tmp', journal_file)
+        self.f = open(journal_file, 'a')
+
+    def _append(self, record):
+        if self.f is None:
+            return
+        self.f.write(json.dumps(record) + '\n')
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def set_baseline(self, baseline):
+        self.baseline = float(baseline)
+        self._append({'baseline': self.baseline})
+
+    def add(self, param, ratio, loss):
+        self._append({
+            'param': param,
+            'ratio': float(ratio),
+            'loss': float(loss)
+        })
+
+    def close(self):
+        """关闭日志。全部结果已保存至敏感度文件后调用，删除日志文件。
+        """
+        if self.f is None:
+            return
+        self.f.close()
+        self.f = None
+        os.remove(self.journal_file)
 
 
 def sensitivity(program,
@@ -32,7 +111,8 @@ def sensitivity(program,
                 eval_func,
                 sensitivities_file=None,
                 pruned_ratios=None,
-                scope=None):
+                scope=None,
+                journal_header=None):
     import paddleslim
     from paddleslim.prune import Pruner, load_sensitivities
     from paddleslim.core import GraphWrapper
@@ -46,6 +126,9 @@ def sensitivity(program,
 
     if pruned_ratios is None:
         pruned_ratios = np.arange(0.1, 1, step=0.1)
+    journal = _open_journal(sensitivities_file, pruned_ratios, journal_header)
+    for name, results in journal.results.items():
+        sensitivities.setdefault(name, {}).update(results)
 
     total_evaluate_iters = 0
     for name in param_names:
@@ -55,11 +138,13 @@ def sensitivity(program,
         else:
             total_evaluate_iters += (
                 len(list(pruned_ratios)) - len(sensitivities[name]))
-    eta = '-'
     start_time = time.time()
-    baseline = eval_func(graph.program)
+    if journal.baseline is None:
+        baseline = eval_func(graph.program)
+        journal.set_baseline(baseline)
+    else:
+        baseline = journal.baseline
     cost = time.time() - start_time
-    eta = cost * (total_evaluate_iters - 1)
     current_iter = 1
     for name in sensitivities:
         for ratio in pruned_ratios:
@@ -77,6 +162,7 @@ def sensitivity(program,
                 use_color=True)
             current_iter += 1
 
+            start_time = time.time()
             pruner = Pruner()
             logging.info("sensitive - param: {}; ratios: {}".format(name,
                                                                     ratio))
@@ -95,13 +181,186 @@ def sensitivity(program,
                                                                 loss))
 
             sensitivities[name][ratio] = loss
-
-            with open(sensitivities_file, 'wb') as f:
-                pickle.dump(sensitivities, f)
+            journal.add(name, ratio, loss)
 
             for param_name in param_backup.keys():
                 param_t = scope.find_var(param_name).get_tensor()
                 param_t.set(param_backup[param_name], place)
+            cost = time.time() - start_time
+    _save_sensitivities(sensitivities, sensitivities_file, journal)
+    return sensitivities
+
+
+def _open_journal(sensitivities_file, pruned_ratios, journal_header=None):
+    header = {'pruned_ratios': [float(r) for r in pruned_ratios]}
+    if journal_header is not None:
+        header.update(journal_header)
+    journal_file = None
+    if sensitivities_file is not None:
+        journal_file = sensitivities_file + '.journal'
+    return _SensitivityJournal(journal_file, header)
+
+
+def _save_sensitivities(sensitivities, sensitivities_file, journal):
+    if sensitivities_file is not None:
+        with open(sensitivities_file, 'wb') as f:
+            pickle.dump(sensitivities, f)
+    journal.close()
+
+
+def _eval_metric(model, eval_dataset, batch_size):
+    eval_metrics = model.evaluate(
+        eval_dataset=eval_dataset, batch_size=batch_size, return_details=False)
+    primary_key = list(eval_metrics.keys())[0]
+    return eval_metrics[primary_key]
+
+
+def _sensitivity_worker(model_dir, eval_dataset, batch_size, job_queue,
+                        result_queue):
+    # 每个进程加载独立的模型和scope，依次评估裁剪单个参数后的精度
+    try:
+        from paddleslim.prune import Pruner
+        model = paddlex.load_model(model_dir)
+        place = model.places[0]
+        while True:
+            job = job_queue.get()
+            if job is None:
+                break
+            name, ratio = job
+            _, param_backup, _ = Pruner().prune(
+                program=model.test_prog,
+                scope=model.scope,
+                params=[name],
+                ratios=[ratio],
+                place=place,
+                lazy=True,
+                only_graph=False,
+                param_backup=True)
+            metric = _eval_metric(model, eval_dataset, batch_size)
+            for param_name in param_backup.keys():
+                param_t = model.scope.find_var(param_name).get_tensor()
+                param_t.set(param_backup[param_name], place)
+            result_queue.put((name, ratio, float(metric)))
+    except Exception:
+        result_queue.put((None, None, traceback.format_exc()))
+
+
+def _get_devices():
+    if paddlex.env_info['place'] == 'cpu':
+        return ['']
+    visible = os.environ.get('CUDA_VISIBLE_DEVICES', None)
+    if visible:
+        return [d.strip() for d in visible.split(',') if d.strip() != '']
+    return [str(i) for i in range(fluid.core.get_cuda_device_count())]
+
+
+def _get_worker_result(result_queue, workers):
+    while True:
+        try:
+            name, ratio, metric = result_queue.get(timeout=10)
+        except queue.Empty:
+            if any(not p.is_alive() and p.exitcode != 0 for p in workers):
+                raise Exception(
+                    "A worker of sensitivity analysis exited unexpectedly. {}".
+                    format(SPAWN_MAIN_GUARD_HINT))
+            continue
+        if name is None:
+            raise Exception(
+                "Sensitivity analysis failed in a worker:\n{}".format(metric))
+        return name, ratio, metric
+
+
+def parallel_sensitivity(model,
+                         param_names,
+                         eval_dataset,
+                         batch_size,
+                         sensitivities_file,
+                         pruned_ratios,
+                         num_workers,
+                         journal_header=None):
+    """在多个进程中并行计算参数敏感度。各(参数, 裁剪率)的评估任务分发至num_workers个进程，
+       每个进程加载独立的模型和scope，有GPU时进程轮流使用各卡。每完成一个任务即写入日志，
+       中断后重新计算时跳过已完成的任务。
+
+    Args:
+        model (paddlex.cv.models): paddlex中的模型。
+        param_names (list): 需计算敏感度的参数名。
+        eval_dataset (paddlex.datasets): 验证数据读取器。
+        batch_size (int): 验证数据批大小。
+        sensitivities_file (str): 敏感度文件存储路径，日志保存在同目录下的
+            `sensitivities_file`.journal中。
+        pruned_ratios (list): 裁剪率。
+        num_workers (int): 进程数。
+        journal_header (dict): 除裁剪率外需与已有日志一致的配置。默认为None。
+
+    Returns:
+        dict: 由参数名和不同裁剪率下敏感度组成的字典。
+    """
+    check_spawn_main_guard("Sensitivity analysis with num_workers > 1")
+    journal = _open_journal(sensitivities_file, pruned_ratios, journal_header)
+    sensitivities = dict()
+    for name in param_names:
+        sensitivities[name] = dict(journal.results.get(name, {}))
+    jobs = [(name, ratio) for name in param_names for ratio in pruned_ratios
+            if ratio not in sensitivities[name]]
+    if journal.baseline is None:
+        journal.set_baseline(_eval_metric(model, eval_dataset, batch_size))
+    baseline = journal.baseline
+    if len(jobs) == 0:
+        _save_sensitivities(sensitivities, sensitivities_file, journal)
+        return sensitivities
+
+    model_dir = tempfile.mkdtemp()
+    workers = list()
+    try:
+        with fluid.scope_guard(model.scope):
+            model.save_model(model_dir)
+        devices = _get_devices()
+        ctx = mp.get_context('spawn')
+        job_queue = ctx.Queue()
+        result_queue = ctx.Queue()
+        for job in jobs:
+            job_queue.put(job)
+        num_workers = min(num_workers, len(jobs))
+        env = os.environ.get('CUDA_VISIBLE_DEVICES', None)
+        try:
+            for i in range(num_workers):
+                job_queue.put(None)
+                # 子进程启动时继承环境变量，由此指定其使用的卡
+                os.environ['CUDA_VISIBLE_DEVICES'] = devices[i % len(devices)]
+                p = ctx.Process(
+                    target=_sensitivity_worker,
+                    args=(model_dir, eval_dataset, batch_size, job_queue,
+                          result_queue))
+                p.start()
+                workers.append(p)
+        finally:
+            if env is None:
+                os.environ.pop('CUDA_VISIBLE_DEVICES', None)
+            else:
+                os.environ['CUDA_VISIBLE_DEVICES'] = env
+        start_time = time.time()
+        for current_iter in range(1, len(jobs) + 1):
+            name, ratio, metric = _get_worker_result(result_queue, workers)
+            loss = (baseline - metric) / baseline
+            sensitivities[name][ratio] = loss
+            journal.add(name, ratio, loss)
+            cost = (time.time() - start_time) / current_iter
+            logging.info(
+                "Total evaluate iters={}, current={}, progress={:.2f}%, eta={}, pruned param: {}; {}; loss={}".
+                format(
+                    len(jobs), current_iter, current_iter * 100.0 / len(jobs),
+                    seconds_to_hms(int(cost * (len(jobs) - current_iter))),
+                    name, ratio, loss),
+                use_color=True)
+        for p in workers:
+            p.join()
+    finally:
+        for p in workers:
+            if p.is_alive():
+                p.terminate()
+        shutil.rmtree(model_dir, ignore_errors=True)
+    _save_sensitivities(sensitivities, sensitivities_file, journal)
     return sensitivities
 
 
@@ -234,7 +493,12 @@ def update_program(program, model_dir, place, scope=None):
     return program
 
 
-def cal_params_sensitivities(model, save_file, eval_dataset, batch_size=8):
+def cal_params_sensitivities(model,
+                             save_file,
+                             eval_dataset,
+                             batch_size=8,
+                             num_workers=1,
+                             eval_ratio=None):
     """计算模型中可裁剪卷积Kernel的敏感度。
 
        1. 获取模型中可裁剪卷积Kernel的名称。
@@ -247,6 +511,11 @@ def cal_params_sensitivities(model, save_file, eval_dataset, batch_size=8):
         save_file (str): 计算的得到的sensetives文件存储路径。
         eval_dataset (paddlex.datasets): 验证数据读取器。
         batch_size (int): 验证数据批大小。默认为8。
+        num_workers (int): 并行计算敏感度的进程数，每个进程加载独立的模型，有GPU时进程轮流使用
+            各卡。子进程以spawn方式启动，会重新导入主程序，大于1时主程序的代码需放在
+            if __name__ == '__main__':下。为1时在当前进程中计算。默认为1。
+        eval_ratio (float): 快速模式下，在验证集中按层均匀选取的固定子集所占的比例，
+            取值范围为(0, 1)。为None时在完整验证集上评估。默认为None。
 
     Returns:
         dict: 由参数名和不同裁剪率下敏感度组成的字典。存储的信息如下：
@@ -263,6 +532,8 @@ def cal_params_sensitivities(model, save_file, eval_dataset, batch_size=8):
             }
 
             其中``weight_0``是卷积Kernel名；``sensitivities['weight_0']``是一个字典，key是裁剪率，value是敏感度。
+
+       计算过程记录在`save_file`.journal中，中断后以相同的参数重新调用时从中恢复已完成的结果。
     """
     import paddleslim
     from paddleslim.prune import Pruner, load_sensitivities
@@ -273,14 +544,32 @@ def cal_params_sensitivities(model, save_file, eval_dataset, batch_size=8):
         os.remove(save_file)
 
     prune_names = get_prune_params(model)
+    pruned_ratios = list(np.arange(0.1, 1, 0.1))
+    journal_header = {
+        'model': model.__class__.__name__,
+        'num_samples': eval_dataset.num_samples,
+        'eval_ratio': eval_ratio
+    }
+    if eval_ratio is not None:
+        eval_dataset = stratified_subset(eval_dataset, model.model_type,
+                                         eval_ratio)
+        logging.info(
+            "Evaluate the sensitivities on a subset of {} samples.".format(
+                eval_dataset.num_samples))
+
+    if num_workers > 1:
+        return parallel_sensitivity(
+            model,
+            prune_names,
+            eval_dataset,
+            batch_size,
+            save_file,
+            pruned_ratios,
+            num_workers,
+            journal_header=journal_header)
 
     def eval_for_prune(program):
-        eval_metrics = model.evaluate(
-            eval_dataset=eval_dataset,
-            batch_size=batch_size,
-            return_details=False)
-        primary_key = list(eval_metrics.keys())[0]
-        return eval_metrics[primary_key]
+        return _eval_metric(model, eval_dataset, batch_size)
 
     sensitivitives = sensitivity(
         model.test_prog,
@@ -288,14 +577,25 @@ def cal_params_sensitivities(model, save_file, eval_dataset, batch_size=8):
         prune_names,
         eval_for_prune,
         sensitivities_file=save_file,
-        pruned_ratios=list(np.arange(0.1, 1, 0.1)),
-        scope=model.scope)
+        pruned_ratios=pruned_ratios,
+        scope=model.scope,
+        journal_header=journal_header)
     return sensitivitives
 
 
-def analysis(model, dataset, batch_size=8, save_file='./model.sensi.data'):
+def analysis(model,
+             dataset,
+             batch_size=8,
+             save_file='./model.sensi.data',
+             num_workers=1,
+             eval_ratio=None):
     return cal_params_sensitivities(
-        model, eval_dataset=dataset, batch_size=batch_size, save_file=save_file)
+        model,
+        eval_dataset=dataset,
+        batch_size=batch_size,
+        save_file=save_file,
+        num_workers=num_workers,
+        eval_ratio=eval_ratio)
 
 
 def get_params_ratios(sensitivities_file, eval_metric_loss=0.05):
@@ -330,6 +630,248 @@ def get_params_ratios(sensitivities_file, eval_metric_loss=0.05):
     return params_ratios
 
 
+def _measure_conv(exe, in_shape, num_filters, filter_size, op, groups,
+                  repeats):
+    # 在CPU上单独运行一个卷积，返回耗时的中位数（ms）
+    padding = op.attr('paddings')
+    if op.has_attr('padding_algorithm') and \
+            op.attr('padding_algorithm') in ['SAME', 'VALID']:
+        padding = op.attr('padding_algorithm')
+    prog = fluid.Program()
+    startup_prog = fluid.Program()
+    with fluid.program_guard(prog, startup_prog):
+        with fluid.unique_name.guard():
+            x = fluid.data(name='x', shape=in_shape, dtype='float32')
+            y = fluid.layers.conv2d(
+                x,
+                num_filters=num_filters,
+                filter_size=filter_size,
+                stride=op.attr('strides'),
+                padding=padding,
+                dilation=op.attr('dilations'),
+                groups=groups,
+                bias_attr=False,
+                use_cudnn=False)
+    scope = fluid.Scope()
+    feed = {'x': np.random.rand(*in_shape).astype('float32')}
+    costs = list()
+    with fluid.scope_guard(scope):
+        exe.run(startup_prog)
+        for i in range(repeats + 2):
+            start_time = time.time()
+            exe.run(prog, feed=feed, fetch_list=[y], return_numpy=False)
+            # 前两次运行用于预热
+            if i >= 2:
+                costs.append(time.time() - start_time)
+    return float(np.median(costs)) * 1000
+
+
+def _pruned_channels(channels, ratio, groups=1):
+    return groups * max(1, int(round(channels // groups * (1 - ratio))))
+
+
+def cal_latency_table(model, save_file, pruned_ratios=None, repeats=20):
+    """在当前机器的CPU上测量模型中各卷积在不同输入、输出通道裁剪率下的耗时，保存为延时表，
+       用于按延时目标选择裁剪率。
+
+       【注意】模型需以固定的输入shape加载，即paddlex.load_model(model_dir, fixed_input_shape=[w, h])，
+           测量应在部署的目标机器上进行，并与部署时使用相同的CPU线程数。
+
+    Args:
+        model (paddlex.cv.models): paddlex中的模型。
+        save_file (str): 延时表的存储路径。
+        pruned_ratios (list): 测量的通道裁剪率，估计时在其间线性插值。默认为[0., 0.3, 0.6, 0.9]。
+        repeats (int): 每个卷积每种通道数测量的次数，取中位数。默认为20。
+
+    Returns:
+        dict: 延时表，各卷积的测量结果为一个二维列表，第i行第j列为输入通道裁剪率pruned_ratios[i]、
+            输出通道裁剪率pruned_ratios[j]下的耗时（ms）。
+    """
+    if pruned_ratios is None:
+        pruned_ratios = [0., 0.3, 0.6, 0.9]
+    pruned_ratios = sorted(float(r) for r in pruned_ratios)
+    exe = fluid.Executor(fluid.CPUPlace())
+    block = model.test_prog.global_block()
+    convs = list()
+    for op in block.ops:
+        if op.type not in ['conv2d', 'depthwise_conv2d']:
+            continue
+        in_shape = list(block.var(op.input('Input')[0]).shape)
+        if any(s <= 0 for s in in_shape[1:]):
+            raise Exception(
+                "The input shape of {} is unknown, please load the model with fixed_input_shape.".
+                format(op.input('Filter')[0]))
+        filter_shape = list(block.var(op.input('Filter')[0]).shape)
+        groups = op.attr('groups')
+        depthwise = groups > 1 and groups == in_shape[1]
+        latency = list()
+        for in_ratio in pruned_ratios:
+            row = list()
+            for out_ratio in pruned_ratios:
+                if depthwise:
+                    # 深度可分离卷积的输入、输出通道同时裁剪
+                    channels = _pruned_channels(in_shape[1], in_ratio)
+                    if len(row) > 0:
+                        row.append(row[0])
+                        continue
+                    cost = _measure_conv(exe, [1, channels] + in_shape[2:],
+                                         channels, filter_shape[2:], op,
+                                         channels, repeats)
+                else:
+                    cost = _measure_conv(
+                        exe, [1, _pruned_channels(in_shape[1], in_ratio,
+                                                  groups)] + in_shape[2:],
+                        _pruned_channels(filter_shape[0], out_ratio, groups),
+                        filter_shape[2:], op, groups, repeats)
+                row.append(cost)
+            latency.append(row)
+        convs.append({
+            'filter': op.input('Filter')[0],
+            'filter_shape': filter_shape,
+            'depthwise': depthwise,
+            'latency': latency
+        })
+        logging.info("Measure latency of {}, {:.3f}ms before pruning.".format(
+            op.input('Filter')[0], latency[0][0]))
+    latency_table = {'pruned_ratios': pruned_ratios, 'convs': convs}
+    with open(save_file, 'w') as f:
+        json.dump(latency_table, f)
+    logging.info("Latency of convolutions: {:.3f}ms, saved in {}.".format(
+        sum(conv['latency'][0][0] for conv in convs), save_file))
+    return latency_table
+
+
+class _LatencyModel(object):
+    # 由延时表和各参数裁剪对卷积通道的影响估计裁剪后卷积的总耗时
+    def __init__(self, latency_table, effects):
+        self.grid = np.array(latency_table['pruned_ratios'])
+        self.convs = latency_table['convs']
+        self.effects = effects
+
+    def _interp(self, latency, in_ratio, out_ratio):
+        latency = np.array(latency)
+        row = [np.interp(out_ratio, self.grid, r) for r in latency]
+        return float(np.interp(in_ratio, self.grid, row))
+
+    def conv_ratios(self, params_ratios):
+        # 各卷积输入、输出通道的裁剪率
+        ratios = [[0., 0.] for conv in self.convs]
+        for param, ratio in params_ratios.items():
+            for index, axis, scale in self.effects.get(param, []):
+                ratios[index][axis] = max(ratios[index][axis],
+                                          min(scale * ratio, 0.95))
+        return ratios
+
+    def latency(self, params_ratios, indices=None):
+        ratios = self.conv_ratios(params_ratios)
+        if indices is None:
+            indices = range(len(self.convs))
+        total = 0.
+        for i in indices:
+            conv = self.convs[i]
+            out_ratio, in_ratio = ratios[i]
+            if conv['depthwise']:
+                in_ratio = max(in_ratio, out_ratio)
+            total += self._interp(conv['latency'], in_ratio, out_ratio)
+        return total
+
+
+def get_params_ratios_by_latency(model, sensitivities_file, latency_file,
+                                 target_latency_ms):
+    """根据延时表和敏感度信息，选择使模型卷积的估计耗时不超过target_latency_ms、且敏感度之和
+       最小的裁剪率。每次在所有参数中选择将裁剪率提高一档后，每单位精度损失减少耗时最多的参数，
+       直至满足延时目标。
+
+    Args:
+        model (paddlex.cv.models): paddlex中的模型。
+        sensitivities_file (str): 敏感度文件存储路径。
+        latency_file (str): cal_latency_table保存的延时表路径。
+        target_latency_ms (float): 裁剪后卷积的目标总耗时（ms）。
+
+    Returns:
+        dict: 由参数名和裁剪率组成的字典，不裁剪的参数不在其中。
+    """
+    import paddleslim
+
+    if not osp.exists(sensitivities_file):
+        raise Exception('The sensitivities file is not exists!')
+    if not osp.exists(latency_file):
+        raise Exception('The latency file is not exists!')
+    sensitivities = paddleslim.prune.load_sensitivities(sensitivities_file)
+    with open(latency_file) as f:
+        latency_table = json.load(f)
+    program = model.test_prog
+    filter_index = dict()
+    for i, conv in enumerate(latency_table['convs']):
+        filter_index.setdefault(conv['filter'], list()).append(i)
+    prog_var_shape_dict = {}
+    for var in program.list_vars():
+        if var.name in filter_index:
+            prog_var_shape_dict[var.name] = var.shape
+
+    # 按0.5的裁剪率裁剪各参数，记录受影响的卷积通道及其裁剪率相对参数裁剪率的比例
+    effects = dict()
+    prune_names = [
+        name for name in get_prune_params(model) if name in sensitivities
+    ]
+    for name in prune_names:
+        pruned_program = channel_prune(
+            program, [name], [0.5],
+            model.places[0],
+            only_graph=True,
+            scope=model.scope)
+        effects[name] = list()
+        for block in pruned_program.blocks:
+            for var in block.all_parameters():
+                if var.name not in prog_var_shape_dict:
+                    continue
+                origin_shape = prog_var_shape_dict[var.name]
+                for axis in [0, 1]:
+                    if var.shape[axis] == origin_shape[axis]:
+                        continue
+                    scale = float(origin_shape[axis] - var.shape[
+                        axis]) / origin_shape[axis] / 0.5
+                    for index in filter_index[var.name]:
+                        effects[name].append((index, axis, scale))
+
+    latency_model = _LatencyModel(latency_table, effects)
+    params_ratios = dict((name, 0.) for name in prune_names)
+    latency = latency_model.latency(params_ratios)
+    origin_latency = latency
+    total_loss = 0.
+    while latency > target_latency_ms:
+        best = None
+        for name in prune_names:
+            ratios = sorted(r for r in sensitivities[name]
+                            if r > params_ratios[name])
+            if len(ratios) == 0:
+                continue
+            next_ratios = dict(params_ratios)
+            next_ratios[name] = ratios[0]
+            indices = set(index for index, _, _ in effects[name])
+            saving = latency_model.latency(
+                params_ratios, indices) - latency_model.latency(next_ratios,
+                                                                indices)
+            loss = sensitivities[name][ratios[0]] - sensitivities[name].get(
+                params_ratios[name], 0.)
+            score = saving / (max(loss, 0.) + 1e-6)
+            if saving > 0 and (best is None or score > best[0]):
+                best = (score, name, ratios[0], loss)
+        if best is None:
+            logging.warning(
+                "The target latency {}ms can not be reached, the minimum latency is {:.3f}ms.".
+                format(target_latency_ms, latency))
+            break
+        _, name, ratio, loss = best
+        params_ratios[name] = ratio
+        total_loss += loss
+        latency = latency_model.latency(params_ratios)
+    logging.info(
+        "Estimated latency of convolutions: {:.3f}ms -> {:.3f}ms, sum of sensitivities: {:.4f}".
+        format(origin_latency, latency, total_loss))
+    return dict((k, v) for k, v in params_ratios.items() if v > 0)
+
+
 def cal_model_size(program,
                    place,
                    sensitivities_file,
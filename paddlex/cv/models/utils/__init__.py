@@ -0,0 +1,28 @@
+# copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+from paddlex.utils.lazy_import import lazy_getattr, import_all
+
+# 评估及可视化模块依赖数据集模块，在首次访问时才导入
+_LAZY_ATTRS = {
+    'detection_eval': ('.detection_eval', None),
+    'seg_eval': ('.seg_eval', None),
+    'visualize': ('.visualize', None),
+}
+
+__getattr__ = lazy_getattr(__name__, _LAZY_ATTRS)
+
+if sys.version_info < (3, 7):
+    import_all(__name__, _LAZY_ATTRS)
@@ -18,10 +18,17 @@ from __future__ import absolute_import
 import numpy as np
 import json
 import os
+import os.path as osp
 import sys
+import hashlib
+import io
 import cv2
 import copy
+import contextlib
+import threading
+import multiprocessing as mp
 import paddlex.utils.logging as logging
+from paddlex.utils.utils import get_default_num_workers
 
 # fix linspace problem for pycocotools while numpy > 1.17.2
 backup_linspace = np.linspace
@@ -44,8 +51,22 @@ def eval_results(results,
                  with_background=True,
                  resolution=None,
                  is_bbox_normalized=False,
-                 map_type='11point'):
-    """Evaluation for evaluation program results"""
+                 map_type='11point',
+                 xywh_results=None,
+                 segm_results=None,
+                 coco_evaluators=None):
+    """Evaluation for evaluation program results
+
+    Args:
+        xywh_results (list): bbox results already converted by `bbox2out`.
+            Compute from `results` if None.
+        segm_results (list): mask results already converted by `mask2out`.
+            Compute from `results` if None.
+        coco_evaluators (dict): COCOEvaluator of `bbox` and `segm` which
+            have been updated with xywh_results and segm_results.
+    """
+    if coco_evaluators is None:
+        coco_evaluators = dict()
     box_ap_stats = []
     coco_gt_data = copy.deepcopy(coco_gt)
     eval_details = {'gt': copy.deepcopy(coco_gt.dataset)}
@@ -58,11 +79,17 @@ def eval_results(results,
                 results,
                 coco_gt_data,
                 with_background,
-                is_bbox_normalized=is_bbox_normalized)
+                is_bbox_normalized=is_bbox_normalized,
+                xywh_results=xywh_results,
+                evaluator=coco_evaluators.get('bbox'))
 
         if 'mask' in results[0]:
-            mask_ap_stats, segm_results = mask_eval(results, coco_gt_data,
-                                                    resolution)
+            mask_ap_stats, segm_results = mask_eval(
+                results,
+                coco_gt_data,
+                resolution,
+                segm_results=segm_results,
+                evaluator=coco_evaluators.get('segm'))
             ap_stats = [box_ap_stats, mask_ap_stats]
             eval_details['bbox'] = xywh_results
             eval_details['mask'] = segm_results
@@ -85,6 +112,72 @@ def eval_results(results,
     return box_ap_stats, eval_details
 
 
+def bbox_eval_state(results, metric, coco_gt, with_background=False):
+    """Get the mergeable bbox evaluation state of an evaluation shard.
+
+    Args:
+        results (list): evaluation program results of the shard.
+        metric (str): `VOC` or `COCO`.
+        coco_gt (pycocotools.coco.COCO): ground truth.
+        with_background (bool): whether class id 0 is the background.
+
+    Returns:
+        dict: `bbox` holds the detections in COCO result format. For VOC,
+            `map_state` holds the DetectionMAP state; for COCO, `im_ids`
+            holds all the evaluated images, including those without
+            detections.
+    """
+    clsid2catid = dict({
+        i + int(with_background): catid
+        for i, catid in enumerate(coco_gt.getCatIds())
+    })
+    state = dict()
+    if metric == 'VOC':
+        detection_map = DetectionMAP(
+            class_num=len(clsid2catid) + int(with_background))
+        state['bbox'] = update_voc_map(detection_map, results, clsid2catid)
+        state['map_state'] = detection_map.get_state()
+    else:
+        state['bbox'] = bbox2out(results, clsid2catid)
+        state['im_ids'] = [
+            int(i) for t in results
+            for i in np.array(t['im_id'][0]).flatten()
+        ]
+    return state
+
+
+def eval_bbox_states(states, metric, coco_gt, with_background=False):
+    """Reduce the states got by `bbox_eval_state` of the evaluation shards,
+    in the order of the shards, and evaluate like `eval_results`.
+    """
+    xywh_results = [r for state in states for r in state['bbox']]
+    eval_details = {'gt': copy.deepcopy(coco_gt.dataset)}
+    eval_details['bbox'] = xywh_results
+    if metric == 'VOC':
+        detection_map = DetectionMAP(
+            class_num=len(coco_gt.getCatIds()) + int(with_background))
+        for state in states:
+            detection_map.merge_state(state['map_state'])
+        detection_map.accumulate()
+        return [100. * detection_map.get_map()], eval_details
+
+    if len(xywh_results) == 0:
+        logging.warning(
+            "The number of valid bbox detected is zero.\n Please use reasonable model and check input data.\n stop eval!"
+        )
+        return [0.0], eval_details
+    evaluator = COCOEvaluator(coco_gt, 'bbox')
+    for state in states:
+        evaluator.update(state['bbox'], state['im_ids'])
+    np.linspace = fixed_linspace
+    try:
+        box_ap_stats = cocoapi_eval(xywh_results, 'bbox', evaluator=evaluator)
+    finally:
+        np.linspace = backup_linspace
+    sys.stdout.flush()
+    return box_ap_stats, eval_details
+
+
 def proposal_eval(results, coco_gt, outputfile, max_dets=(100, 300, 1000)):
     assert 'proposal' in results[0]
     assert outfile.endswith('.json')
@@ -105,7 +198,9 @@ def proposal_eval(results, coco_gt, outputfile, max_dets=(100, 300, 1000)):
 def coco_bbox_eval(results,
                    coco_gt,
                    with_background=True,
-                   is_bbox_normalized=False):
+                   is_bbox_normalized=False,
+                   xywh_results=None,
+                   evaluator=None):
     assert 'bbox' in results[0]
     # matplotlib.use() must be called *before* pylab, matplotlib.pyplot,
     # or matplotlib.backends is imported for the first time
@@ -122,17 +217,21 @@ def coco_bbox_eval(results,
         {i + int(with_background): catid
          for i, catid in enumerate(cat_ids)})
 
-    xywh_results = bbox2out(
-        results, clsid2catid, is_bbox_normalized=is_bbox_normalized)
+    if xywh_results is None:
+        xywh_results = bbox2out(
+            results, clsid2catid, is_bbox_normalized=is_bbox_normalized)
 
     results = copy.deepcopy(xywh_results)
     if len(xywh_results) == 0:
         logging.warning(
             "The number of valid bbox detected is zero.\n Please use reasonable model and check input data.\n stop eval!"
         )
+        if evaluator is not None:
+            evaluator.close()
         return [0.0], results
 
-    map_stats = cocoapi_eval(xywh_results, 'bbox', coco_gt=coco_gt)
+    map_stats = cocoapi_eval(
+        xywh_results, 'bbox', coco_gt=coco_gt, evaluator=evaluator)
     # flush coco evaluation result
     sys.stdout.flush()
     return map_stats, results
@@ -206,7 +305,12 @@ def loadRes(coco_obj, anns):
     return res
 
 
-def mask_eval(results, coco_gt, resolution, thresh_binarize=0.5):
+def mask_eval(results,
+              coco_gt,
+              resolution,
+              thresh_binarize=0.5,
+              segm_results=None,
+              evaluator=None):
     assert 'mask' in results[0]
     # matplotlib.use() must be called *before* pylab, matplotlib.pyplot,
     # or matplotlib.backends is imported for the first time
@@ -217,15 +321,20 @@ def mask_eval(results, coco_gt, resolution, thresh_binarize=0.5):
 
     clsid2catid = {i + 1: v for i, v in enumerate(coco_gt.getCatIds())}
 
-    segm_results = mask2out(results, clsid2catid, resolution, thresh_binarize)
+    if segm_results is None:
+        segm_results = mask2out(results, clsid2catid, resolution,
+                                thresh_binarize)
     results = copy.deepcopy(segm_results)
     if len(segm_results) == 0:
         logging.warning(
             "The number of valid mask detected is zero.\n Please use reasonable model and check input data."
         )
+        if evaluator is not None:
+            evaluator.close()
         return None, results
 
-    map_stats = cocoapi_eval(segm_results, 'segm', coco_gt=coco_gt)
+    map_stats = cocoapi_eval(
+        segm_results, 'segm', coco_gt=coco_gt, evaluator=evaluator)
     return map_stats, results
 
 
@@ -233,7 +342,8 @@ def cocoapi_eval(anns,
                  style,
                  coco_gt=None,
                  anno_file=None,
-                 max_dets=(100, 300, 1000)):
+                 max_dets=(100, 300, 1000),
+                 evaluator=None):
     """
     Args:
         anns: Evaluation result.
@@ -242,8 +352,10 @@ def cocoapi_eval(anns,
                  eg: coco_gt = COCO(anno_file)
         anno_file: COCO annotations file.
         max_dets: COCO evaluation maxDets.
+        evaluator: COCOEvaluator which has been updated with `anns`
+                 incrementally, a new one is created if None.
     """
-    assert coco_gt != None or anno_file != None
+    assert coco_gt != None or anno_file != None or evaluator != None
     # matplotlib.use() must be called *before* pylab, matplotlib.pyplot,
     # or matplotlib.backends is imported for the first time
     # pycocotools import matplotlib
@@ -252,9 +364,15 @@ def cocoapi_eval(anns,
     from pycocotools.coco import COCO
     from pycocotools.cocoeval import COCOeval
 
+    if evaluator is not None:
+        return evaluator.summarize()
     if coco_gt == None:
         coco_gt = COCO(anno_file)
     logging.debug("Start evaluate...")
+    if style in ['bbox', 'segm']:
+        evaluator = COCOEvaluator(coco_gt, style)
+        evaluator.update(anns)
+        return evaluator.summarize()
     coco_dt = loadRes(coco_gt, anns)
     if style == 'proposal':
         coco_eval = COCOeval(coco_gt, coco_dt, 'bbox')
@@ -268,6 +386,240 @@ def cocoapi_eval(anns,
     return coco_eval.stats
 
 
+def _load_dt(coco_gt, anns):
+    if len(anns) > 0:
+        return loadRes(coco_gt, anns)
+    from pycocotools.coco import COCO
+    coco_dt = COCO()
+    coco_dt.dataset['images'] = [img for img in coco_gt.dataset['images']]
+    coco_dt.dataset['categories'] = copy.deepcopy(coco_gt.dataset[
+        'categories'])
+    coco_dt.dataset['annotations'] = []
+    coco_dt.createIndex()
+    return coco_dt
+
+
+def _set_eval_params(coco_eval, img_ids=None, iou_thrs=None, max_dets=None):
+    p = coco_eval.params
+    if img_ids is not None:
+        p.imgIds = img_ids
+    if iou_thrs is not None:
+        p.iouThrs = np.array(iou_thrs, dtype='float64')
+    if max_dets is not None:
+        p.maxDets = list(max_dets)
+    p.imgIds = list(np.unique(p.imgIds))
+    p.catIds = list(np.unique(p.catIds))
+    p.maxDets = sorted(p.maxDets)
+    return p
+
+
+def _evaluate_images(coco_gt,
+                     anns,
+                     img_ids,
+                     iou_type,
+                     iou_thrs=None,
+                     max_dets=None):
+    """Run COCOeval.evaluateImg on `img_ids` only, `anns` must contain all
+       the detections of these images.
+
+    Returns:
+        dict: {(catId, areaIdx, imgId): evalImg}
+    """
+    from pycocotools.cocoeval import COCOeval
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        coco_dt = _load_dt(coco_gt, anns)
+    coco_eval = COCOeval(coco_gt, coco_dt, iou_type)
+    p = _set_eval_params(coco_eval, img_ids, iou_thrs, max_dets)
+    coco_eval._prepare()
+    coco_eval.ious = {(img_id, cat_id): coco_eval.computeIoU(img_id, cat_id)
+                      for img_id in p.imgIds for cat_id in p.catIds}
+    max_det = p.maxDets[-1]
+    eval_imgs = dict()
+    for cat_id in p.catIds:
+        for area_idx, area_rng in enumerate(p.areaRng):
+            for img_id in p.imgIds:
+                eval_imgs[(cat_id, area_idx, img_id)] = coco_eval.evaluateImg(
+                    img_id, cat_id, area_rng, max_det)
+    return eval_imgs
+
+
+_worker_coco_gt = None
+
+
+def _init_evaluate_worker(gt_dataset):
+    global _worker_coco_gt
+    from pycocotools.coco import COCO
+
+    np.linspace = fixed_linspace
+    with contextlib.redirect_stdout(io.StringIO()):
+        _worker_coco_gt = COCO()
+        _worker_coco_gt.dataset = gt_dataset
+        _worker_coco_gt.createIndex()
+
+
+def _evaluate_images_worker(anns, img_ids, iou_type, iou_thrs, max_dets):
+    return _evaluate_images(_worker_coco_gt, anns, img_ids, iou_type,
+                            iou_thrs, max_dets)
+
+
+class COCOEvaluator(object):
+    """In-memory COCO evaluation for `bbox` and `segm`.
+
+    Detections are grouped by image and evaluated by chunks of images with
+    `COCOeval.evaluateImg` in a process pool as soon as they are given to
+    `update`, so evaluation overlaps with inference. `summarize` assembles
+    the per-image results in the layout of `COCOeval.evaluate` before
+    running `accumulate` and `summarize`, so the stats are identical to a
+    single COCOeval run on all the detections.
+
+    Args:
+        coco_gt (pycocotools.coco.COCO): ground truth.
+        iou_type (str): `bbox` or `segm`.
+        num_workers (int): number of processes, evaluate in the current
+            process if 0. Default is min(8, cpu_count), and 0 on Windows and
+            macOS where the processes are spawned.
+        chunk_size (int): number of images evaluated by one task.
+        iou_thrs (list): IoU thresholds, COCOeval default if None.
+        max_dets (list): max detection numbers, COCOeval default if None.
+    """
+
+    def __init__(self,
+                 coco_gt,
+                 iou_type='bbox',
+                 num_workers=None,
+                 chunk_size=64,
+                 iou_thrs=None,
+                 max_dets=None):
+        assert iou_type in ['bbox', 'segm'], \
+            "iou_type only support 'bbox' or 'segm'"
+        self.coco_gt = coco_gt
+        self.iou_type = iou_type
+        self.chunk_size = chunk_size
+        self.iou_thrs = iou_thrs
+        self.max_dets = max_dets
+        if num_workers is None:
+            num_workers = get_default_num_workers()
+        self.pool = None
+        if num_workers == 0:
+            # COCOeval modifies the annotations of the ground truth
+            self.coco_gt = copy.deepcopy(coco_gt)
+        else:
+            self.pool = mp.Pool(
+                num_workers,
+                initializer=_init_evaluate_worker,
+                initargs=(coco_gt.dataset, ))
+        self.img_ids = set(coco_gt.getImgIds())
+        self.evaluated_img_ids = set()
+        self.pending_anns = list()
+        self.pending_img_ids = list()
+        self.tasks = list()
+        self.lock = threading.Lock()
+
+    def update(self, anns, img_ids=None):
+        """Add the detections of some images. All the detections of an image
+           must be given in the same call.
+
+        Images which are not in the ground truth, such as the negative
+        samples added by `VOCDetection.add_negative_samples`, are skipped
+        together with their detections.
+
+        Args:
+            anns (list): detections in COCO result format.
+            img_ids (list): images the detections belong to, images without
+                detections can be listed here as well. Collected from `anns`
+                if None.
+        """
+        if img_ids is None:
+            img_ids = [ann['image_id'] for ann in anns]
+        img_ids = [
+            int(i) for i in np.unique(np.array(img_ids, dtype='int64'))
+            if int(i) in self.img_ids
+        ]
+        anns = [ann for ann in anns if int(ann['image_id']) in self.img_ids]
+        with self.lock:
+            for img_id in img_ids:
+                if img_id in self.evaluated_img_ids:
+                    raise Exception(
+                        "Detections of image {} have been updated already.".
+                        format(img_id))
+            self.evaluated_img_ids.update(img_ids)
+            self.pending_anns.extend(anns)
+            self.pending_img_ids.extend(img_ids)
+            if len(self.pending_img_ids) >= self.chunk_size:
+                self._flush()
+
+    def _flush(self):
+        if len(self.pending_img_ids) == 0:
+            return
+        anns, img_ids = self.pending_anns, self.pending_img_ids
+        self.pending_anns, self.pending_img_ids = list(), list()
+        if self.pool is not None:
+            self.tasks.append(
+                self.pool.apply_async(_evaluate_images_worker, (
+                    anns, img_ids, self.iou_type, self.iou_thrs,
+                    self.max_dets)))
+        else:
+            # loadRes adds keys to the annotations
+            anns = copy.deepcopy(anns)
+            self.tasks.append(
+                _evaluate_images(self.coco_gt, anns, img_ids, self.iou_type,
+                                 self.iou_thrs, self.max_dets))
+
+    def summarize(self):
+        """Evaluate the remaining images and summarize.
+
+        Returns:
+            np.ndarray: COCOeval.stats
+        """
+        coco_eval = self.accumulate()
+        coco_eval.summarize()
+        return coco_eval.stats
+
+    def accumulate(self):
+        """Evaluate the remaining images and accumulate.
+
+        Returns:
+            pycocotools.cocoeval.COCOeval: the accumulated COCOeval, whose
+                `eval` holds precision, recall and scores.
+        """
+        from pycocotools.cocoeval import COCOeval
+
+        with self.lock:
+            # images without any detection
+            missing_img_ids = sorted(self.img_ids - self.evaluated_img_ids)
+            self.evaluated_img_ids.update(missing_img_ids)
+            self.pending_img_ids.extend(missing_img_ids)
+            self._flush()
+            tasks, self.tasks = self.tasks, list()
+        eval_imgs = dict()
+        try:
+            for task in tasks:
+                if self.pool is not None:
+                    task = task.get()
+                eval_imgs.update(task)
+        finally:
+            self.close()
+
+        coco_eval = COCOeval(self.coco_gt, None, self.iou_type)
+        p = _set_eval_params(
+            coco_eval, iou_thrs=self.iou_thrs, max_dets=self.max_dets)
+        coco_eval.evalImgs = [
+            eval_imgs.get((cat_id, area_idx, img_id))
+            for cat_id in p.catIds for area_idx in range(len(p.areaRng))
+            for img_id in p.imgIds
+        ]
+        coco_eval._paramsEval = copy.deepcopy(p)
+        coco_eval.accumulate()
+        return coco_eval
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
 def proposal2out(results, is_bbox_normalized=False):
     xywh_res = []
     for t in results:
@@ -478,8 +830,9 @@ def voc_bbox_eval(results,
     Args:
         results (list): prediction bounding box results.
         class_num (int): evaluation class number.
-        overlap_thresh (float): the postive threshold of
-                        bbox overlap
+        overlap_thresh (float|list): the postive threshold of
+                        bbox overlap, the mAP is averaged over the
+                        thresholds if a list is given
         map_type (string): method for mAP calcualtion,
                         can only be '11point' or 'integral'
         is_bbox_normalized (bool): whether bbox is normalized
@@ -512,9 +865,35 @@ def voc_bbox_eval(results,
         is_bbox_normalized=is_bbox_normalized,
         evaluate_difficult=evaluate_difficult)
 
+    xywh_res = update_voc_map(detection_map, results, clsid2catid,
+                              evaluate_difficult)
+
+    logging.debug("Accumulating evaluatation results...")
+    detection_map.accumulate()
+    map_stat = 100. * detection_map.get_map()
+    logging.debug("mAP({}, {}) = {:.2f}".format(overlap_thresh, map_type,
+                                                map_stat))
+    return map_stat, xywh_res
+
+
+def update_voc_map(detection_map,
+                   results,
+                   clsid2catid,
+                   evaluate_difficult=False):
+    """
+    Update DetectionMAP with prediction results of evaluation program
+
+    Args:
+        detection_map (DetectionMAP): the metric to update.
+        results (list): prediction bounding box results.
+        clsid2catid (dict): mapping from class id to category id.
+        evaluate_difficult (bool): whether to evaluate
+                        difficult gt bbox.
+
+    Returns:
+        list: the bounding boxes in COCO result format.
+    """
     xywh_res = []
-    det_nums = 0
-    gt_nums = 0
     for t in results:
         bboxes = t['bbox'][0]
         bbox_lengths = t['bbox'][1][0]
@@ -541,8 +920,6 @@ def voc_bbox_eval(results,
                     gt_box, gt_label, difficult)
                 detection_map.update(bbox, gt_box, gt_label, difficult)
                 bbox_idx += bbox_num
-                det_nums += bbox_num
-                gt_nums += gt_box.shape[0]
 
                 im_id = int(im_ids[i])
                 for b in bbox:
@@ -588,12 +965,7 @@ def voc_bbox_eval(results,
                     }
                     xywh_res.append(coco_res)
 
-    logging.debug("Accumulating evaluatation results...")
-    detection_map.accumulate()
-    map_stat = 100. * detection_map.get_map()
-    logging.debug("mAP({:.2f}, {}) = {:.2f}".format(overlap_thresh, map_type,
-                                                    map_stat))
-    return map_stat, xywh_res
+    return xywh_res
 
 
 def prune_zero_padding(gt_box, gt_label, difficult=None):
@@ -636,17 +1008,61 @@ def jaccard_overlap(pred, gt, is_bbox_normalized=False):
     return overlap
 
 
+def jaccard_overlap_matrix(pred, gt, is_bbox_normalized=False):
+    """
+    Calculate jaccard overlap ratio between every pair of prediction
+    and ground truth bounding boxes, the result equals calling
+    jaccard_overlap pair by pair.
+
+    Args:
+        pred (np.ndarray): prediction boxes with shape [P, 4].
+        gt (np.ndarray): ground truth boxes with shape [G, 4].
+        is_bbox_normalized (bool): whether bbox is normalized
+            to range [0, 1].
+
+    Returns:
+        np.ndarray: overlap matrix with shape [P, G].
+    """
+    pred = np.asarray(pred, dtype=np.float64).reshape(-1, 4)
+    gt = np.asarray(gt, dtype=np.float64).reshape(-1, 4)
+    norm = 1. - float(is_bbox_normalized)
+    inter_xmin = np.maximum(pred[:, None, 0], gt[None, :, 0])
+    inter_ymin = np.maximum(pred[:, None, 1], gt[None, :, 1])
+    inter_xmax = np.minimum(pred[:, None, 2], gt[None, :, 2])
+    inter_ymax = np.minimum(pred[:, None, 3], gt[None, :, 3])
+    inter_size = (inter_xmax - inter_xmin + norm) * (
+        inter_ymax - inter_ymin + norm)
+    pred_size = (pred[:, 2] - pred[:, 0] + norm) * (
+        pred[:, 3] - pred[:, 1] + norm)
+    gt_size = (gt[:, 2] - gt[:, 0] + norm) * (gt[:, 3] - gt[:, 1] + norm)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        overlap = inter_size / (
+            pred_size[:, None] + gt_size[None, :] - inter_size)
+    disjoint = (pred[:, None, 0] >= gt[None, :, 2]) | \
+               (pred[:, None, 2] <= gt[None, :, 0]) | \
+               (pred[:, None, 1] >= gt[None, :, 3]) | \
+               (pred[:, None, 3] <= gt[None, :, 1])
+    overlap[disjoint] = 0.
+    return overlap
+
+
 class DetectionMAP(object):
     """
     Calculate detection mean average precision.
     Currently support two types: 11point and integral
 
+    Matching is done per image on an IoU matrix and the precision/recall
+    curves are built with cumulative sums, so several overlap thresholds
+    (e.g. 0.5:0.95) can be evaluated in one pass.
+
     Args:
         class_num (int): the class number.
-        overlap_thresh (float): The threshold of overlap
+        overlap_thresh (float|list): The threshold of overlap
             ratio between prediction bounding box and
             ground truth bounding box for deciding
-            true/false positive. Default 0.5.
+            true/false positive. If it is a list, mAP is
+            calculated for each threshold and get_map returns
+            their average. Default 0.5.
         map_type (str): calculation method of mean average
             precision, currently support '11point' and
             'integral'. Default '11point'.
@@ -664,6 +1080,8 @@ class DetectionMAP(object):
                  evaluate_difficult=False):
         self.class_num = class_num
         self.overlap_thresh = overlap_thresh
+        self.overlap_threshs = np.array(
+            overlap_thresh, dtype=np.float64, ndmin=1)
         assert map_type in ['11point', 'integral'], \
                 "map_type currently only support '11point' "\
                 "and 'integral'"
@@ -676,104 +1094,169 @@ class DetectionMAP(object):
         """
         Update metric statics from given prediction and ground
         truth infomations.
+
+        Args:
+            bbox (np.ndarray): prediction with shape [P, 6], each row is
+                [label, score, xmin, ymin, xmax, ymax].
+            gt_box (np.ndarray): ground truth boxes with shape [G, 4].
+            gt_label (np.ndarray): ground truth labels with shape [G, 1].
+            difficult (np.ndarray): whether ground truth boxes are
+                difficult, with shape [G, 1]. Default None.
+        """
+        bbox = np.asarray(bbox).reshape(-1, 6)
+        self.update_arrays(bbox[:, 0], bbox[:, 1], bbox[:, 2:], gt_box,
+                           gt_label, difficult)
+
+    def update_arrays(self,
+                      label,
+                      score,
+                      bbox,
+                      gt_box,
+                      gt_label,
+                      difficult=None):
+        """
+        Update metric statics with predictions of one image given as
+        separate label [P], score [P] and bbox [P, 4] arrays.
         """
+        gt_box = np.asarray(gt_box).reshape(-1, 4)
+        gt_label = np.asarray(gt_label).reshape(-1).astype(np.int64)
         if difficult is None:
-            difficult = np.zeros_like(gt_label)
+            difficult = np.zeros(gt_label.shape, dtype=np.bool_)
+        else:
+            difficult = np.asarray(difficult).reshape(-1).astype(
+                np.int64) != 0
+        if self.evaluate_difficult:
+            difficult = np.zeros(gt_label.shape, dtype=np.bool_)
 
         # record class gt count
-        for gtl, diff in zip(gt_label, difficult):
-            if self.evaluate_difficult or int(diff) == 0:
-                self.class_gt_counts[int(np.array(gtl))] += 1
-
-        # record class score positive
-        visited = [False] * len(gt_label)
-        for b in bbox:
-            label, score, xmin, ymin, xmax, ymax = b.tolist()
-            pred = [xmin, ymin, xmax, ymax]
-            max_idx = -1
-            max_overlap = -1.0
-            for i, gl in enumerate(gt_label):
-                if int(gl) == int(label):
-                    overlap = jaccard_overlap(pred, gt_box[i],
+        np.add.at(self.class_gt_counts, gt_label[~difficult], 1)
+
+        label = np.asarray(label).reshape(-1).astype(np.int64)
+        score = np.asarray(score, dtype=np.float64).reshape(-1)
+        if label.size == 0:
+            return
+        num_thresh = len(self.overlap_threshs)
+        tp = np.zeros((label.size, num_thresh), dtype=np.bool_)
+        valid = np.ones((label.size, num_thresh), dtype=np.bool_)
+        if gt_label.size > 0:
+            overlaps = jaccard_overlap_matrix(bbox, gt_box,
                                               self.is_bbox_normalized)
-                    if overlap > max_overlap:
-                        max_overlap = overlap
-                        max_idx = i
-
-            if max_overlap > self.overlap_thresh:
-                if self.evaluate_difficult or \
-                        int(np.array(difficult[max_idx])) == 0:
-                    if not visited[max_idx]:
-                        self.class_score_poss[int(label)].append([score, 1.0])
-                        visited[max_idx] = True
-                    else:
-                        self.class_score_poss[int(label)].append([score, 0.0])
-            else:
-                self.class_score_poss[int(label)].append([score, 0.0])
+            overlaps[label[:, None] != gt_label[None, :]] = -1.
+            # argmax keeps the first ground truth among equal overlaps
+            max_idx = overlaps.argmax(axis=1)
+            max_overlap = overlaps[np.arange(label.size), max_idx]
+            matched = max_overlap[:, None] > self.overlap_threshs[None, :]
+            # predictions matched with difficult ground truth are ignored
+            valid = ~(matched & difficult[max_idx][:, None])
+            for t in range(num_thresh):
+                cand = np.nonzero(matched[:, t] & valid[:, t])[0]
+                # only the first prediction matched with a ground truth
+                # is a true positive, the rest are duplicates
+                _, first = np.unique(max_idx[cand], return_index=True)
+                tp[cand[first], t] = True
+        self.labels.append(label)
+        self.scores.append(score)
+        self.tps.append(tp)
+        self.valids.append(valid)
+
+    def get_state(self):
+        """
+        Get the mergeable statics of the images updated so far, used
+        to reduce the results of evaluation shards
+        """
+        return {
+            'labels': self.labels,
+            'scores': self.scores,
+            'tps': self.tps,
+            'valids': self.valids,
+            'class_gt_counts': self.class_gt_counts
+        }
+
+    def merge_state(self, state):
+        """
+        Merge the statics got by `get_state` of another shard
+        """
+        self.labels.extend(state['labels'])
+        self.scores.extend(state['scores'])
+        self.tps.extend(state['tps'])
+        self.valids.extend(state['valids'])
+        self.class_gt_counts += state['class_gt_counts']
 
     def reset(self):
         """
         Reset metric statics
         """
-        self.class_score_poss = [[] for _ in range(self.class_num)]
-        self.class_gt_counts = [0] * self.class_num
+        self.labels = []
+        self.scores = []
+        self.tps = []
+        self.valids = []
+        self.class_gt_counts = np.zeros(self.class_num, dtype=np.int64)
         self.mAP = None
+        self.mAPs = None
         self.APs = [None] * self.class_num
 
+    def _get_ap(self, score, tp, count):
+        """
+        Calculate average precision of one class from the scores and
+        true positive flags of its predictions
+        """
+        order = np.argsort(-score, kind='stable')
+        accum_tp = np.cumsum(tp[order], dtype=np.int64)
+        precision = accum_tp / np.arange(1., accum_tp.size + 1.)
+        recall = accum_tp / float(count)
+        if self.map_type == '11point':
+            max_precisions = np.zeros(11)
+            for j in range(11):
+                mask = recall >= j / 10.
+                if mask.any():
+                    max_precisions[j] = precision[mask].max()
+            return max_precisions.sum() / 11.
+        elif self.map_type == 'integral':
+            recall_gap = np.diff(recall, prepend=0.)
+            mask = np.abs(recall_gap) > 1e-6
+            return float(np.sum(precision[mask] * recall_gap[mask]))
+        else:
+            raise Exception("Unspported mAP type {}".format(self.map_type))
+
     def accumulate(self):
         """
         Accumulate metric results and calculate mAP
         """
-        mAP = 0.
+        num_thresh = len(self.overlap_threshs)
+        if len(self.labels) > 0:
+            labels = np.concatenate(self.labels)
+            scores = np.concatenate(self.scores)
+            tps = np.concatenate(self.tps)
+            valids = np.concatenate(self.valids)
+        else:
+            labels = np.zeros((0, ), dtype=np.int64)
+            scores = np.zeros((0, ))
+            tps = np.zeros((0, num_thresh), dtype=np.bool_)
+            valids = np.zeros((0, num_thresh), dtype=np.bool_)
+        # group predictions by class, keeping the order of update
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(self.class_num + 1))
+
+        mAPs = np.zeros(num_thresh)
         valid_cnt = 0
-        for id, (
-                score_pos, count
-        ) in enumerate(zip(self.class_score_poss, self.class_gt_counts)):
+        for id, count in enumerate(self.class_gt_counts):
             if count == 0: continue
-            if len(score_pos) == 0:
-                valid_cnt += 1
-                continue
-
-            accum_tp_list, accum_fp_list = \
-                    self._get_tp_fp_accum(score_pos)
-            precision = []
-            recall = []
-            for ac_tp, ac_fp in zip(accum_tp_list, accum_fp_list):
-                precision.append(float(ac_tp) / (ac_tp + ac_fp))
-                recall.append(float(ac_tp) / count)
-
-            if self.map_type == '11point':
-                max_precisions = [0.] * 11
-                start_idx = len(precision) - 1
-                for j in range(10, -1, -1):
-                    for i in range(start_idx, -1, -1):
-                        if recall[i] < float(j) / 10.:
-                            start_idx = i
-                            if j > 0:
-                                max_precisions[j - 1] = max_precisions[j]
-                                break
-                        else:
-                            if max_precisions[j] < precision[i]:
-                                max_precisions[j] = precision[i]
-                mAP += sum(max_precisions) / 11.
-                self.APs[id] = sum(max_precisions) / 11.
-                valid_cnt += 1
-            elif self.map_type == 'integral':
-                import math
-                ap = 0.
-                prev_recall = 0.
-                for i in range(len(precision)):
-                    recall_gap = math.fabs(recall[i] - prev_recall)
-                    if recall_gap > 1e-6:
-                        ap += precision[i] * recall_gap
-                        prev_recall = recall[i]
-                mAP += ap
-                self.APs[id] = sum(max_precisions) / 11.
-                valid_cnt += 1
-            else:
-                raise Exception("Unspported mAP type {}".format(self.map_type))
-
-        self.mAP = mAP / float(valid_cnt) if valid_cnt > 0 else mAP
+            valid_cnt += 1
+            idx = order[bounds[id]:bounds[id + 1]]
+            aps = np.zeros(num_thresh)
+            for t in range(num_thresh):
+                mask = valids[idx, t]
+                if not mask.any():
+                    continue
+                aps[t] = self._get_ap(scores[idx][mask], tps[idx, t][mask],
+                                      count)
+            mAPs += aps
+            self.APs[id] = float(aps.mean())
+
+        if valid_cnt > 0:
+            mAPs = mAPs / float(valid_cnt)
+        self.mAPs = mAPs.tolist()
+        self.mAP = float(mAPs.mean())
 
     def get_map(self):
         """
@@ -783,23 +1266,6 @@ class DetectionMAP(object):
             raise Exception("mAP is not calculated.")
         return self.mAP
 
-    def _get_tp_fp_accum(self, score_pos_list):
-        """
-        Calculate accumulating true/false positive results from
-        [score, pos] records
-        """
-        sorted_list = sorted(score_pos_list, key=lambda s: s[0], reverse=True)
-        accum_tp = 0
-        accum_fp = 0
-        accum_tp_list = []
-        accum_fp_list = []
-        for (score, pos) in sorted_list:
-            accum_tp += int(pos)
-            accum_tp_list.append(accum_tp)
-            accum_fp += 1 - int(pos)
-            accum_fp_list.append(accum_fp)
-        return accum_tp_list, accum_fp_list
-
 
 def makeplot(rs, ps, outDir, class_name, iou_type):
     """针对某个特定类别，绘制不同评估要求下的准确率和召回率。
@@ -854,6 +1320,59 @@ def makeplot(rs, ps, outDir, class_name, iou_type):
         plt.close(fig)
 
 
+def _file_md5(file_path):
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def load_eval_details_cache(eval_details_file, name):
+    """读取eval_details_file对应的缓存（eval_details_file + '.cache.npz'）中名为name的结果，
+       eval_details_file内容改变后缓存失效。
+
+       Returns:
+           np.ndarray: 缓存的结果，不存在或已失效时为None。
+    """
+    if eval_details_file is None:
+        return None
+    cache_file = eval_details_file + '.cache.npz'
+    if not osp.exists(cache_file):
+        return None
+    try:
+        with np.load(cache_file) as cache:
+            if name not in cache.files or str(cache[
+                    'eval_details_md5']) != _file_md5(eval_details_file):
+                return None
+            return cache[name]
+    except Exception:
+        return None
+
+
+def save_eval_details_cache(eval_details_file, name, value):
+    """将名为name的中间结果写入eval_details_file对应的缓存。
+    """
+    if eval_details_file is None:
+        return
+    cache_file = eval_details_file + '.cache.npz'
+    key = _file_md5(eval_details_file)
+    arrays = dict()
+    if osp.exists(cache_file):
+        try:
+            with np.load(cache_file) as cache:
+                if str(cache['eval_details_md5']) == key:
+                    arrays = {k: cache[k] for k in cache.files}
+        except Exception:
+            pass
+    arrays[name] = value
+    arrays['eval_details_md5'] = np.array(key)
+    try:
+        np.savez(cache_file, **arrays)
+    except (IOError, OSError) as e:
+        logging.warning("Failed to save cache {}: {}".format(cache_file, e))
+
+
 def analyze_individual_category(k, cocoDt, cocoGt, catId, iou_type):
     """针对某个特定类别，分析忽略亚类混淆和类别混淆时的准确率。
 
@@ -881,57 +1400,87 @@ def analyze_individual_category(k, cocoDt, cocoGt, catId, iou_type):
     from pycocotools.coco import COCO
     from pycocotools.cocoeval import COCOeval
 
+    def _build_coco(coco_obj, anns):
+        # only this category is evaluated, so the annotations are shallow
+        # copied instead of deep copying the whole dataset
+        coco = COCO()
+        coco.dataset['images'] = coco_obj.dataset['images']
+        coco.dataset['categories'] = coco_obj.dataset['categories']
+        coco.dataset['annotations'] = anns
+        with contextlib.redirect_stdout(io.StringIO()):
+            coco.createIndex()
+        return coco
+
+    def _precision(gt_anns):
+        gt = _build_coco(cocoGt, gt_anns)
+        cocoEval = COCOeval(gt, dt, iou_type)
+        cocoEval.params.imgIds = imgIds
+        cocoEval.params.catIds = [catId]
+        cocoEval.params.maxDets = [100]
+        cocoEval.params.iouThrs = [.1]
+        cocoEval.params.useCats = 1
+        with contextlib.redirect_stdout(io.StringIO()):
+            cocoEval.evaluate()
+            cocoEval.accumulate()
+        return cocoEval.eval['precision'][0, :, 0, :, :]
+
+    def _ignored(ann):
+        ann = dict(ann)
+        ann['ignore'] = 1
+        ann['iscrowd'] = 1
+        ann['category_id'] = catId
+        return ann
+
     nm = cocoGt.loadCats(catId)[0]
     logging.info('--------------analyzing {}-{}---------------'.format(
         k + 1, nm['name']))
     ps_ = {}
-    dt = copy.deepcopy(cocoDt)
-    nm = cocoGt.loadCats(catId)[0]
     imgIds = cocoGt.getImgIds()
-    dt_anns = dt.dataset['annotations']
-    select_dt_anns = []
-    for ann in dt_anns:
-        if ann['category_id'] == catId:
-            select_dt_anns.append(ann)
-    dt.dataset['annotations'] = select_dt_anns
-    dt.createIndex()
+    dt = _build_coco(cocoDt, [
+        dict(ann) for ann in cocoDt.dataset['annotations']
+        if ann['category_id'] == catId
+    ])
     # compute precision but ignore superclass confusion
-    gt = copy.deepcopy(cocoGt)
-    child_catIds = gt.getCatIds(supNms=[nm['supercategory']])
-    for idx, ann in enumerate(gt.dataset['annotations']):
-        if (ann['category_id'] in child_catIds and
-                ann['category_id'] != catId):
-            gt.dataset['annotations'][idx]['ignore'] = 1
-            gt.dataset['annotations'][idx]['iscrowd'] = 1
-            gt.dataset['annotations'][idx]['category_id'] = catId
-    cocoEval = COCOeval(gt, copy.deepcopy(dt), iou_type)
-    cocoEval.params.imgIds = imgIds
-    cocoEval.params.maxDets = [100]
-    cocoEval.params.iouThrs = [.1]
-    cocoEval.params.useCats = 1
-    cocoEval.evaluate()
-    cocoEval.accumulate()
-    ps_supercategory = cocoEval.eval['precision'][0, :, k, :, :]
-    ps_['ps_supercategory'] = ps_supercategory
+    child_catIds = cocoGt.getCatIds(supNms=[nm['supercategory']])
+    gt_anns = list()
+    for ann in cocoGt.dataset['annotations']:
+        if ann['category_id'] == catId:
+            gt_anns.append(dict(ann))
+        elif ann['category_id'] in child_catIds:
+            gt_anns.append(_ignored(ann))
+    ps_['ps_supercategory'] = _precision(gt_anns)
     # compute precision but ignore any class confusion
-    gt = copy.deepcopy(cocoGt)
-    for idx, ann in enumerate(gt.dataset['annotations']):
-        if ann['category_id'] != catId:
-            gt.dataset['annotations'][idx]['ignore'] = 1
-            gt.dataset['annotations'][idx]['iscrowd'] = 1
-            gt.dataset['annotations'][idx]['category_id'] = catId
-    cocoEval = COCOeval(gt, copy.deepcopy(dt), iou_type)
-    cocoEval.params.imgIds = imgIds
-    cocoEval.params.maxDets = [100]
-    cocoEval.params.iouThrs = [.1]
-    cocoEval.params.useCats = 1
-    cocoEval.evaluate()
-    cocoEval.accumulate()
-    ps_allcategory = cocoEval.eval['precision'][0, :, k, :, :]
-    ps_['ps_allcategory'] = ps_allcategory
+    gt_anns = [
+        dict(ann) if ann['category_id'] == catId else _ignored(ann)
+        for ann in cocoGt.dataset['annotations']
+    ]
+    ps_['ps_allcategory'] = _precision(gt_anns)
     return k, ps_
 
 
+_worker_analysis_coco = None
+
+
+def _init_analysis_worker(gt_dataset, dt_dataset):
+    global _worker_analysis_coco
+    from pycocotools.coco import COCO
+
+    np.linspace = fixed_linspace
+    with contextlib.redirect_stdout(io.StringIO()):
+        coco_gt = COCO()
+        coco_gt.dataset = gt_dataset
+        coco_gt.createIndex()
+        coco_dt = COCO()
+        coco_dt.dataset = dt_dataset
+        coco_dt.createIndex()
+    _worker_analysis_coco = (coco_dt, coco_gt)
+
+
+def _analyze_individual_category_worker(k, catId, iou_type):
+    coco_dt, coco_gt = _worker_analysis_coco
+    return analyze_individual_category(k, coco_dt, coco_gt, catId, iou_type)
+
+
 def coco_error_analysis(eval_details_file=None,
                         gt=None,
                         pred_bbox=None,
@@ -953,17 +1502,18 @@ def coco_error_analysis(eval_details_file=None,
            eval_details_file的优先级更高，只要eval_details_file不为None，
            就会从eval_details_file提取真值信息和预测结果做分析。
            当eval_details_file为None时，则用gt、pred_mask、pred_mask做分析。
+           使用eval_details_file时，分析得到的准确率会缓存在eval_details_file + '.cache.npz'中，
+           再次分析同一文件时直接读取缓存绘图。
 
     """
 
-    import multiprocessing as mp
     # matplotlib.use() must be called *before* pylab, matplotlib.pyplot,
     # or matplotlib.backends is imported for the first time
     # pycocotools import matplotlib
     import matplotlib
     matplotlib.use('Agg')
     from pycocotools.coco import COCO
-    from pycocotools.cocoeval import COCOeval
+    from pycocotools.cocoeval import Params
 
     if eval_details_file is not None:
         import json
@@ -982,42 +1532,36 @@ def coco_error_analysis(eval_details_file=None,
     if pred_mask is not None and len(pred_mask) == 0:
         raise Exception("There is no predicted mask.")
 
-    def _analyze_results(cocoGt, cocoDt, res_type, out_dir):
-        directory = os.path.dirname(out_dir + '/')
-        if not os.path.exists(directory):
-            logging.info('-------------create {}-----------------'.format(
-                out_dir))
-            os.makedirs(directory)
-
-        imgIds = cocoGt.getImgIds()
-        res_out_dir = out_dir + '/' + res_type + '/'
-        res_directory = os.path.dirname(res_out_dir)
-        if not os.path.exists(res_directory):
-            logging.info('-------------create {}-----------------'.format(
-                res_out_dir))
-            os.makedirs(res_directory)
-        iou_type = res_type
-        cocoEval = COCOeval(
-            copy.deepcopy(cocoGt), copy.deepcopy(cocoDt), iou_type)
-        cocoEval.params.imgIds = imgIds
-        cocoEval.params.iouThrs = [.75, .5, .1]
-        cocoEval.params.maxDets = [100]
-        cocoEval.evaluate()
-        cocoEval.accumulate()
+    def _compute_precisions(cocoGt, preds, iou_type):
+        catIds = cocoGt.getCatIds()
+        evaluator = COCOEvaluator(
+            cocoGt, iou_type, iou_thrs=[.75, .5, .1], max_dets=[100])
+        evaluator.update(preds)
+        cocoEval = evaluator.accumulate()
         ps = cocoEval.eval['precision']
         ps = np.vstack([ps, np.zeros((4, *ps.shape[1:]))])
-        catIds = cocoGt.getCatIds()
-        recThrs = cocoEval.params.recThrs
-        thread_num = mp.cpu_count() if mp.cpu_count() < 8 else 8
-        thread_pool = mp.pool.ThreadPool(thread_num)
-        args = [(k, cocoDt, cocoGt, catId, iou_type)
-                for k, catId in enumerate(catIds)]
-        analyze_results = thread_pool.starmap(analyze_individual_category,
-                                              args)
+
+        cocoDt = loadRes(cocoGt, preds)
+        process_num = min(get_default_num_workers(), len(catIds))
+        if process_num > 1:
+            pool = mp.Pool(
+                process_num,
+                initializer=_init_analysis_worker,
+                initargs=(cocoGt.dataset, cocoDt.dataset))
+            try:
+                analyze_results = pool.starmap(
+                    _analyze_individual_category_worker,
+                    [(k, catId, iou_type) for k, catId in enumerate(catIds)])
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            analyze_results = [
+                analyze_individual_category(k, cocoDt, cocoGt, catId,
+                                            iou_type)
+                for k, catId in enumerate(catIds)
+            ]
         for k, catId in enumerate(catIds):
-            nm = cocoGt.loadCats(catId)[0]
-            logging.info('--------------saving {}-{}---------------'.format(
-                k + 1, nm['name']))
             analyze_result = analyze_results[k]
             assert k == analyze_result[0], ""
             ps_supercategory = analyze_result[1]['ps_supercategory']
@@ -1035,6 +1579,36 @@ def coco_error_analysis(eval_details_file=None,
                         ps[t, :, k, a, :][ps[t, :, k, a, :] == -1] = 0
             ps[5, :, k, :, :] = (ps[4, :, k, :, :] > 0)
             ps[6, :, k, :, :] = 1.0
+        return ps
+
+    def _analyze_results(cocoGt, preds, res_type, out_dir):
+        directory = os.path.dirname(out_dir + '/')
+        if not os.path.exists(directory):
+            logging.info('-------------create {}-----------------'.format(
+                out_dir))
+            os.makedirs(directory)
+
+        res_out_dir = out_dir + '/' + res_type + '/'
+        res_directory = os.path.dirname(res_out_dir)
+        if not os.path.exists(res_directory):
+            logging.info('-------------create {}-----------------'.format(
+                res_out_dir))
+            os.makedirs(res_directory)
+        iou_type = res_type
+        cache_name = '{}_error_analysis'.format(res_type)
+        ps = load_eval_details_cache(eval_details_file, cache_name)
+        recThrs = Params(iou_type).recThrs
+        if ps is None:
+            ps = _compute_precisions(cocoGt, preds, iou_type)
+            save_eval_details_cache(eval_details_file, cache_name, ps)
+        else:
+            logging.info("Load the analysis results of {} from cache.".
+                         format(res_type))
+        catIds = cocoGt.getCatIds()
+        for k, catId in enumerate(catIds):
+            nm = cocoGt.loadCats(catId)[0]
+            logging.info('--------------saving {}-{}---------------'.format(
+                k + 1, nm['name']))
             makeplot(recThrs, ps[:, :, k], res_out_dir, nm['name'], iou_type)
         makeplot(recThrs, ps, res_out_dir, 'allclass', iou_type)
 
@@ -1042,17 +1616,9 @@ def coco_error_analysis(eval_details_file=None,
     coco_gt = COCO()
     coco_gt.dataset = gt
     coco_gt.createIndex()
-    # matplotlib.use() must be called *before* pylab, matplotlib.pyplot,
-    # or matplotlib.backends is imported for the first time
-    # pycocotools import matplotlib
-    import matplotlib
-    matplotlib.use('Agg')
-    from pycocotools.cocoeval import COCOeval
     if pred_bbox is not None:
-        coco_dt = loadRes(coco_gt, pred_bbox)
-        _analyze_results(coco_gt, coco_dt, res_type='bbox', out_dir=save_dir)
+        _analyze_results(coco_gt, pred_bbox, res_type='bbox', out_dir=save_dir)
     if pred_mask is not None:
-        coco_dt = loadRes(coco_gt, pred_mask)
-        _analyze_results(coco_gt, coco_dt, res_type='segm', out_dir=save_dir)
+        _analyze_results(coco_gt, pred_mask, res_type='segm', out_dir=save_dir)
     np.linspace = backup_linspace
     logging.info("The analysis figures are saved in {}".format(save_dir))
@@ -0,0 +1,61 @@
+# copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+
+class EvalPipeline(object):
+    """评估流水线：在线程池中对已完成推理的batch做后处理（如还原预测尺寸、更新混淆矩阵、
+       转换为COCO格式结果），与下一个batch的推理重叠执行。
+
+    Args:
+        num_workers (int): 后处理线程数。为0时在当前线程中同步执行。默认为2。
+        max_pending (int): 允许同时等待后处理的batch数上限，超过时阻塞至最早提交的batch完成，
+            以限制缓存的推理结果占用的内存。默认为None，即num_workers的2倍。
+    """
+
+    def __init__(self, num_workers=2, max_pending=None):
+        self.num_workers = num_workers
+        if max_pending is None:
+            max_pending = 2 * max(num_workers, 1)
+        self.max_pending = max_pending
+        self.pool = ThreadPool(num_workers) if num_workers > 0 else None
+        self.pending = deque()
+        self.results = list()
+
+    def submit(self, func, *args):
+        """提交一个batch的后处理任务，结果按提交顺序保存。
+        """
+        if self.pool is None:
+            self.results.append(func(*args))
+            return
+        self.pending.append(self.pool.apply_async(func, args))
+        while len(self.pending) > self.max_pending:
+            self.results.append(self.pending.popleft().get())
+
+    def join(self):
+        """等待所有后处理任务完成并关闭线程池。
+
+        Returns:
+            list: 按提交顺序排列的各batch后处理结果。
+        """
+        if self.pool is not None:
+            try:
+                while len(self.pending) > 0:
+                    self.results.append(self.pending.popleft().get())
+            finally:
+                self.pool.terminate()
+                self.pool = None
+        return self.results
@@ -15,163 +15,143 @@
 import os
 import sys
 import numpy as np
-from scipy.sparse import csr_matrix
 
 
 class ConfusionMatrix(object):
     """
         Confusion Matrix for segmentation evaluation
+
+        The matrix is accumulated with `np.bincount` over all valid pixels of
+        a batch, row=label and col=pred. Row sums, column sums and the
+        diagonal are kept alongside the matrix so that the metrics only cost
+        O(num_classes) to read.
     """
 
     def __init__(self, num_classes=2, streaming=False):
-        self.confusion_matrix = np.zeros(
-            [num_classes, num_classes], dtype='int64')
         self.num_classes = num_classes
         self.streaming = streaming
+        self.zero_matrix()
 
     def calculate(self, pred, label, ignore=None):
+        """ Accumulate a batch, pred in NHWC and label/ignore in NCHW """
         # If not in streaming mode, clear matrix everytime when call `calculate`
         if not self.streaming:
             self.zero_matrix()
 
-        label = np.transpose(label, (0, 2, 3, 1))
-        ignore = np.transpose(ignore, (0, 2, 3, 1))
-        mask = np.array(ignore) == 1
-
-        label = np.asarray(label)[mask]
-        pred = np.asarray(pred)[mask]
-        one = np.ones_like(pred)
-        # Accumuate ([row=label, col=pred], 1) into sparse matrix
-        spm = csr_matrix(
-            (one, (label, pred)), shape=(self.num_classes, self.num_classes))
-        spm = spm.todense()
-        self.confusion_matrix += spm
+        label = np.transpose(np.asarray(label), (0, 2, 3, 1))
+        pred = np.asarray(pred)
+        if ignore is not None:
+            ignore = np.transpose(np.asarray(ignore), (0, 2, 3, 1))
+            mask = ignore == 1
+            label = label[mask]
+            pred = pred[mask]
+        self._accumulate(pred, label)
+
+    def update(self, pred, label, ignore_index=None):
+        """ Accumulate predictions and labels of the same shape.
+
+        Args:
+            pred (np.ndarray|list): The prediction, or a list of the
+                predictions of several images.
+            label (np.ndarray|list): The label, matching pred one to one.
+            ignore_index (int): The label value to ignore. Default: None.
+        """
+        if not self.streaming:
+            self.zero_matrix()
+        if isinstance(pred, (list, tuple)):
+            pred = np.concatenate([np.asarray(p).ravel() for p in pred])
+            label = np.concatenate([np.asarray(l).ravel() for l in label])
+        else:
+            pred = np.asarray(pred).ravel()
+            label = np.asarray(label).ravel()
+        if ignore_index is not None:
+            mask = label != ignore_index
+            label = label[mask]
+            pred = pred[mask]
+        self._accumulate(pred, label)
+
+    def _accumulate(self, pred, label):
+        num_classes = self.num_classes
+        label = np.asarray(label, dtype='int64').ravel()
+        pred = np.asarray(pred, dtype='int64').ravel()
+        if label.size == 0:
+            return
+        hist = np.bincount(
+            label * num_classes + pred, minlength=num_classes * num_classes)
+        if hist.size > num_classes * num_classes:
+            raise Exception(
+                "Label or prediction out of range [0, {}), please check "
+                "num_classes and ignore_index.".format(num_classes))
+        hist = hist.reshape(num_classes, num_classes)
+        self.confusion_matrix += hist
+        self.label_sum += hist.sum(axis=1)
+        self.pred_sum += hist.sum(axis=0)
+        self.diag += np.diagonal(hist)
+
+    def merge(self, other):
+        """ Add the statistics of another ConfusionMatrix, e.g. the one
+            accumulated by another worker.
+        """
+        if isinstance(other, ConfusionMatrix):
+            matrix = other.confusion_matrix
+        else:
+            matrix = np.asarray(other, dtype='int64')
+        if matrix.shape != self.confusion_matrix.shape:
+            raise Exception(
+                "Cannot merge confusion matrix of shape {} into {}.".format(
+                    matrix.shape, self.confusion_matrix.shape))
+        self.confusion_matrix += matrix
+        self.label_sum += matrix.sum(axis=1)
+        self.pred_sum += matrix.sum(axis=0)
+        self.diag += np.diagonal(matrix)
+        return self
 
     def zero_matrix(self):
         """ Clear confusion matrix """
         self.confusion_matrix = np.zeros(
             [self.num_classes, self.num_classes], dtype='int64')
+        self.label_sum = np.zeros(self.num_classes, dtype='int64')
+        self.pred_sum = np.zeros(self.num_classes, dtype='int64')
+        self.diag = np.zeros(self.num_classes, dtype='int64')
+
+    @staticmethod
+    def _safe_div(numerator, denominator):
+        numerator = numerator.astype('float64')
+        result = np.zeros_like(numerator)
+        valid = denominator != 0
+        result[valid] = numerator[valid] / denominator[valid]
+        return result
 
     def mean_iou(self):
-        iou_list = []
-        avg_iou = 0
-        # TODO: use numpy sum axis api to simpliy
-        vji = np.zeros(self.num_classes, dtype=int)
-        vij = np.zeros(self.num_classes, dtype=int)
-        for j in range(self.num_classes):
-            v_j = 0
-            for i in range(self.num_classes):
-                v_j += self.confusion_matrix[j][i]
-            vji[j] = v_j
-
-        for i in range(self.num_classes):
-            v_i = 0
-            for j in range(self.num_classes):
-                v_i += self.confusion_matrix[j][i]
-            vij[i] = v_i
-
-        for c in range(self.num_classes):
-            total = vji[c] + vij[c] - self.confusion_matrix[c][c]
-            if total == 0:
-                iou = 0
-            else:
-                iou = float(self.confusion_matrix[c][c]) / total
-            avg_iou += iou
-            iou_list.append(iou)
-        avg_iou = float(avg_iou) / float(self.num_classes)
-        return np.array(iou_list), avg_iou
+        union = self.label_sum + self.pred_sum - self.diag
+        iou = self._safe_div(self.diag, union)
+        avg_iou = float(iou.sum()) / float(self.num_classes)
+        return iou, avg_iou
 
     def accuracy(self):
-        total = self.confusion_matrix.sum()
-        total_right = 0
-        for c in range(self.num_classes):
-            total_right += self.confusion_matrix[c][c]
+        total = self.label_sum.sum()
         if total == 0:
             avg_acc = 0
         else:
-            avg_acc = float(total_right) / total
-
-        vij = np.zeros(self.num_classes, dtype=int)
-        for i in range(self.num_classes):
-            v_i = 0
-            for j in range(self.num_classes):
-                v_i += self.confusion_matrix[j][i]
-            vij[i] = v_i
-
-        acc_list = []
-        for c in range(self.num_classes):
-            if vij[c] == 0:
-                acc = 0
-            else:
-                acc = self.confusion_matrix[c][c] / float(vij[c])
-            acc_list.append(acc)
-        return np.array(acc_list), avg_acc
+            avg_acc = float(self.diag.sum()) / total
+        acc = self._safe_div(self.diag, self.pred_sum)
+        return acc, avg_acc
 
     def kappa(self):
-        vji = np.zeros(self.num_classes)
-        vij = np.zeros(self.num_classes)
-        for j in range(self.num_classes):
-            v_j = 0
-            for i in range(self.num_classes):
-                v_j += self.confusion_matrix[j][i]
-            vji[j] = v_j
-
-        for i in range(self.num_classes):
-            v_i = 0
-            for j in range(self.num_classes):
-                v_i += self.confusion_matrix[j][i]
-            vij[i] = v_i
-
-        total = self.confusion_matrix.sum()
-
-        # avoid spillovers
-        # TODO: is it reasonable to hard code 10000.0?
-        total = float(total) / 10000.0
-        vji = vji / 10000.0
-        vij = vij / 10000.0
-
-        tp = 0
-        tc = 0
-        for c in range(self.num_classes):
-            tp += vji[c] * vij[c]
-            tc += self.confusion_matrix[c][c]
-
-        tc = tc / 10000.0
-        pe = tp / (total * total)
-        po = tc / total
-
+        total = np.float64(self.label_sum.sum())
+        pe = np.dot(
+            self.label_sum.astype('float64'),
+            self.pred_sum.astype('float64')) / (total * total)
+        po = self.diag.sum() / total
         kappa = (po - pe) / (1 - pe)
         return kappa
 
     def f1_score(self):
-        f1score_list = []
-        # TODO: use numpy sum axis api to simpliy
-        vji = np.zeros(self.num_classes, dtype=int)
-        vij = np.zeros(self.num_classes, dtype=int)
-        for j in range(self.num_classes):
-            v_j = 0
-            for i in range(self.num_classes):
-                v_j += self.confusion_matrix[j][i]
-            vji[j] = v_j
-
-        for i in range(self.num_classes):
-            v_i = 0
-            for j in range(self.num_classes):
-                v_i += self.confusion_matrix[j][i]
-            vij[i] = v_i
-
-        for c in range(self.num_classes):
-            if vji[c] == 0:
-                precision = 0
-            else:
-                precision = self.confusion_matrix[c][c] / vji[c]
-            if vij[c] == 0:
-                recall = 0
-            else:
-                recall = self.confusion_matrix[c][c] / vij[c]
-            if recall + precision <= 1e-06:
-                f1score = 0
-            else:
-                f1score = 2 * precision * recall / (recall + precision)
-            f1score_list.append(f1score)
-        return np.array(f1score_list)
+        precision = self._safe_div(self.diag, self.label_sum)
+        recall = self._safe_div(self.diag, self.pred_sum)
+        denominator = precision + recall
+        f1score = np.zeros_like(precision)
+        valid = denominator > 1e-06
+        f1score[valid] = 2 * precision[valid] * recall[valid] / denominator[
+            valid]
+        return f1score
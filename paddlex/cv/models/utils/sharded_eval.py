@@ -0,0 +1,128 @@
+# copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import math
+import copy
+import queue
+import shutil
+import tempfile
+import traceback
+import multiprocessing as mp
+import paddlex
+import paddlex.utils.logging as logging
+from paddlex.utils.utils import check_spawn_main_guard, SPAWN_MAIN_GUARD_HINT
+
+# 评估进程仅使用CPU，每个进程使用单个CPU设备
+_WORKER_ENVIRON = {'CUDA_VISIBLE_DEVICES': '', 'CPU_NUM': '1'}
+
+
+def shard_dataset(dataset, num_shards):
+    """ 将数据集按顺序切分为互不相交的连续分片，分片数不超过样本数
+
+        Args:
+            dataset (paddlex.datasets): 待切分的数据集。
+            num_shards (int): 分片数。
+    """
+    file_list = list(dataset.file_list)[:dataset.num_samples]
+    shard_size = int(math.ceil(len(file_list) * 1.0 / num_shards))
+    shards = list()
+    for start in range(0, len(file_list), shard_size):
+        shard = copy.copy(dataset)
+        shard.file_list = file_list[start:start + shard_size]
+        shard.num_samples = len(shard.file_list)
+        shard.shuffle = False
+        # 每个分片已在独立进程中评估，数据读取使用线程即可
+        shard.parallel_method = 'thread'
+        shards.append(shard)
+    return shards
+
+
+def _shard_worker(shard_id, model_dir, method, dataset, args, result_queue):
+    try:
+        model = paddlex.load_model(model_dir)
+        result = getattr(model, method)(dataset, *args)
+        result_queue.put((shard_id, True, result))
+    except Exception:
+        result_queue.put((shard_id, False, traceback.format_exc()))
+
+
+def evaluate_shards(model, dataset, num_workers, method, *args):
+    """ 将数据集切分后在多个本地CPU进程中并行评估，各进程加载当前模型的副本，
+        对各自的分片调用model.<method>(shard, *args)，结果按分片顺序返回
+
+        Args:
+            model (paddlex.cv.models.BaseAPI): 待评估的模型。
+            dataset (paddlex.datasets): 验证数据集。
+            num_workers (int): 评估进程数。
+            method (str): 评估单个分片的模型方法名，返回值需可序列化。
+    """
+    check_spawn_main_guard("Evaluation with num_workers > 1")
+    shards = shard_dataset(dataset, num_workers)
+    model_dir = tempfile.mkdtemp(prefix='paddlex_eval_')
+    ctx = mp.get_context('spawn')
+    result_queue = ctx.Queue()
+    processes = list()
+    results = [None] * len(shards)
+    try:
+        model.save_model(model_dir)
+        # 子进程启动时继承当前的环境变量
+        environ_backup = {k: os.environ.get(k) for k in _WORKER_ENVIRON}
+        os.environ.update(_WORKER_ENVIRON)
+        try:
+            for shard_id, shard in enumerate(shards):
+                p = ctx.Process(
+                    target=_shard_worker,
+                    args=(shard_id, model_dir, method, shard, args,
+                          result_queue))
+                p.start()
+                processes.append(p)
+        finally:
+            for k, v in environ_backup.items():
+                if v is None:
+                    del os.environ[k]
+                else:
+                    os.environ[k] = v
+        logging.info("Evaluating {} samples in {} processes...".format(
+            dataset.num_samples, len(shards)))
+        num_finished = 0
+        exited = list()
+        while num_finished < len(shards):
+            try:
+                shard_id, success, result = result_queue.get(timeout=5)
+            except queue.Empty:
+                # 进程退出前写入的结果可能尚未读出，连续两次检查到退出才报错
+                last_exited = exited
+                exited = [
+                    i for i, p in enumerate(processes)
+                    if results[i] is None and not p.is_alive()
+                ]
+                if len(exited) > 0 and exited == last_exited:
+                    raise Exception(
+                        "Evaluation process of shard {} exited with code {}. {}".
+                        format(exited[0], processes[exited[0]].exitcode,
+                               SPAWN_MAIN_GUARD_HINT))
+                continue
+            if not success:
+                raise Exception("Evaluation of shard {} failed:\n{}".format(
+                    shard_id, result))
+            results[shard_id] = result
+            num_finished += 1
+    finally:
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+        shutil.rmtree(model_dir, ignore_errors=True)
+    return results
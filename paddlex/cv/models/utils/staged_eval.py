@@ -0,0 +1,167 @@
+# copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import copy
+import contextlib
+from collections import OrderedDict
+import numpy as np
+import paddlex.utils.logging as logging
+
+# 双侧95%置信区间的t分布分位数，键为自由度
+_T_975 = {
+    1: 12.706,
+    2: 4.303,
+    3: 3.182,
+    4: 2.776,
+    5: 2.571,
+    6: 2.447,
+    7: 2.365,
+    8: 2.306,
+    9: 2.262
+}
+
+
+def _stratum(sample, model_type):
+    # 分类按类别分层，检测按图像中数量最多的类别分层，分割不分层
+    if model_type == 'classifier':
+        return int(sample[1])
+    if model_type == 'detector':
+        gt_class = np.asarray(sample[1][1]['gt_class']).flatten()
+        if gt_class.size == 0:
+            return -1
+        return int(np.bincount(gt_class).argmax())
+    return 0
+
+
+def _subset_coco(coco_gt, img_ids):
+    from pycocotools.coco import COCO
+
+    # add_negative_samples添加的负样本不在coco_gt中，跳过
+    img_ids = [i for i in img_ids if i in coco_gt.imgs]
+    subset = COCO()
+    subset.dataset = dict(coco_gt.dataset)
+    subset.dataset['images'] = [coco_gt.imgs[i] for i in img_ids]
+    subset.dataset['annotations'] = [
+        ann for i in img_ids for ann in coco_gt.imgToAnns[i]
+    ]
+    with contextlib.redirect_stdout(io.StringIO()):
+        subset.createIndex()
+    return subset
+
+
+def _subset_dataset(dataset, indices, model_type):
+    subset = copy.copy(dataset)
+    subset.file_list = [dataset.file_list[i] for i in indices]
+    subset.num_samples = len(subset.file_list)
+    if model_type == 'detector' and hasattr(dataset, 'coco_gt'):
+        img_ids = [int(f[1][0]['im_id'][0]) for f in subset.file_list]
+        subset.coco_gt = _subset_coco(dataset.coco_gt, img_ids)
+    return subset
+
+
+def _stratified_indices(dataset, model_type, ratio):
+    strata = OrderedDict()
+    for i, sample in enumerate(dataset.file_list):
+        strata.setdefault(_stratum(sample, model_type), list()).append(i)
+    # 每层均匀选取ratio比例的样本，至少1个
+    indices = list()
+    for stratum in strata.values():
+        num = max(1, int(round(len(stratum) * ratio)))
+        pos = np.linspace(0, len(stratum) - 1, num).round().astype('int64')
+        indices.extend(stratum[p] for p in pos)
+    return indices
+
+
+def stratified_subset(dataset, model_type, ratio):
+    """从数据集中按层均匀选取固定的子集，分类按类别分层，检测按图像中数量最多的类别分层。
+
+    Args:
+        dataset (paddlex.datasets): 数据读取器。
+        model_type (str): 模型类型，用于确定分层的依据。
+        ratio (float): 子集占数据集的比例，取值范围为(0, 1)。
+
+    Returns:
+        paddlex.datasets: 子集的数据读取器。
+    """
+    if not 0 < ratio < 1:
+        raise Exception("ratio should be in range (0, 1).")
+    indices = sorted(_stratified_indices(dataset, model_type, ratio))
+    return _subset_dataset(dataset, indices, model_type)
+
+
+class StagedEval(object):
+    """分阶段评估：训练过程中先在验证集的固定分层子集上评估，子集被均分为num_folds份，
+       由各份上主指标的均值与t分布估计完整验证集上主指标的95%置信区间。若置信区间上界
+       低于历史最优精度，当前模型不可能成为最优模型，跳过完整验证集的评估。
+
+    Args:
+        eval_dataset (paddlex.datasets): 验证数据读取器。
+        model_type (str): 模型类型，用于确定分层的依据。
+        ratio (float): 子集占验证集的比例，取值范围为(0, 1)。
+        num_folds (int): 子集均分的份数，取值范围为[2, 10]。默认为5。
+    """
+
+    def __init__(self, eval_dataset, model_type, ratio, num_folds=5):
+        if not 0 < ratio < 1:
+            raise Exception("staged_eval_ratio should be in range (0, 1).")
+        if num_folds - 1 not in _T_975:
+            raise Exception("num_folds should be in range [2, 10].")
+        indices = _stratified_indices(eval_dataset, model_type, ratio)
+        num_folds = min(num_folds, len(indices))
+        self.num_samples = len(indices)
+        self.total_samples = eval_dataset.num_samples
+        # 轮流分配到各份，使每份同样按层均衡
+        self.folds = [
+            _subset_dataset(eval_dataset, indices[k::num_folds], model_type)
+            for k in range(num_folds)
+        ]
+
+    def __call__(self, model, batch_size, epoch_id, best_accuracy):
+        """在子集上评估。
+
+        Args:
+            model (paddlex.cv.models.BaseAPI): 待评估的模型。
+            batch_size (int): 验证数据batch大小。
+            epoch_id (int): 当前的训练轮数。
+            best_accuracy (float): 历史最优的主指标。
+
+        Returns:
+            OrderedDict | None: 若当前模型不可能超过历史最优，返回各份指标的均值；
+                否则返回None，需在完整验证集上评估。
+        """
+        if len(self.folds) < 2:
+            return None
+        fold_metrics = [
+            model.evaluate(
+                eval_dataset=fold,
+                batch_size=batch_size,
+                epoch_id=epoch_id,
+                return_details=False) for fold in self.folds
+        ]
+        key = list(fold_metrics[0].keys())[0]
+        values = np.array([float(m[key]) for m in fold_metrics])
+        mean = values.mean()
+        upper = mean + _T_975[len(values) - 1] * values.std(
+            ddof=1) / np.sqrt(len(values))
+        logging.info(
+            "[EVAL] Staged evaluation on {}/{} samples, {}={:.6f}, upper bound={:.6f}, best={:.6f}".
+            format(self.num_samples, self.total_samples, key, mean, upper,
+                   best_accuracy))
+        if upper >= best_accuracy:
+            return None
+        metrics = OrderedDict()
+        for k in fold_metrics[0].keys():
+            metrics[k] = np.mean([np.asarray(m[k]) for m in fold_metrics], axis=0)
+        return metrics
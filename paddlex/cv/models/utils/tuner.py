@@ -0,0 +1,358 @@
+# copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os.path as osp
+import copy
+import json
+import time
+import queue
+import shutil
+import platform
+import tempfile
+import threading
+import traceback
+import subprocess
+import multiprocessing as mp
+from collections import OrderedDict
+import psutil
+import paddlex
+import paddlex.utils.logging as logging
+from paddlex.utils.utils import check_spawn_main_guard, SPAWN_MAIN_GUARD_HINT
+
+# 读取数据的耗时超过单步耗时的该比例时，认为训练受限于数据读取
+_READER_BOUND_RATIO = 0.2
+
+
+def _trial_worker(model_class, init_params, dataset, batch_size, num_steps,
+                  train_kwargs, save_dir, result_queue):
+    # 在独立进程中训练2轮，第1轮用于预热，以第2轮的耗时统计作为结果
+    try:
+        model = getattr(paddlex.cv.models, model_class)(**init_params)
+        kwargs = {
+            'pretrain_weights': None,
+            'save_interval_epochs': 2,
+            'use_vdl': False,
+            'keep_checkpoint_max': 1
+        }
+        kwargs.update(train_kwargs)
+        model.train(
+            num_epochs=2,
+            train_dataset=dataset,
+            train_batch_size=batch_size,
+            save_dir=save_dir,
+            **kwargs)
+        with open(osp.join(save_dir, 'train_timing.json')) as f:
+            summary = json.load(f)[-1]
+        if summary['steps'] < num_steps:
+            raise Exception("Only {} of {} steps are trained.".format(
+                summary['steps'], num_steps))
+        result_queue.put(summary)
+    except Exception:
+        result_queue.put(traceback.format_exc())
+
+
+def _gpu_memory_mb(pids):
+    try:
+        out = subprocess.check_output(
+            [
+                'nvidia-smi', '--query-compute-apps=pid,used_memory',
+                '--format=csv,noheader,nounits'
+            ],
+            stderr=subprocess.DEVNULL).decode()
+    except Exception:
+        return None
+    used = 0.
+    for line in out.strip().split('\n'):
+        fields = [f.strip() for f in line.split(',')]
+        if len(fields) == 2 and fields[0].isdigit() and int(
+                fields[0]) in pids:
+            used += float(fields[1])
+    return used
+
+
+def _host_memory_mb(process):
+    # 使用PSS统计进程树的内存，避免重复计算多进程读取数据时的共享内存
+    used = 0.
+    for p in [process] + process.children(recursive=True):
+        try:
+            info = p.memory_full_info()
+            used += getattr(info, 'pss', info.rss)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return used / 1024**2
+
+
+class _MemoryMonitor(object):
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.host_memory_mb = 0.
+        self.gpu_memory_mb = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        try:
+            process = psutil.Process(self.pid)
+        except psutil.NoSuchProcess:
+            return
+        use_gpu = paddlex.env_info['place'] != 'cpu'
+        while not self.stopped.is_set():
+            try:
+                self.host_memory_mb = max(self.host_memory_mb,
+                                          _host_memory_mb(process))
+                if use_gpu:
+                    pids = set([process.pid] + [
+                        p.pid for p in process.children(recursive=True)
+                    ])
+                    gpu = _gpu_memory_mb(pids)
+                    if gpu is not None:
+                        self.gpu_memory_mb = max(self.gpu_memory_mb or 0.,
+                                                 gpu)
+            except psutil.NoSuchProcess:
+                break
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def _trial_dataset(dataset, num_samples, num_workers, buffer_size,
+                   parallel_method):
+    trial_dataset = copy.copy(dataset)
+    # 样本不足时循环使用，保证每轮有足够的步数
+    file_list = list(dataset.file_list)
+    trial_dataset.file_list = [
+        file_list[i % len(file_list)] for i in range(num_samples)
+    ]
+    trial_dataset.num_samples = num_samples
+    trial_dataset.shuffle = False
+    trial_dataset.num_workers = num_workers
+    trial_dataset.buffer_size = buffer_size
+    trial_dataset.parallel_method = parallel_method
+    return trial_dataset
+
+
+def _model_init_params(model):
+    # 新构建模型的init_params为__init__中的locals()，需去除self等无法传递给
+    # 子进程或无法用于重新构建模型的参数，与get_model_info的处理一致
+    return {
+        k: v
+        for k, v in model.init_params.items()
+        if k not in ['self', '__class__', 'model_name']
+    }
+
+
+def _run_trial(model, dataset, config, num_steps, train_kwargs, timeout):
+    save_dir = tempfile.mkdtemp(prefix='paddlex_tune_')
+    trial_dataset = _trial_dataset(
+        dataset, config['batch_size'] * num_steps, config['num_workers'],
+        config['buffer_size'], config['parallel_method'])
+    ctx = mp.get_context('spawn')
+    result_queue = ctx.Queue()
+    p = ctx.Process(
+        target=_trial_worker,
+        args=(model.__class__.__name__, _model_init_params(model),
+              trial_dataset, config['batch_size'], num_steps, train_kwargs,
+              save_dir, result_queue))
+    start_time = time.time()
+    p.start()
+    monitor = _MemoryMonitor(p.pid)
+    result = None
+    try:
+        while result is None and time.time() - start_time < timeout:
+            try:
+                result = result_queue.get(timeout=5)
+            except queue.Empty:
+                if not p.is_alive():
+                    result = "The trial exited with code {}. {}".format(
+                        p.exitcode, SPAWN_MAIN_GUARD_HINT)
+        if result is None:
+            result = "The trial timed out after {}s.".format(timeout)
+    finally:
+        monitor.stop()
+        if p.is_alive():
+            p.terminate()
+        p.join()
+        shutil.rmtree(save_dir, ignore_errors=True)
+
+    trial = OrderedDict(config)
+    trial['host_memory_mb'] = round(monitor.host_memory_mb, 1)
+    trial['gpu_memory_mb'] = monitor.gpu_memory_mb
+    if isinstance(result, dict):
+        trial['status'] = 'ok'
+        for k in ['ips', 'batch_cost', 'reader_cost', 'executor_cost',
+                  'queue_size']:
+            if k in result:
+                trial[k] = result[k]
+    else:
+        trial['status'] = 'failed'
+        trial['error'] = result.strip().split('\n')[-1]
+    return trial
+
+
+def _over_budget(trial, max_host_memory_mb, max_gpu_memory_mb):
+    if max_host_memory_mb is not None and trial[
+            'host_memory_mb'] > max_host_memory_mb:
+        return True
+    if max_gpu_memory_mb is not None and trial[
+            'gpu_memory_mb'] is not None and trial[
+                'gpu_memory_mb'] > max_gpu_memory_mb:
+        return True
+    return False
+
+
+def tune_train_config(model,
+                      train_dataset,
+                      batch_sizes=None,
+                      num_workers=None,
+                      buffer_sizes=None,
+                      parallel_methods=None,
+                      max_host_memory_mb=None,
+                      max_gpu_memory_mb=None,
+                      num_steps=20,
+                      train_kwargs=None,
+                      trial_timeout=1800,
+                      report_file=None):
+    """通过短时的训练试验搜索训练吞吐最高的train_batch_size、num_workers、buffer_size
+       和parallel_method。每次试验在独立进程中使用真实的数据读取和训练网络训练2轮，
+       以第2轮的耗时统计为准，并记录进程（含数据读取子进程）占用的内存和显存峰值。
+       依次搜索batch大小、数据读取方式与进程数、缓存队列大小，每一步固定之前选出的最优值。
+       试验进程以spawn方式启动，会重新导入主程序，主程序的代码需放在if __name__ == '__main__':下。
+
+    Args:
+        model (paddlex.cv.models): 待训练的模型，仅使用其类型和构造参数，模型本身不会被训练。
+        train_dataset (paddlex.datasets): 训练数据读取器。
+        batch_sizes (list): 候选的train_batch_size，按从小到大的顺序试验，
+            失败或超出内存限制后不再试验更大的值。为None时使用[8, 16, 32, 64]中能被卡数整除的值。默认为None。
+        num_workers (list): 候选的数据读取进程/线程数。为None时使用[1, 2, 4, 8, CPU核数的一半]中
+            不超过CPU核数的值。默认为None。
+        buffer_sizes (list): 候选的数据读取缓存队列大小。为None时使用train_dataset的buffer_size
+            和最优batch大小的4倍。默认为None。
+        parallel_methods (list): 候选的数据读取方式。为None时Linux下使用['process', 'thread']，
+            其它系统使用['thread']。默认为None。
+        max_host_memory_mb (float): 内存上限（MB），超出的配置不会被选中。为None时不限制。默认为None。
+        max_gpu_memory_mb (float): 显存上限（MB），通过nvidia-smi统计。为None时不限制。默认为None。
+        num_steps (int): 每次试验每轮训练的步数。默认为20。
+        train_kwargs (dict): 传给model.train的其它参数，如检测模型的warmup_steps、lr_decay_epochs。
+            默认为None。
+        trial_timeout (float): 单次试验的超时时间（s）。默认为1800。
+        report_file (str): 若不为None，将所有试验结果以json格式保存至该路径。默认为None。
+
+    Returns:
+        OrderedDict: 吞吐最高的配置，包括batch_size、num_workers、buffer_size、parallel_method、
+            ips（samples/s）、bound（'reader'表示受限于数据读取，'compute'表示受限于计算）及所有试验结果trials。
+    """
+    check_spawn_main_guard("tune_train_config")
+    if train_kwargs is None:
+        train_kwargs = dict()
+    for k in ['num_epochs', 'train_dataset', 'train_batch_size', 'save_dir']:
+        if k in train_kwargs:
+            raise Exception("{} in train_kwargs is set by the tuner.".format(
+                k))
+    num_cards = max(paddlex.env_info['num'], 1)
+    if batch_sizes is None:
+        batch_sizes = [b for b in [8, 16, 32, 64] if b % num_cards == 0]
+        if len(batch_sizes) == 0:
+            batch_sizes = [num_cards]
+    for b in batch_sizes:
+        if b % num_cards != 0:
+            raise Exception(
+                "batch size {} can not be divided by the number of cards {}.".
+                format(b, num_cards))
+    cpu_count = mp.cpu_count()
+    if num_workers is None:
+        num_workers = sorted(
+            set(n for n in [1, 2, 4, 8, max(cpu_count // 2, 1)]
+                if n <= cpu_count))
+    if parallel_methods is None:
+        parallel_methods = ['process', 'thread']
+    if platform.system() in ['Windows', 'Darwin']:
+        parallel_methods = ['thread']
+
+    trials = list()
+
+    def run(**changes):
+        config = OrderedDict(best_config)
+        config.update(changes)
+        for trial in trials:
+            if all(trial[k] == v for k, v in config.items()):
+                return trial
+        trial = _run_trial(model, train_dataset, config, num_steps,
+                           train_kwargs, trial_timeout)
+        if trial['status'] == 'ok' and _over_budget(
+                trial, max_host_memory_mb, max_gpu_memory_mb):
+            trial['status'] = 'over_budget'
+        trials.append(trial)
+        logging.info("[TUNE] {}".format(", ".join(
+            "{}={}".format(k, v) for k, v in trial.items())))
+        return trial
+
+    def best_trial():
+        ok_trials = [t for t in trials if t['status'] == 'ok']
+        if len(ok_trials) == 0:
+            return None
+        return max(ok_trials, key=lambda t: t['ips'])
+
+    best_config = OrderedDict([
+        ('batch_size', batch_sizes[0]),
+        ('num_workers', train_dataset.num_workers),
+        ('buffer_size', train_dataset.buffer_size),
+        ('parallel_method', train_dataset.parallel_method
+         if train_dataset.parallel_method in parallel_methods else
+         parallel_methods[0]),
+    ])
+    # batch大小
+    for batch_size in sorted(batch_sizes):
+        if run(batch_size=batch_size)['status'] != 'ok':
+            break
+    if best_trial() is None:
+        raise Exception(
+            "All the trials failed or exceeded the memory limit, try smaller batch_sizes."
+        )
+    best_config['batch_size'] = best_trial()['batch_size']
+    # 数据读取方式及进程数
+    for parallel_method in parallel_methods:
+        for n in num_workers:
+            run(num_workers=n, parallel_method=parallel_method)
+    best_config['num_workers'] = best_trial()['num_workers']
+    best_config['parallel_method'] = best_trial()['parallel_method']
+    # 缓存队列大小
+    if buffer_sizes is None:
+        buffer_sizes = sorted(
+            set([train_dataset.buffer_size, 4 * best_config['batch_size']]))
+    for buffer_size in buffer_sizes:
+        run(buffer_size=buffer_size)
+
+    best = best_trial()
+    result = OrderedDict()
+    for k in best_config.keys():
+        result[k] = best[k]
+    result['ips'] = best['ips']
+    reader_ratio = best.get('reader_cost', 0.) / max(best['batch_cost'], 1e-6)
+    result['bound'] = 'reader' \
+        if reader_ratio > _READER_BOUND_RATIO else 'compute'
+    result['trials'] = trials
+    logging.info(
+        "[TUNE] Best config: batch_size={}, num_workers={}, buffer_size={}, parallel_method={}, ips={:.2f} samples/s, {:.0%} of each step is spent waiting for data, the training is {}-bound."
+        .format(result['batch_size'], result['num_workers'], result[
+            'buffer_size'], result['parallel_method'], result['ips'],
+                reader_ratio, result['bound']))
+    if report_file is not None:
+        with open(report_file, 'w') as f:
+            json.dump(result, f, indent=1)
+    return result
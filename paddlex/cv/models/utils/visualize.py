@@ -19,7 +19,8 @@ import colorsys
 import numpy as np
 import time
 import paddlex.utils.logging as logging
-from .detection_eval import fixed_linspace, backup_linspace, loadRes
+from .detection_eval import fixed_linspace, backup_linspace, COCOEvaluator, \
+    load_eval_details_cache, save_eval_details_cache
 from paddlex.cv.datasets.dataset import is_pic
 
 
@@ -335,6 +336,9 @@ def draw_pr_curve(eval_details_file=None,
                   pred_mask=None,
                   iou_thresh=0.5,
                   save_dir='./'):
+    """绘制每个类别的准确率-召回率曲线和置信度-召回率曲线。使用eval_details_file时，
+       计算得到的曲线会缓存在eval_details_file + '.cache.npz'中，再次绘制时直接读取。
+    """
     if eval_details_file is not None:
         import json
         with open(eval_details_file, 'r') as f:
@@ -355,48 +359,28 @@ def draw_pr_curve(eval_details_file=None,
     matplotlib.use('Agg')
     import matplotlib.pyplot as plt
     from pycocotools.coco import COCO
-    from pycocotools.cocoeval import COCOeval
     coco = COCO()
     coco.dataset = gt
     coco.createIndex()
 
-    def _summarize(coco_gt, ap=1, iouThr=None, areaRng='all', maxDets=100):
-        p = coco_gt.params
-        aind = [i for i, aRng in enumerate(p.areaRngLbl) if aRng == areaRng]
-        mind = [i for i, mDet in enumerate(p.maxDets) if mDet == maxDets]
-        if ap == 1:
-            # dimension of precision: [TxRxKxAxM]
-            s = coco_gt.eval['precision']
-            # IoU
-            if iouThr is not None:
-                t = np.where(iouThr == p.iouThrs)[0]
-                s = s[t]
-            s = s[:, :, :, aind, mind]
-        else:
-            # dimension of recall: [TxKxAxM]
-            s = coco_gt.eval['recall']
-            if iouThr is not None:
-                t = np.where(iouThr == p.iouThrs)[0]
-                s = s[t]
-            s = s[:, :, aind, mind]
-        if len(s[s > -1]) == 0:
-            mean_s = -1
-        else:
-            mean_s = np.mean(s[s > -1])
-        return mean_s
-
     def cal_pr(coco_gt, coco_dt, iou_thresh, save_dir, style='bbox'):
-        coco_dt = loadRes(coco_gt, coco_dt)
-        np.linspace = fixed_linspace
-        coco_eval = COCOeval(coco_gt, coco_dt, style)
-        coco_eval.params.iouThrs = np.linspace(
-            iou_thresh, iou_thresh, 1, endpoint=True)
-        np.linspace = backup_linspace
-        coco_eval.evaluate()
-        coco_eval.accumulate()
-        stats = _summarize(coco_eval, iouThr=iou_thresh)
+        # dimension of precision and scores: [TxRxKxAxM]
+        cache_name = '{}_pr_curve_iou{}'.format(style, iou_thresh)
+        pr_eval = load_eval_details_cache(eval_details_file, cache_name)
+        if pr_eval is None:
+            np.linspace = fixed_linspace
+            evaluator = COCOEvaluator(
+                coco_gt, style, iou_thrs=[iou_thresh])
+            evaluator.update(coco_dt)
+            coco_eval = evaluator.accumulate()
+            np.linspace = backup_linspace
+            pr_eval = np.stack([
+                coco_eval.eval['precision'], coco_eval.eval['scores']
+            ])
+            save_eval_details_cache(eval_details_file, cache_name, pr_eval)
+        precisions, scores = pr_eval[0], pr_eval[1]
         catIds = coco_gt.getCatIds()
-        if len(catIds) != coco_eval.eval['precision'].shape[2]:
+        if len(catIds) != precisions.shape[2]:
             raise Exception(
                 "The category number must be same as the third dimension of precisions."
             )
@@ -416,7 +400,7 @@ def draw_pr_curve(eval_details_file=None,
         plt.xticks(my_x_ticks, fontsize=5)
         plt.yticks(my_y_ticks, fontsize=5)
         for idx, catId in enumerate(catIds):
-            pr_array = coco_eval.eval['precision'][0, :, idx, 0, 2]
+            pr_array = precisions[0, :, idx, 0, 2]
             precision = pr_array[pr_array > -1]
             ap = np.mean(precision) if precision.size else float('nan')
             nm = coco_gt.loadCats(catId)[0]['name'] + ' AP={:0.2f}'.format(
@@ -438,7 +422,7 @@ def draw_pr_curve(eval_details_file=None,
         plt.yticks(my_y_ticks, fontsize=5)
         for idx, catId in enumerate(catIds):
             nm = coco_gt.loadCats(catId)[0]['name']
-            sr_array = coco_eval.eval['scores'][0, :, idx, 0, 2]
+            sr_array = scores[0, :, idx, 0, 2]
             color = tuple(color_map[idx])
             color = [float(c) / 255 for c in color]
             color.append(0.75)
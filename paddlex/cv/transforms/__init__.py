@@ -12,12 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
+from paddlex.utils.lazy_import import lazy_getattr, import_all
 from . import cls_transforms
 from . import det_transforms
 from . import seg_transforms
 
-from . import visualize
-visualize = visualize.visualize
+# visualize依赖模型及数据集模块，在首次访问时才导入
+_LAZY_ATTRS = {'visualize': ('.visualize', 'visualize')}
+
+__getattr__ = lazy_getattr(__name__, _LAZY_ATTRS)
+
+if sys.version_info < (3, 7):
+    import_all(__name__, _LAZY_ATTRS)
 
 
 def build_transforms(model_type, transforms_info, to_rgb=True):
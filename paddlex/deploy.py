@@ -13,18 +13,69 @@
 # limitations under the License.
 import os
 import os.path as osp
+import time
+import pickle
+import shutil
+import hashlib
 import cv2
 import numpy as np
 import yaml
+import importlib
 import multiprocessing as mp
+from collections import OrderedDict
 import paddlex
+import paddle
 import paddle.fluid as fluid
 from paddlex.cv.transforms import build_transforms
-from paddlex.cv.models import BaseClassifier
-from paddlex.cv.models import PPYOLO, FasterRCNN, MaskRCNN
-from paddlex.cv.models import DeepLabv3p
 import paddlex.utils.logging as logging
 
+# 预热时默认使用的原始图像大小[h, w]，覆盖常见的横屏、竖屏及方形分辨率
+WARMUP_IMAGE_SIZES = [[480, 640], [720, 1280], [1080, 1920], [640, 480],
+                      [1280, 720], [1920, 1080], [512, 512], [1024, 1024]]
+
+
+def get_model_processor(model_type, model_name):
+    """ 获取提供模型预处理及后处理方法的模型类。模型模块在创建Predictor时
+        才按需导入，import paddlex.deploy时不加载训练及评估相关的模块
+
+        Args:
+            model_type (str): 模型类型，classifier、detector或segmenter。
+            model_name (str): 模型名称。
+    """
+    if model_type == "classifier":
+        module_name, class_name = 'classifier', 'BaseClassifier'
+    elif model_type == "detector":
+        if model_name in ["PPYOLO", "YOLOv3"]:
+            module_name, class_name = 'ppyolo', 'PPYOLO'
+        elif model_name == "MaskRCNN":
+            module_name, class_name = 'mask_rcnn', 'MaskRCNN'
+        else:
+            module_name, class_name = 'faster_rcnn', 'FasterRCNN'
+    else:
+        module_name, class_name = 'deeplabv3p', 'DeepLabv3p'
+    module = importlib.import_module('paddlex.cv.models.' + module_name)
+    return getattr(module, class_name)
+
+
+def get_program_cache_key(model_dir, config_info):
+    """ 根据模型文件及预测配置生成优化程序缓存的索引
+
+        Args:
+            model_dir (str): 导出的部署模型路径。
+            config_info (list): 影响计算图优化结果的预测配置。
+    """
+    md5 = hashlib.md5()
+    for name in ['__model__', 'model.yml']:
+        with open(osp.join(model_dir, name), 'rb') as f:
+            md5.update(f.read())
+    # 参数文件较大，以其大小和修改时间代替内容
+    params_stat = os.stat(osp.join(model_dir, '__params__'))
+    md5.update("{}{}".format(params_stat.st_size, params_stat.st_mtime)
+               .encode('utf-8'))
+    md5.update(str(config_info).encode('utf-8'))
+    md5.update(paddle.__version__.encode('utf-8'))
+    return md5.hexdigest()
+
 
 class Predictor:
     def __init__(self,
@@ -36,7 +87,8 @@ class Predictor:
                  use_trt=False,
                  use_glog=False,
                  memory_optimize=True,
-                 max_trt_batch_size=1):
+                 max_trt_batch_size=1,
+                 optim_cache_dir=None):
         """ 创建Paddle Predictor
 
             Args:
@@ -49,13 +101,28 @@ class Predictor:
                 use_glog: 是否启用glog日志, 默认False
                 memory_optimize: 是否启动内存优化，默认True
                 max_trt_batch_size: 在使用TensorRT时配置的最大batch size，默认1
+                optim_cache_dir: 优化结果的缓存路径，设置后TensorRT引擎，或经过计算图优化的
+                    模型与解析后的预处理流程将被保存至该路径，再次启动时直接加载，跳过优化过程，
+                    默认None表示不保存
         """
         if not osp.isdir(model_dir):
             raise Exception("[ERROR] Path {} not exist.".format(model_dir))
         if not osp.exists(osp.join(model_dir, "model.yml")):
             raise Exception("There's not model.yml in {}".format(model_dir))
-        with open(osp.join(model_dir, "model.yml")) as f:
-            self.info = yaml.load(f.read(), Loader=yaml.Loader)
+        self.model_dir = model_dir
+        # 使用TensorRT时计算图优化在构建引擎时完成，仅缓存TensorRT引擎
+        self.program_cache_dir = None
+        if optim_cache_dir is not None and not use_trt:
+            cache_key = get_program_cache_key(
+                model_dir, [use_gpu, use_mkl, memory_optimize])
+            self.program_cache_dir = osp.join(optim_cache_dir, cache_key)
+        if self.program_cache_hit():
+            with open(osp.join(self.program_cache_dir, 'info.pkl'),
+                      'rb') as f:
+                self.info, self.transforms = pickle.load(f)
+        else:
+            with open(osp.join(model_dir, "model.yml")) as f:
+                self.info = yaml.load(f.read(), Loader=yaml.Loader)
 
         self.status = self.info['status']
 
@@ -63,26 +130,30 @@ class Predictor:
             raise Exception("[ERROR] Only quantized model or exported "
                             "inference model is supported.")
 
-        self.model_dir = model_dir
         self.model_type = self.info['_Attributes']['model_type']
         self.model_name = self.info['Model']
         self.num_classes = self.info['_Attributes']['num_classes']
         self.labels = self.info['_Attributes']['labels']
+        self.processor = get_model_processor(self.model_type, self.model_name)
         if self.info['Model'] == 'MaskRCNN':
             if self.info['_init_params']['with_fpn']:
                 self.mask_head_resolution = 28
             else:
                 self.mask_head_resolution = 14
-        transforms_mode = self.info.get('TransformsMode', 'RGB')
-        if transforms_mode == 'RGB':
-            to_rgb = True
-        else:
-            to_rgb = False
-        self.transforms = build_transforms(self.model_type,
-                                           self.info['Transforms'], to_rgb)
+        if not self.program_cache_hit():
+            transforms_mode = self.info.get('TransformsMode', 'RGB')
+            if transforms_mode == 'RGB':
+                to_rgb = True
+            else:
+                to_rgb = False
+            self.transforms = build_transforms(
+                self.model_type, self.info['Transforms'], to_rgb)
         self.predictor = self.create_predictor(
             use_gpu, gpu_id, use_mkl, mkl_thread_num, use_trt, use_glog,
-            memory_optimize, max_trt_batch_size)
+            memory_optimize, max_trt_batch_size, optim_cache_dir)
+        if self.program_cache_dir is not None and not self.program_cache_hit(
+        ):
+            self.save_program_cache()
         # 线程池，在模型在预测时用于对输入数据以图片为单位进行并行处理
         # 主要用于batch_predict接口
         thread_num = mp.cpu_count() if mp.cpu_count() < 8 else 8
@@ -96,6 +167,37 @@ class Predictor:
         self.thread_pool.join()
         self.thread_pool = mp.pool.ThreadPool(thread_num)
 
+    def program_cache_hit(self):
+        if self.program_cache_dir is None:
+            return False
+        return osp.exists(osp.join(self.program_cache_dir, '.success'))
+
+    def save_program_cache(self):
+        """ 保存经过计算图优化的模型及解析后的预处理流程，供下次启动时直接加载
+        """
+        if not hasattr(self.predictor, 'SaveOptimModel'):
+            logging.warning(
+                "Current paddle version does not support saving the optimized model, skip program cache."
+            )
+            return
+        # 先写入临时目录再重命名，避免多进程同时启动时读到不完整的缓存
+        tmp_dir = "{}.tmp{}".format(self.program_cache_dir, os.getpid())
+        if osp.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        self.predictor.SaveOptimModel(tmp_dir)
+        with open(osp.join(tmp_dir, 'info.pkl'), 'wb') as f:
+            pickle.dump((self.info, self.transforms), f)
+        open(osp.join(tmp_dir, '.success'), 'w').close()
+        try:
+            os.rename(tmp_dir, self.program_cache_dir)
+        except OSError:
+            # 其他进程已完成缓存的保存
+            shutil.rmtree(tmp_dir)
+            return
+        logging.info("Optimized program cached in {}.".format(
+            self.program_cache_dir))
+
     def create_predictor(self,
                          use_gpu=True,
                          gpu_id=0,
@@ -104,10 +206,18 @@ class Predictor:
                          use_trt=False,
                          use_glog=False,
                          memory_optimize=True,
-                         max_trt_batch_size=1):
-        config = fluid.core.AnalysisConfig(
-            os.path.join(self.model_dir, '__model__'),
-            os.path.join(self.model_dir, '__params__'))
+                         max_trt_batch_size=1,
+                         optim_cache_dir=None):
+        model_file = osp.join(self.model_dir, '__model__')
+        params_file = osp.join(self.model_dir, '__params__')
+        ir_optim = True
+        if getattr(self, 'program_cache_dir', None) is not None and \
+                self.program_cache_hit():
+            # 缓存中的模型已经过计算图优化，无需再次优化
+            model_file = osp.join(self.program_cache_dir, 'model')
+            params_file = osp.join(self.program_cache_dir, 'params')
+            ir_optim = False
+        config = fluid.core.AnalysisConfig(model_file, params_file)
 
         if use_gpu:
             # 设置GPU初始显存(单位M)和Device ID
@@ -118,7 +228,7 @@ class Predictor:
                     max_batch_size=max_trt_batch_size,
                     min_subgraph_size=3,
                     precision_mode=fluid.core.AnalysisConfig.Precision.Float32,
-                    use_static=False,
+                    use_static=optim_cache_dir is not None,
                     use_calib_mode=False)
         else:
             config.disable_gpu()
@@ -136,9 +246,14 @@ class Predictor:
             config.disable_glog_info()
         if memory_optimize:
             config.enable_memory_optim()
+        if optim_cache_dir is not None:
+            # 序列化保存优化后的引擎，避免每次启动时重新构建
+            if not osp.isdir(optim_cache_dir):
+                os.makedirs(optim_cache_dir)
+            config.set_optim_cache_dir(optim_cache_dir)
 
         # 开启计算图分析优化，包括OP融合等
-        config.switch_ir_optim(True)
+        config.switch_ir_optim(ir_optim)
         # 关闭feed和fetch OP使用，使用ZeroCopy接口必须设置此项
         config.switch_use_feed_fetch_ops(False)
         predictor = fluid.core.create_paddle_predictor(config)
@@ -153,7 +268,7 @@ class Predictor:
         """
         res = dict()
         if self.model_type == "classifier":
-            im = BaseClassifier._preprocess(
+            im = self.processor._preprocess(
                 image,
                 self.transforms,
                 self.model_type,
@@ -162,7 +277,7 @@ class Predictor:
             res['image'] = im
         elif self.model_type == "detector":
             if self.model_name in ["PPYOLO", "YOLOv3"]:
-                im, im_size = PPYOLO._preprocess(
+                im, im_size = self.processor._preprocess(
                     image,
                     self.transforms,
                     self.model_type,
@@ -172,7 +287,7 @@ class Predictor:
                 res['image'] = im
                 res['im_size'] = im_size
             if self.model_name.count('RCNN') > 0:
-                im, im_resize_info, im_shape = FasterRCNN._preprocess(
+                im, im_resize_info, im_shape = self.processor._preprocess(
                     image,
                     self.transforms,
                     self.model_type,
@@ -183,7 +298,7 @@ class Predictor:
                 res['im_info'] = im_resize_info
                 res['im_shape'] = im_shape
         elif self.model_type == "segmenter":
-            im, im_info = DeepLabv3p._preprocess(
+            im, im_info = self.processor._preprocess(
                 image,
                 self.transforms,
                 self.model_type,
@@ -219,27 +334,27 @@ class Predictor:
 
         if self.model_type == "classifier":
             true_topk = min(self.num_classes, topk)
-            preds = BaseClassifier._postprocess([results[0][0]], true_topk,
+            preds = self.processor._postprocess([results[0][0]], true_topk,
                                                 self.labels)
         elif self.model_type == "detector":
             res = {'bbox': (results[0][0], offset_to_lengths(results[0][1])), }
             res['im_id'] = (np.array(
                 [[i] for i in range(batch_size)]).astype('int32'), [[]])
             if self.model_name in ["PPYOLO", "YOLOv3"]:
-                preds = PPYOLO._postprocess(res, batch_size, self.num_classes,
-                                            self.labels)
+                preds = self.processor._postprocess(
+                    res, batch_size, self.num_classes, self.labels)
             elif self.model_name == "FasterRCNN":
-                preds = FasterRCNN._postprocess(res, batch_size,
-                                                self.num_classes, self.labels)
+                preds = self.processor._postprocess(
+                    res, batch_size, self.num_classes, self.labels)
             elif self.model_name == "MaskRCNN":
                 res['mask'] = (results[1][0], offset_to_lengths(results[1][1]))
                 res['im_shape'] = (im_shape, [])
-                preds = MaskRCNN._postprocess(
+                preds = self.processor._postprocess(
                     res, batch_size, self.num_classes,
                     self.mask_head_resolution, self.labels)
         elif self.model_type == "segmenter":
             res = [results[0][0], results[1][0]]
-            preds = DeepLabv3p._postprocess(res, im_info)
+            preds = self.processor._postprocess(res, im_info)
         return preds
 
     def raw_predict(self, inputs):
@@ -315,3 +430,70 @@ class Predictor:
             im_info=im_info)
 
         return results
+
+    def get_warmup_shapes(self, image_sizes=None):
+        """ 根据model.yml中的预处理流程，获取模型可能接收的不同输入shape
+
+            Args:
+                image_sizes(list|tuple): 原始图像大小列表，每个元素为[h, w]。
+                    默认为None，表示使用常见的图像分辨率。
+
+            Returns:
+                list: 每个元素为(input_shape, [h, w])，input_shape为预处理后输入网络
+                    的图像shape，[h, w]为产生该shape的原始图像大小。
+        """
+        if image_sizes is None:
+            image_sizes = WARMUP_IMAGE_SIZES
+        shapes = OrderedDict()
+        for h, w in image_sizes:
+            im = np.zeros((h, w, self.input_channel), dtype='uint8')
+            preprocessed_input = self.preprocess([im])
+            input_shape = tuple(preprocessed_input['image'].shape[1:])
+            if input_shape not in shapes:
+                shapes[input_shape] = [h, w]
+        return list(shapes.items())
+
+    def warmup(self, images=None, image_sizes=None, batch_size=1, repeats=1):
+        """ 对模型进行预热，使每种输入shape都提前完成计算图优化与显存分配，
+            避免线上首次预测时出现耗时抖动
+
+            Args:
+                images(list|tuple): 样例图像列表，元素可以是图像路径或解码后的
+                    (H，W，C)数组。设置后将以样例图像预处理后的不同shape进行预热。
+                image_sizes(list|tuple): 原始图像大小列表，每个元素为[h, w]，
+                    仅在images为None时生效，默认使用常见的图像分辨率。
+                batch_size(int): 预热时每次预测的图像数量，默认为1。
+                repeats(int): 每种shape的预热次数，默认为1。
+
+            Returns:
+                list: 每个元素为dict，包含预热的输入shape（'shape'）及
+                    首次预测耗时（'first_cost'，单位s）。
+        """
+        if images is not None:
+            samples = OrderedDict()
+            for image in images:
+                preprocessed_input = self.preprocess([image])
+                input_shape = tuple(preprocessed_input['image'].shape[1:])
+                if input_shape not in samples:
+                    samples[input_shape] = image
+        else:
+            samples = OrderedDict()
+            for input_shape, (h, w) in self.get_warmup_shapes(image_sizes):
+                samples[input_shape] = np.zeros(
+                    (h, w, self.input_channel), dtype='uint8')
+        records = list()
+        for input_shape, image in samples.items():
+            preprocessed_input = self.preprocess([image] * batch_size)
+            first_cost = None
+            for i in range(repeats):
+                start_time = time.time()
+                self.raw_predict(preprocessed_input)
+                if first_cost is None:
+                    first_cost = time.time() - start_time
+            records.append({
+                'shape': list(input_shape),
+                'first_cost': first_cost
+            })
+            logging.info("Warmup with input shape {}, cost {:.3f}s.".format(
+                list(input_shape), first_cost))
+        return records
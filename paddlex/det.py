@@ -16,6 +16,16 @@ from __future__ import absolute_import
 from . import cv
 from . import tools
 
+try:
+    import pycocotools
+except:
+    print(
+        "[WARNING] pycocotools is not installed, detection model is not available now."
+    )
+    print(
+        "[WARNING] pycocotools install: https://paddlex.readthedocs.io/zh_CN/develop/install.html#pycocotools"
+    )
+
 FasterRCNN = cv.models.FasterRCNN
 YOLOv3 = cv.models.YOLOv3
 PPYOLO = cv.models.PPYOLO
@@ -18,6 +18,9 @@ from . import utils
 from . import save
 from .utils import seconds_to_hms
 from .utils import path_normalization
+from .stats import StepTimer
+from .stats import get_queue_size
+from .checkpoint_writer import CheckpointWriter
 from .download import download
 from .download import decompress
 from .download import download_and_decompress
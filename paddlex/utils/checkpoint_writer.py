@@ -0,0 +1,179 @@
+# copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import os.path as osp
+import re
+import shutil
+import threading
+import queue
+import paddlex.utils.logging as logging
+
+
+def _replace_dir(src_dir, save_dir):
+    # 替换已有目录时先将其重命名，写入完成前save_dir中始终是完整的模型
+    if osp.isdir(save_dir):
+        old_dir = save_dir + '.old'
+        if osp.exists(old_dir):
+            shutil.rmtree(old_dir)
+        os.rename(save_dir, old_dir)
+        os.rename(src_dir, save_dir)
+        shutil.rmtree(old_dir)
+    else:
+        if osp.exists(save_dir):
+            os.remove(save_dir)
+        os.rename(src_dir, save_dir)
+
+
+def _new_tmp_dir(save_dir):
+    tmp_dir = save_dir + '.tmp'
+    if osp.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    return tmp_dir
+
+
+def write_checkpoint(save_dir, files, atomic=True):
+    """保存模型文件并写入`.success`标志。
+
+    Args:
+        save_dir (str): 模型保存路径。
+        files (list): 由文件名和写文件的函数组成的列表，函数的参数为文件路径。
+        atomic (bool): 是否先写入临时目录再重命名为save_dir，此时save_dir中原有的文件
+            会被整体替换。为False时直接写入save_dir。默认为True。
+    """
+    parent_dir = osp.dirname(osp.abspath(save_dir))
+    if not osp.isdir(parent_dir):
+        os.makedirs(parent_dir)
+    if atomic:
+        write_dir = _new_tmp_dir(save_dir)
+    else:
+        if not osp.isdir(save_dir):
+            if osp.exists(save_dir):
+                os.remove(save_dir)
+            os.makedirs(save_dir)
+        write_dir = save_dir
+    for name, write_func in files:
+        write_func(osp.join(write_dir, name))
+    # 模型保存成功的标志
+    open(osp.join(write_dir, '.success'), 'w').close()
+    if atomic:
+        _replace_dir(write_dir, save_dir)
+    logging.info("Model saved in {}.".format(save_dir))
+
+
+def link_checkpoint(src_dir, save_dir):
+    """以硬链接的方式将已保存的模型src_dir复制到save_dir，不支持硬链接时复制文件。
+    """
+    tmp_dir = _new_tmp_dir(save_dir)
+    for name in os.listdir(src_dir):
+        src = osp.join(src_dir, name)
+        if not osp.isfile(src):
+            continue
+        try:
+            os.link(src, osp.join(tmp_dir, name))
+        except OSError:
+            shutil.copy2(src, osp.join(tmp_dir, name))
+    _replace_dir(tmp_dir, save_dir)
+    logging.info("Model saved in {}.".format(save_dir))
+
+
+def remove_old_checkpoints(save_dir, keep_checkpoint_max, current_epoch=None):
+    """只保留save_dir下轮数最大的keep_checkpoint_max个`epoch_N`目录。给定current_epoch时，
+       轮数大于current_epoch的目录来自上次更长的训练，既不计入保留数也不删除，
+       current_epoch对应的目录总是保留。
+    """
+    epochs = list()
+    for name in os.listdir(save_dir):
+        match = re.match(r'^epoch_(\d+)$', name)
+        if match and osp.isdir(osp.join(save_dir, name)):
+            epochs.append(int(match.group(1)))
+    if current_epoch is not None:
+        epochs = [epoch for epoch in epochs if epoch <= current_epoch]
+    if keep_checkpoint_max > 0:
+        epochs = sorted(epochs)[:-keep_checkpoint_max]
+    for epoch in epochs:
+        shutil.rmtree(
+            osp.join(save_dir, 'epoch_{}'.format(epoch)), ignore_errors=True)
+
+
+class CheckpointWriter(object):
+    """在后台线程中按提交顺序保存模型，训练线程只需将参数复制到内存。
+
+    Args:
+        keep_checkpoint_max (int): 保存`epoch_N`后，只保留轮数最大的keep_checkpoint_max个
+            `epoch_N`目录。为None时全部保留。默认为None。
+        max_pending (int): 等待写入的模型数上限，超过时提交阻塞，以限制内存中模型的数量。默认为1。
+    """
+
+    def __init__(self, keep_checkpoint_max=None, max_pending=1):
+        if keep_checkpoint_max is not None and keep_checkpoint_max < 1:
+            raise Exception("keep_checkpoint_max should be at least 1.")
+        self.keep_checkpoint_max = keep_checkpoint_max
+        self.tasks = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            task = self.tasks.get()
+            try:
+                if task is None:
+                    break
+                if self.error is None:
+                    task()
+            except Exception as e:
+                self.error = e
+                logging.warning("Failed to save the model: {}".format(e))
+            finally:
+                self.tasks.task_done()
+
+    def _submit(self, task):
+        if self.error is not None:
+            raise self.error
+        self.tasks.put(task)
+
+    def save(self, save_dir, files):
+        """提交保存任务。
+
+        Args:
+            save_dir (str): 模型保存路径，目录名为`epoch_N`时按keep_checkpoint_max清理旧模型。
+            files (list): 由文件名和写文件的函数组成的列表，函数的参数为文件路径。
+        """
+
+        def task():
+            write_checkpoint(save_dir, files)
+            match = re.match(r'^epoch_(\d+)$',
+                             osp.basename(osp.normpath(save_dir)))
+            if self.keep_checkpoint_max is not None and match:
+                remove_old_checkpoints(
+                    osp.dirname(osp.abspath(save_dir)),
+                    self.keep_checkpoint_max, int(match.group(1)))
+
+        self._submit(task)
+
+    def link(self, src_dir, save_dir):
+        """提交任务，在src_dir保存完成后将其链接至save_dir，用于最优模型与当前轮模型相同时。
+        """
+        self._submit(lambda: link_checkpoint(src_dir, save_dir))
+
+    def close(self):
+        """等待所有任务完成并结束后台线程。
+        """
+        self.tasks.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
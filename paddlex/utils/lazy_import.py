@@ -0,0 +1,50 @@
+# copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import importlib
+
+
+def lazy_getattr(module_name, lazy_attrs):
+    """ 生成模块级的__getattr__函数，在属性首次被访问时才导入对应的子模块
+
+        Args:
+            module_name (str): 所属模块名，一般为__name__。
+            lazy_attrs (dict): 属性名到(子模块相对路径, 子模块中的属性名)的映射，
+                子模块中的属性名为None时表示属性即为子模块本身。
+    """
+
+    def __getattr__(name):
+        if name not in lazy_attrs:
+            raise AttributeError("module '{}' has no attribute '{}'".format(
+                module_name, name))
+        submodule_name, attr_name = lazy_attrs[name]
+        submodule = importlib.import_module(submodule_name, module_name)
+        if attr_name is None:
+            value = submodule
+        else:
+            value = getattr(submodule, attr_name)
+        # 缓存至模块中，再次访问时不再经过__getattr__
+        setattr(sys.modules[module_name], name, value)
+        return value
+
+    return __getattr__
+
+
+def import_all(module_name, lazy_attrs):
+    """ 立即导入所有延迟加载的属性，用于不支持模块级__getattr__的Python版本(<3.7)
+    """
+    getter = lazy_getattr(module_name, lazy_attrs)
+    for name in lazy_attrs:
+        getter(name)
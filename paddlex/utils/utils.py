@@ -21,6 +21,7 @@ import six
 import yaml
 import math
 import platform
+import multiprocessing as mp
 from . import logging
 
 
@@ -51,6 +52,29 @@ def get_environ_info():
     return info
 
 
+def get_default_num_workers():
+    """计算密集任务默认使用的进程数。Windows及MacOS下子进程以spawn方式启动，
+       会重新导入用户的主程序，因此默认不创建子进程，与数据读取强制使用线程的处理一致。
+    """
+    if platform.system() in ["Windows", "Darwin"]:
+        return 0
+    return min(8, mp.cpu_count())
+
+
+SPAWN_MAIN_GUARD_HINT = "Worker processes are started with spawn, which imports the main script again in each process, so the code of the main script must be put under `if __name__ == '__main__':`."
+
+
+def check_spawn_main_guard(name):
+    """以spawn方式启动的子进程会重新导入用户的主程序，主程序未使用
+       if __name__ == '__main__' 保护入口时，子进程会再次执行到name处并尝试创建子进程，
+       此时给出明确的报错。
+    """
+    if getattr(mp.current_process(), '_inheriting', False):
+        raise Exception(
+            "{} is called while a spawned worker process imports the main script. {}".
+            format(name, SPAWN_MAIN_GUARD_HINT))
+
+
 def path_normalization(path):
     win_sep = "\\"
     other_sep = "/"
@@ -0,0 +1,70 @@
+# copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import importlib.util
+import numpy as np
+
+
+def build_predictor(model_type, model_name, num_classes, labels):
+    """构造仅包含后处理所需属性的Predictor，不加载模型文件。
+    """
+    from paddlex.deploy import Predictor, get_model_processor
+    predictor = Predictor.__new__(Predictor)
+    predictor.model_type = model_type
+    predictor.model_name = model_name
+    predictor.num_classes = num_classes
+    predictor.labels = labels
+    predictor.processor = get_model_processor(model_type, model_name)
+    return predictor
+
+
+@unittest.skipIf(
+    importlib.util.find_spec('paddle') is None, "paddle is not installed")
+class TestPredictorPostprocess(unittest.TestCase):
+    def test_get_model_processor(self):
+        from paddlex.deploy import get_model_processor
+        from paddlex.cv.models import BaseClassifier, PPYOLO, FasterRCNN, \
+            MaskRCNN, DeepLabv3p
+        cases = [('classifier', 'ResNet50', BaseClassifier),
+                 ('detector', 'YOLOv3', PPYOLO),
+                 ('detector', 'PPYOLO', PPYOLO),
+                 ('detector', 'FasterRCNN', FasterRCNN),
+                 ('detector', 'MaskRCNN', MaskRCNN),
+                 ('segmenter', 'UNet', DeepLabv3p)]
+        for model_type, model_name, expected in cases:
+            self.assertIs(
+                get_model_processor(model_type, model_name), expected)
+
+    def test_classifier_postprocess(self):
+        labels = ['cat', 'dog', 'bird']
+        predictor = build_predictor('classifier', 'ResNet50', 3, labels)
+        scores = np.array(
+            [[0.1, 0.7, 0.2], [0.5, 0.2, 0.3]], dtype='float32')
+        preds = predictor.postprocess([[scores]], topk=2, batch_size=2)
+        self.assertEqual(len(preds), 2)
+        self.assertEqual([p['category'] for p in preds[0]], ['dog', 'bird'])
+        self.assertEqual([p['category_id'] for p in preds[1]], [0, 2])
+        self.assertAlmostEqual(float(preds[0][0]['score']), 0.7, places=5)
+
+    def test_classifier_postprocess_topk_exceeds_num_classes(self):
+        labels = ['cat', 'dog']
+        predictor = build_predictor('classifier', 'MobileNetV2', 2, labels)
+        scores = np.array([[0.3, 0.7]], dtype='float32')
+        preds = predictor.postprocess([[scores]], topk=5, batch_size=1)
+        self.assertEqual([p['category'] for p in preds[0]], ['dog', 'cat'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import os.path as osp
+import sys
+import json
+import unittest
+import importlib.util
+import subprocess
+
+ROOT_DIR = osp.dirname(osp.dirname(osp.abspath(__file__)))
+
+# 在已导入paddle的基础上，导入paddlex自身允许的额外耗时(秒)
+IMPORT_PADDLEX_BUDGET = 1.0
+IMPORT_DEPLOY_BUDGET = 2.0
+
+# 仅训练、评估使用的模块及依赖，部署时不应被加载
+TRAINING_ONLY_MODULES = [
+    'paddlex.cv.models', 'paddlex.cv.datasets', 'paddlex.cv.nets',
+    'paddlex.slim', 'paddlex.interpret', 'paddlex.tools', 'paddlex.converter',
+    'pycocotools', 'matplotlib', 'paddleslim', 'visualdl', 'paddlehub'
+]
+
+_PROBE = """
+import sys
+import json
+import time
+import paddle
+before = set(sys.modules)
+start = time.time()
+import {module}
+elapsed = time.time() - start
+print(json.dumps({{
+    'elapsed': elapsed,
+    'modules': sorted(set(sys.modules) - before)
+}}))
+"""
+
+
+def import_module_in_subprocess(module):
+    """在新的解释器中导入模块，返回导入耗时及新加载的模块列表。
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+    out = subprocess.check_output(
+        [sys.executable, '-c', _PROBE.format(module=module)],
+        cwd=ROOT_DIR,
+        env=env)
+    return json.loads(out.decode().strip().split('\n')[-1])
+
+
+def find_loaded(modules, names):
+    return [
+        m for m in modules
+        if any(m == name or m.startswith(name + '.') for name in names)
+    ]
+
+
+@unittest.skipIf(
+    importlib.util.find_spec('paddle') is None, "paddle is not installed")
+class TestImportTime(unittest.TestCase):
+    def test_import_paddlex(self):
+        result = import_module_in_subprocess('paddlex')
+        loaded = find_loaded(result['modules'],
+                             TRAINING_ONLY_MODULES + ['paddlex.cv'])
+        self.assertEqual(loaded, [])
+        self.assertLess(result['elapsed'], IMPORT_PADDLEX_BUDGET)
+
+    def test_import_paddlex_deploy(self):
+        result = import_module_in_subprocess('paddlex.deploy')
+        loaded = find_loaded(result['modules'], TRAINING_ONLY_MODULES)
+        self.assertEqual(loaded, [])
+        self.assertLess(result['elapsed'], IMPORT_DEPLOY_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+# copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import unittest
+import importlib.util
+import numpy as np
+
+# 采样直方图重采样后的阈值与参考实现的最大相对误差，适用于样本充足的激活值
+RESAMPLED_RTOL = 0.02
+
+
+def _expand_quantized_bins(quantized_bins, reference_bins):
+    expanded_quantized_bins = [0] * len(reference_bins)
+    num_merged_bins = int(len(reference_bins) / len(quantized_bins))
+    j_start = 0
+    j_end = num_merged_bins
+    for idx in range(len(quantized_bins)):
+        zero_count = reference_bins[j_start:j_end].count(0)
+        num_merged_bins = j_end - j_start
+        if zero_count == num_merged_bins:
+            avg_bin_ele = 0
+        else:
+            avg_bin_ele = quantized_bins[idx] / (
+                num_merged_bins - zero_count + 0.0)
+        for idx1 in range(j_start, j_end):
+            expanded_quantized_bins[idx1] = (0 if reference_bins[idx1] == 0
+                                             else avg_bin_ele)
+        j_start += num_merged_bins
+        j_end += num_merged_bins
+        if (idx + 1) == len(quantized_bins) - 1:
+            j_end = len(reference_bins)
+    return expanded_quantized_bins
+
+
+def _safe_entropy(reference_distr_P, P_sum, candidate_distr_Q, Q_sum):
+    assert len(reference_distr_P) == len(candidate_distr_Q)
+    tmp_sum1 = 0
+    tmp_sum2 = 0
+    for idx in range(len(reference_distr_P)):
+        p_idx = reference_distr_P[idx]
+        q_idx = candidate_distr_Q[idx]
+        if p_idx == 0:
+            tmp_sum1 += 0
+            tmp_sum2 += 0
+        else:
+            tmp_sum1 += p_idx * (math.log(Q_sum * p_idx))
+            tmp_sum2 += p_idx * (math.log(P_sum * q_idx))
+    return (tmp_sum1 - tmp_sum2) / P_sum
+
+
+def reference_kl_scaling_factor(activation_blob, num_quantized_bins=255):
+    """Paddle 1.8中PostTrainingQuantization._get_kl_scaling_factor的实现，
+       activation_blob为激活值的绝对值。
+    """
+    max_val = np.max(activation_blob)
+    min_val = np.min(activation_blob)
+    hist, hist_edeges = np.histogram(
+        activation_blob, bins=2048, range=(min_val, max_val))
+    ending_iter = 2047
+    starting_iter = int(ending_iter * 0.7)
+    bin_width = hist_edeges[1] - hist_edeges[0]
+
+    P_sum = len(np.array(activation_blob).ravel())
+    min_kl_divergence = 0
+    min_kl_index = 0
+    kl_inited = False
+    for i in range(starting_iter, ending_iter + 1):
+        reference_distr_P = hist[0:i].tolist()
+        outliers_count = sum(hist[i:2048])
+        if reference_distr_P[i - 1] == 0:
+            continue
+        reference_distr_P[i - 1] += outliers_count
+        reference_distr_bins = reference_distr_P[:]
+        candidate_distr_Q = hist[0:i].tolist()
+        num_merged_bins = int(i / num_quantized_bins)
+        candidate_distr_Q_quantized = [0] * num_quantized_bins
+        j_start = 0
+        j_end = num_merged_bins
+        for idx in range(num_quantized_bins):
+            candidate_distr_Q_quantized[idx] = sum(candidate_distr_Q[j_start:
+                                                                     j_end])
+            j_start += num_merged_bins
+            j_end += num_merged_bins
+            if (idx + 1) == num_quantized_bins - 1:
+                j_end = i
+        candidate_distr_Q = _expand_quantized_bins(candidate_distr_Q_quantized,
+                                                   reference_distr_bins)
+        Q_sum = sum(candidate_distr_Q)
+        kl_divergence = _safe_entropy(reference_distr_P, P_sum,
+                                      candidate_distr_Q, Q_sum)
+        if not kl_inited:
+            min_kl_divergence = kl_divergence
+            min_kl_index = i
+            kl_inited = True
+        elif kl_divergence < min_kl_divergence:
+            min_kl_divergence = kl_divergence
+            min_kl_index = i
+        else:
+            pass
+    if min_kl_index == 0:
+        while starting_iter > 0:
+            if hist[starting_iter] == 0:
+                starting_iter -= 1
+                continue
+            else:
+                break
+        min_kl_index = starting_iter
+    return (min_kl_index + 0.5) * bin_width
+
+
+def synthetic_activations(name, num_batches=8, batch_size=20000, seed=0):
+    """生成分批采样的合成激活值，包含0值以使参考实现的直方图同样从0开始。
+    """
+    rng = np.random.RandomState(seed)
+    batches = list()
+    for k in range(num_batches):
+        if name == 'relu':
+            data = np.maximum(rng.randn(batch_size), 0.)
+        elif name == 'normal':
+            data = rng.randn(batch_size)
+        elif name == 'laplace':
+            data = rng.laplace(size=batch_size)
+        elif name == 'heavy_tailed':
+            data = rng.standard_t(3, batch_size)
+        elif name == 'growing_range':
+            # 后续批次超出已有范围，直方图需合并已有的bins
+            data = np.maximum(rng.randn(batch_size) * (1 + k), 0.)
+        elif name == 'outliers':
+            data = np.concatenate(
+                [rng.randn(batch_size - 10), 50 * rng.rand(10)])
+        data[0] = 0.
+        batches.append(data.astype('float32'))
+    return batches
+
+
+@unittest.skipIf(
+    importlib.util.find_spec('paddle') is None, "paddle is not installed")
+class TestKLThreshold(unittest.TestCase):
+    cases = [
+        'relu', 'normal', 'laplace', 'heavy_tailed', 'growing_range',
+        'outliers'
+    ]
+
+    def test_same_histogram(self):
+        from paddlex.cv.models.slim.post_quantization import _get_kl_threshold
+        for name in self.cases:
+            data = np.abs(np.concatenate(synthetic_activations(name)))
+            hist, edges = np.histogram(
+                data, bins=2048, range=(0., float(np.max(data))))
+            threshold = _get_kl_threshold(hist, edges[1] - edges[0])
+            expected = reference_kl_scaling_factor(data)
+            self.assertAlmostEqual(
+                threshold, expected, delta=1e-6 * expected, msg=name)
+
+    def test_resampled_histogram(self):
+        from paddlex.cv.models.slim.post_quantization import _AbsHistogram, \
+            _get_kl_threshold
+        for name in self.cases:
+            batches = synthetic_activations(name)
+            histogram = _AbsHistogram(16384)
+            for data in batches:
+                histogram.update(data)
+            threshold = _get_kl_threshold(*histogram.get(2048))
+            expected = reference_kl_scaling_factor(
+                np.abs(np.concatenate(batches)))
+            self.assertLess(
+                abs(threshold - expected) / expected,
+                RESAMPLED_RTOL,
+                msg="{}: {} vs {}".format(name, threshold, expected))
+
+    def test_zero_activation(self):
+        from paddlex.cv.models.slim.post_quantization import _AbsHistogram, \
+            _get_kl_threshold
+        histogram = _AbsHistogram(16384)
+        histogram.update(np.zeros(100, dtype='float32'))
+        self.assertEqual(_get_kl_threshold(*histogram.get(2048)), 0.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# copyright (c) 2020 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os.path as osp
+import pickle
+import shutil
+import tempfile
+import unittest
+import importlib.util
+import cv2
+import numpy as np
+
+
+def build_imagenet_dataset(data_dir, num_samples=8, num_classes=2):
+    """在data_dir下生成随机图像组成的ImageNet格式数据集。
+    """
+    import paddlex as pdx
+    from paddlex.cls import transforms
+    labels = ['class_{}'.format(i) for i in range(num_classes)]
+    with open(osp.join(data_dir, 'labels.txt'), 'w') as f:
+        f.write('\n'.join(labels) + '\n')
+    with open(osp.join(data_dir, 'train_list.txt'), 'w') as f:
+        for i in range(num_samples):
+            im = np.random.randint(0, 255, (64, 64, 3), dtype='uint8')
+            cv2.imwrite(osp.join(data_dir, '{}.jpg'.format(i)), im)
+            f.write('{}.jpg {}\n'.format(i, i % num_classes))
+    train_transforms = transforms.Compose(
+        [transforms.ResizeByShort(short_size=32), transforms.Normalize()])
+    return pdx.datasets.ImageNet(
+        data_dir=data_dir,
+        file_list=osp.join(data_dir, 'train_list.txt'),
+        label_list=osp.join(data_dir, 'labels.txt'),
+        transforms=train_transforms,
+        num_workers=1,
+        parallel_method='thread')
+
+
+@unittest.skipIf(
+    importlib.util.find_spec('paddle') is None, "paddle is not installed")
+class TestTuneTrainConfig(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp(prefix='paddlex_test_tuner_')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def test_model_init_params(self):
+        import paddlex as pdx
+        from paddlex.cv.models.utils.tuner import _model_init_params
+        model = pdx.cls.ResNet18(num_classes=2)
+        init_params = pickle.loads(pickle.dumps(_model_init_params(model)))
+        self.assertEqual(init_params, {'num_classes': 2, 'input_channel': 3})
+        rebuilt = pdx.cls.ResNet18(**init_params)
+        self.assertEqual(rebuilt.num_classes, 2)
+        # 不修改原模型的init_params
+        self.assertIn('self', model.init_params)
+
+    def test_tune_train_config(self):
+        import paddlex as pdx
+        train_dataset = build_imagenet_dataset(self.data_dir)
+        model = pdx.cls.ResNet18(num_classes=2)
+        report_file = osp.join(self.data_dir, 'tune.json')
+        result = pdx.tune_train_config(
+            model,
+            train_dataset,
+            batch_sizes=[2],
+            num_workers=[1],
+            buffer_sizes=[4],
+            parallel_methods=['thread'],
+            num_steps=2,
+            train_kwargs={'learning_rate': 0.001},
+            trial_timeout=600,
+            report_file=report_file)
+        for trial in result['trials']:
+            self.assertEqual(trial['status'], 'ok', trial.get('error'))
+        self.assertEqual(result['batch_size'], 2)
+        self.assertEqual(result['num_workers'], 1)
+        self.assertEqual(result['parallel_method'], 'thread')
+        self.assertGreater(result['ips'], 0)
+        self.assertIn(result['bound'], ['reader', 'compute'])
+        self.assertTrue(osp.exists(report_file))
+
+
+if __name__ == '__main__':
+    unittest.main()